@@ -0,0 +1,206 @@
+"""
+Async Yoto API client for ASGI deployments.
+
+Mirrors YotoAPIClient, but performs upstream calls with httpx so an event
+loop can hold many in-flight requests at once. All instances running on the
+same event loop share one httpx.AsyncClient connection pool.
+"""
+import asyncio
+import logging
+import weakref
+from typing import Any, Dict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import coalesce, identity, metrics, resilience
+from .tokens import token_manager
+from .yoto_client import VALIDATOR_HEADERS, YotoAPIClient
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+_pools: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]' = weakref.WeakKeyDictionary()
+
+
+def get_async_pool() -> 'httpx.AsyncClient':
+    """Return the shared httpx.AsyncClient for the running event loop."""
+    if httpx is None:
+        raise ImproperlyConfigured("httpx must be installed to use the async Yoto API client")
+
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None or pool.is_closed:
+        pool = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                settings.YOTO_HTTP_READ_TIMEOUT,
+                connect=settings.YOTO_HTTP_CONNECT_TIMEOUT,
+            ),
+            # Limits go on the transport: httpx ignores the client's when given one
+            transport=httpx.AsyncHTTPTransport(
+                retries=settings.YOTO_HTTP_MAX_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=settings.YOTO_HTTP_ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.YOTO_HTTP_POOL_SIZE,
+                ),
+            ),
+        )
+        _pools[loop] = pool
+    return pool
+
+
+async def open_stream(method: str, url: str, headers: Dict[str, str]) -> 'httpx.Response':
+    """Send a request on the shared pool without reading its body (read it with aiter_raw(), then aclose())."""
+    pool = get_async_pool()
+    return await pool.send(pool.build_request(method, url, headers=headers), stream=True)
+
+
+async def close_async_pool():
+    """Close the shared pool for the running event loop (e.g. on shutdown)."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.aclose()
+
+
+class AsyncYotoAPIClient(YotoAPIClient):
+    """Non-blocking variant of YotoAPIClient; every API method is a coroutine."""
+
+    async def authenticate(self) -> bool:
+        """
+        Authenticate with the Yoto API using refresh token.
+        Returns True if authentication is successful.
+
+        Runs the shared token manager in a worker thread, so refreshes stay
+        single-flight across sync and async requests for the same account.
+        """
+        if not self.client_id or not self.client_secret:
+            raise ValueError("YOTO_CLIENT_ID and YOTO_CLIENT_SECRET must be set in environment variables")
+
+        state = await sync_to_async(token_manager.refresh, thread_sensitive=False)(
+            self.refresh_token, self.client_id, self.client_secret, stale_token=self.access_token
+        )
+        if state is None:
+            return False
+        self._apply_token(state)
+        return True
+
+    async def _ensure_authenticated(self):
+        """Ensure we have a valid access token."""
+        if not self.access_token:
+            raise Exception("No access token available")
+
+        self._adopt_managed_token()
+        if self._is_token_expired() and self._can_refresh():
+            if not await self.authenticate():
+                raise Exception("Failed to authenticate with Yoto API")
+
+    async def _send(self, pool, method: str, url: str, headers: Dict[str, str], **kwargs):
+        """One upstream call through the host's breaker and rate limiter, timed as 'upstream'."""
+        guard = resilience.guard_for(url)
+        try:
+            wait = guard.acquire()
+        except resilience.UpstreamUnavailable:
+            metrics.upstream_rejected.inc(host=guard.host)
+            raise
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            with metrics.timed('upstream'):
+                response = await pool.request(method, url, headers=headers, **kwargs)
+        except BaseException:
+            # Transport errors, but also anything unexpected (cancellation
+            # included): a half-open probe must always be released
+            guard.record_error()
+            raise
+        guard.record(response.status_code, response.headers.get('Retry-After'))
+        metrics.upstream_responses.inc(status=response.status_code)
+        metrics.upstream_bytes.inc(len(response.content))
+        return response
+
+    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict[Any, Any]:
+        """
+        Make an authenticated request to the Yoto API.
+
+        Accepts the same arguments as httpx.AsyncClient.request() and
+        returns the decoded JSON body.
+        """
+        await self._ensure_authenticated()
+
+        url = f"{self.base_url}{endpoint}"
+        headers = kwargs.pop('headers', {})
+        headers['Authorization'] = f'Bearer {self.access_token}'
+        pool = get_async_pool()
+
+        try:
+            response = await self._send(pool, method, url, headers, **kwargs)
+
+            # Same 403 handling as the sync client: refresh once and retry
+            if response.status_code == 403 and self._can_refresh():
+                logger.info("Got 403 for %s %s, refreshing token and retrying", method, endpoint)
+                if await self.authenticate():
+                    headers['Authorization'] = f'Bearer {self.access_token}'
+                    response = await self._send(pool, method, url, headers, **kwargs)
+
+            response.raise_for_status()
+            identity.vouch(self.access_token)
+            self.last_validators = {h: response.headers[h] for h in VALIDATOR_HEADERS if h in response.headers}
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.warning("API request %s %s failed: %s: %s", method, endpoint, type(e).__name__, e)
+            raise
+
+    async def get(self, endpoint: str, **kwargs) -> Dict[Any, Any]:
+        """Make a GET request to the Yoto API, joining identical ones in flight."""
+        if not settings.YOTO_COALESCE_GETS or 'headers' in kwargs:
+            return await self._make_request('GET', endpoint, **kwargs)
+
+        async def call():
+            return await self._make_request('GET', endpoint, **kwargs), self.last_validators
+        key = coalesce.key_for(self, endpoint, kwargs.get('params'))
+        return coalesce.shared(await coalesce.coalescer.arun(key, call), self)
+
+    async def post(self, endpoint: str, **kwargs) -> Dict[Any, Any]:
+        """Make a POST request to the Yoto API."""
+        return await self._make_request('POST', endpoint, **kwargs)
+
+    async def put(self, endpoint: str, **kwargs) -> Dict[Any, Any]:
+        """Make a PUT request to the Yoto API."""
+        return await self._make_request('PUT', endpoint, **kwargs)
+
+    async def delete(self, endpoint: str, **kwargs) -> Dict[Any, Any]:
+        """Make a DELETE request to the Yoto API."""
+        return await self._make_request('DELETE', endpoint, **kwargs)
+
+    async def get_family(self) -> Dict[Any, Any]:
+        """Get family information."""
+        return await self.get('/family')
+
+    async def get_players(self) -> list:
+        """Get all devices (players) in the family."""
+        response = await self.get('/device-v2/devices/mine')
+        devices = response.get('devices', [])
+        return devices if isinstance(devices, list) else []
+
+    async def get_player(self, player_id: str) -> Dict[Any, Any]:
+        """Get specific device (player) information."""
+        return await self.get(f'/devices/{player_id}')
+
+    async def get_library(self) -> list:
+        """Get user's MYO content library."""
+        response = await self.get('/content/mine')
+        cards = response.get('cards', [])
+        return cards if isinstance(cards, list) else []
+
+    async def get_card(self, card_id: str, playable: bool = True) -> dict:
+        """Get detailed card information including chapters."""
+        params = {}
+        if playable:
+            params['playable'] = 'true'
+            params['signingType'] = 's3'
+        return await self.get(f'/content/{card_id}', params=params)
@@ -0,0 +1,212 @@
+"""
+Async variants of the Yoto proxy views, for ASGI deployments.
+
+Routed in place of the sync views when YOTO_ASYNC_VIEWS is enabled; each
+view awaits the upstream call instead of holding a worker thread.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import cache, library_sync, media_store, metrics
+from .async_client import AsyncYotoAPIClient
+from .resilience import UpstreamUnavailable
+from .responses import api_response
+from .views import (create_response_with_tokens, get_client_from_request, library_page, parse_bootstrap_sections,
+                    parse_card_batch, parse_library_query, section_result, unavailable_response,
+                    wants_playable, wants_refresh)
+
+logger = logging.getLogger(__name__)
+
+
+def _missing_token_response():
+    return JsonResponse({
+        'status': 'error',
+        'message': 'No access token provided'
+    }, status=401)
+
+
+def _error_response(e):
+    return JsonResponse({
+        'status': 'error',
+        'message': str(e)
+    }, status=500)
+
+
+@require_http_methods(["GET"])
+async def get_family(request):
+    """Get family information from Yoto API."""
+    try:
+        client = get_client_from_request(request, AsyncYotoAPIClient)
+        if not client.access_token:
+            return _missing_token_response()
+
+        family_data = await client.get_family()
+        return JsonResponse({
+            'status': 'success',
+            'data': family_data
+        })
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception("Error in async get_family view: %s", e)
+        return _error_response(e)
+
+
+@require_http_methods(["GET"])
+async def get_players(request):
+    """Get list of players from Yoto API."""
+    try:
+        client = get_client_from_request(request, AsyncYotoAPIClient)
+        if not client.access_token:
+            return _missing_token_response()
+
+        players = await cache.aget_players(client, refresh=wants_refresh(request))
+        return api_response(request, players, client)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception("Error in async get_players view: %s", e)
+        return _error_response(e)
+
+
+@require_http_methods(["GET"])
+async def get_library(request):
+    """Get library from Yoto API."""
+    try:
+        query, error_response = parse_library_query(request)
+        if error_response:
+            return error_response
+
+        client = get_client_from_request(request, AsyncYotoAPIClient)
+        if not client.access_token:
+            return _missing_token_response()
+
+        library = await cache.aget_library(client, refresh=wants_refresh(request))
+        if query is not None:
+            return library_page(request, client, library, query)
+        if media_store.is_enabled():
+            media_store.rewrite_library_media(library)
+        return api_response(request, library, client)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception("Error in async get_library view: %s", e)
+        return _error_response(e)
+
+
+@require_http_methods(["GET"])
+async def sync_library(request):
+    """Library changes since the ?since= sync token."""
+    try:
+        client = get_client_from_request(request, AsyncYotoAPIClient)
+        if not client.access_token:
+            return _missing_token_response()
+
+        changes = await library_sync.async_sync_library(client, request.GET.get('since'),
+                                                        refresh=wants_refresh(request))
+        if media_store.is_enabled():
+            media_store.rewrite_library_media(changes['added'] + changes['changed'])
+        return api_response(request, changes, client)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception("Error in async sync_library view: %s", e)
+        return _error_response(e)
+
+
+@require_http_methods(["GET"])
+async def get_card_detail(request, card_id):
+    """Get detailed card information including chapters."""
+    try:
+        client = get_client_from_request(request, AsyncYotoAPIClient)
+        if not client.access_token:
+            return _missing_token_response()
+
+        card = await cache.aget_card(client, card_id, playable=wants_playable(request.GET.get('playable')),
+                                     refresh=wants_refresh(request))
+        if media_store.is_enabled():
+            media_store.rewrite_card_media(card)
+        return api_response(request, card, client, include_token=True)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception("Error in async get_card_detail view: %s", e)
+        return _error_response(e)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def get_cards_batch(request):
+    """Get details for many cards at once, fetched upstream concurrently."""
+    card_ids, playable, error_response = parse_card_batch(request)
+    if error_response:
+        return error_response
+
+    client = get_client_from_request(request, AsyncYotoAPIClient)
+    if not client.access_token:
+        return _missing_token_response()
+
+    semaphore = asyncio.Semaphore(settings.YOTO_BATCH_MAX_WORKERS)
+
+    async def fetch(card_id):
+        async with semaphore:
+            try:
+                # Each card gets its own fork: clients hold per-call state
+                return card_id, await cache.aget_card(client.fork(), card_id, playable=playable), None
+            except Exception as e:
+                return card_id, None, str(e)
+
+    cards, errors = {}, {}
+    for card_id, card, error in await asyncio.gather(*map(fetch, card_ids)):
+        if error is None:
+            cards[card_id] = card
+        else:
+            errors[card_id] = error
+
+    if media_store.is_enabled():
+        for card in cards.values():
+            media_store.rewrite_card_media(card)
+    return create_response_with_tokens(client, {'cards': cards, 'errors': errors})
+
+
+@require_http_methods(["GET"])
+async def bootstrap(request):
+    """Players, library and family in one response, fetched upstream concurrently."""
+    sections, error_response = parse_bootstrap_sections(request)
+    if error_response:
+        return error_response
+
+    client = get_client_from_request(request, AsyncYotoAPIClient)
+    if not client.access_token:
+        return _missing_token_response()
+
+    refresh = wants_refresh(request)
+
+    async def library(c):
+        cards = await cache.aget_library(c, refresh=refresh)
+        if media_store.is_enabled():
+            media_store.rewrite_library_media(cards)
+        return cards
+
+    loaders = {
+        'players': lambda c: cache.aget_players(c, refresh=refresh),
+        'library': library,
+        'family': lambda c: c.get_family(),
+    }
+
+    async def load(name):
+        started = time.perf_counter()
+        try:
+            with metrics.timed(name):
+                return section_result(name, await loaders[name](client.fork()), started=started)
+        except Exception as e:
+            return section_result(name, error=e, started=started)
+
+    results = await asyncio.gather(*(load(name) for name in sections))
+    return create_response_with_tokens(client, dict(zip(sections, results)))
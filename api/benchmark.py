@@ -0,0 +1,78 @@
+"""
+Load generator for the proxy endpoints, used by `manage.py benchmark`.
+
+run_load() calls a request function from a pool of worker threads and
+records each call's latency and status; LoadResult summarises them as
+requests per second and latency percentiles.
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending list (0.0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+class LoadResult:
+    """Latencies (seconds) and status codes of one load run."""
+
+    def __init__(self, name: str, latencies: List[float], statuses: List[int], elapsed: float):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.statuses = statuses
+        self.elapsed = elapsed
+
+    @property
+    def errors(self) -> int:
+        return sum(1 for status in self.statuses if not 200 <= status < 400)
+
+    @property
+    def rps(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        ms = lambda seconds: round(seconds * 1000, 2)
+        return {
+            'endpoint': self.name,
+            'requests': len(self.latencies),
+            'errors': self.errors,
+            'rps': round(self.rps, 1),
+            'p50_ms': ms(percentile(self.latencies, 50)),
+            'p95_ms': ms(percentile(self.latencies, 95)),
+            'p99_ms': ms(percentile(self.latencies, 99)),
+            'max_ms': ms(self.latencies[-1]) if self.latencies else 0.0,
+        }
+
+
+def run_load(name: str, call: Callable[[int], int], requests: int, concurrency: int) -> LoadResult:
+    """
+    Run call(i) for i in range(requests) on concurrency threads.
+
+    call returns the HTTP status; an exception counts as status 0.
+    """
+    latencies: List[float] = []
+    statuses: List[int] = []
+    lock = threading.Lock()
+
+    def one(i: int):
+        start = time.perf_counter()
+        try:
+            status = call(i)
+        except Exception:
+            status = 0
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(one, range(requests)))
+    return LoadResult(name, latencies, statuses, time.perf_counter() - started)
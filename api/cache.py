@@ -0,0 +1,414 @@
+"""
+Server-side response cache for Yoto API reads.
+
+Sits in front of YotoAPIClient.get_library/get_card and stores decoded
+responses per account in a Django cache (see CACHES['yoto'] in settings),
+so the backend can be swapped between locmem, file or Redis. Entries
+outlive their TTL by YOTO_CACHE_STALE_TTL so they can stand in for the
+upstream while its circuit breaker is open, and, for the endpoints in
+YOTO_SWR_ENDPOINTS, be served immediately for YOTO_SWR_STALE_TTL seconds
+past their TTL while a bounded pool of background workers revalidates them
+(stale-while-revalidate).
+"""
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import identity, metrics, search
+from .resilience import UpstreamUnavailable
+from .yoto_client import YotoAPIClient
+
+logger = logging.getLogger(__name__)
+
+
+def account_key(client) -> str:
+    """
+    Stable, non-reversible identifier for the account behind a client.
+
+    The account id from the access token once the Yoto API has accepted that
+    token (it survives token refreshes), else a hash of the presented
+    credentials; see api.identity.
+    """
+    return identity.account_key(client)
+
+
+def _rekeyed(key: str, client) -> Optional[str]:
+    """key under the client's verified account, if that differs from the account in key."""
+    # Keys look like yoto:<account>:<endpoint>:...
+    parts = key.split(':')
+    account = identity.verified_account(client) if client is not None else None
+    if account is None or len(parts) < 3 or parts[1] == account:
+        return None
+    return ':'.join([parts[0], account] + parts[2:])
+
+
+def _signature_expiry(url: str) -> Optional[float]:
+    """Epoch time at which a presigned S3 URL stops working, if it is one."""
+    query = parse_qs(urlparse(url).query)
+    if 'X-Amz-Date' in query and 'X-Amz-Expires' in query:
+        try:
+            signed_at = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ')
+            signed_at = signed_at.replace(tzinfo=timezone.utc).timestamp()
+            return signed_at + int(query['X-Amz-Expires'][0])
+        except ValueError:
+            return None
+    if 'Expires' in query:
+        try:
+            return float(query['Expires'][0])
+        except ValueError:
+            return None
+    return None
+
+
+def get_chapters(card: Dict[Any, Any]) -> list:
+    """Return the chapters list of a /content/{id} response."""
+    card = card.get('card', card) if isinstance(card, dict) else {}
+    return (card.get('content') or {}).get('chapters') or []
+
+
+def iter_track_urls(card: Dict[Any, Any]):
+    """Yield every trackUrl in a /content/{id} response."""
+    for chapter in get_chapters(card):
+        for track in chapter.get('tracks') or []:
+            if track.get('trackUrl'):
+                yield track['trackUrl']
+
+
+def playable_ttl(card: Dict[Any, Any]) -> int:
+    """
+    TTL for a playable card response.
+
+    Capped so the entry expires YOTO_SIGNED_URL_MARGIN seconds before the
+    earliest track URL signature does.
+    """
+    ttl = settings.YOTO_CACHE_TTLS['card_playable']
+    expiries = [e for e in map(_signature_expiry, iter_track_urls(card)) if e]
+    if expiries:
+        remaining = min(expiries) - time.time() - settings.YOTO_SIGNED_URL_MARGIN
+        ttl = min(ttl, int(remaining))
+    return max(ttl, 0)
+
+
+class Revalidator:
+    """
+    Runs stale-while-revalidate refreshes in the background.
+
+    At most one refresh per key is in flight, and at most max_pending
+    overall; further requests are dropped (the next stale hit retries).
+    Refreshes run on a small thread pool with the sync client, also for
+    async views, so they outlive the event loop of the request that
+    triggered them.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._lock = threading.Lock()
+        self._inflight: set = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _claim(self, key: str) -> bool:
+        with self._lock:
+            if key in self._inflight or len(self._inflight) >= self.max_pending:
+                return False
+            self._inflight.add(key)
+            return True
+
+    def _release(self, key: str):
+        with self._lock:
+            self._inflight.discard(key)
+
+    def submit(self, key: str, refresh: Callable[[], Any]) -> bool:
+        """Schedule refresh() unless key is already being refreshed or the queue is full."""
+        if not self._claim(key):
+            return False
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='yoto-revalidate')
+
+        def run():
+            try:
+                refresh()
+            except Exception as e:
+                logger.warning("Background refresh of %s failed: %s", key.split(':')[2], e)
+            finally:
+                self._release(key)
+
+        self._executor.submit(run)
+        return True
+
+
+class ResponseCache:
+    """Per-account cache of decoded upstream responses."""
+
+    def __init__(self, alias: Optional[str] = None):
+        self.alias = alias or settings.YOTO_CACHE_ALIAS
+        self.revalidator = Revalidator(settings.YOTO_SWR_WORKERS, settings.YOTO_SWR_MAX_PENDING)
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def make_key(self, account: str, endpoint: str, *parts) -> str:
+        return ':'.join(['yoto', account, endpoint] + [str(p) for p in parts])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry ({'data', 'stored_at', 'expires_at'}), fresh or stale, or None."""
+        return self.backend.get(key)
+
+    @staticmethod
+    def is_fresh(entry: Dict[str, Any]) -> bool:
+        return time.time() < entry.get('expires_at', float('inf'))
+
+    @staticmethod
+    def can_revalidate(entry: Dict[str, Any]) -> bool:
+        """Whether an expired entry is recent enough to serve while revalidating."""
+        return time.time() < entry.get('expires_at', float('inf')) + settings.YOTO_SWR_STALE_TTL
+
+    def _entry(self, data: Any, client=None, ttl: int = 0) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            'data': data,
+            'stored_at': now,
+            'expires_at': now + ttl,
+            'validators': getattr(client, 'last_validators', None) or {},
+        }
+
+    def set(self, key: str, data: Any, ttl: int, client=None, stale_ttl: int = 0):
+        """Store data as fresh for ttl seconds, then kept stale for stale_ttl more."""
+        if ttl <= 0:
+            return
+        self.backend.set(key, self._entry(data, client, ttl), ttl + stale_ttl)
+
+    def delete(self, key: str):
+        self.backend.delete(key)
+
+    @staticmethod
+    def _count_lookup(key: str, result: str):
+        # Keys look like yoto:<account>:<endpoint>:...
+        metrics.cache_lookups.inc(endpoint=key.split(':')[2], result=result)
+
+    @staticmethod
+    def _use(entry: Dict[str, Any], client, status: str) -> Any:
+        """Return an entry's data, recording its validators, age and status on client."""
+        if client is not None:
+            client.last_validators = entry.get('validators', {})
+            client.cache_status = status
+            client.cache_age = max(int(time.time() - entry['stored_at']), 0)
+        return entry['data']
+
+    @staticmethod
+    def _loaded(data: Any, client) -> Any:
+        if client is not None:
+            client.cache_status = 'miss'
+            client.cache_age = None
+        return data
+
+    def _stale_fallback(self, key: str, entry: Optional[Dict[str, Any]], client, error: Exception) -> Any:
+        """Serve a stale entry while the upstream is unavailable, or re-raise."""
+        if entry is None:
+            raise error
+        self._count_lookup(key, 'stale')
+        logger.info("Serving stale %s: %s", key.split(':')[2], error)
+        return self._use(entry, client, 'stale')
+
+    def _load(self, key: str, loader: Callable[[], Any], ttl: Any, client, stale_ttl: Optional[int]) -> Any:
+        data = loader()
+        ttl = ttl(data) if callable(ttl) else ttl
+        stale_ttl = settings.YOTO_CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+        # A first request with a new token loads under its credentials; the
+        # token is verified now, so later requests will look under the account
+        for store_key in filter(None, (key, _rekeyed(key, client))):
+            self.set(store_key, data, ttl, client, stale_ttl)
+        return data
+
+    async def _aload(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Any, client,
+                     stale_ttl: Optional[int]) -> Any:
+        data = await loader()
+        ttl = ttl(data) if callable(ttl) else ttl
+        stale_ttl = settings.YOTO_CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+        if ttl > 0:
+            for store_key in filter(None, (key, _rekeyed(key, client))):
+                await self.backend.aset(store_key, self._entry(data, client, ttl), ttl + stale_ttl)
+        return data
+
+    def fetch(self, key: str, loader: Callable[[], Any], ttl: Any, refresh: bool = False,
+              client=None, stale_ttl: Optional[int] = None,
+              revalidate: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Return cached data for key, calling loader() on a miss.
+
+        ttl is either a number of seconds or a callable taking the loaded
+        data and returning one. Entries are kept stale_ttl seconds past
+        their ttl (default YOTO_CACHE_STALE_TTL) and served if loader()
+        fails with UpstreamUnavailable, or, if revalidate is given and the
+        entry expired less than YOTO_SWR_STALE_TTL seconds ago, served
+        straight away while revalidate() (which must reload and store the
+        entry itself) runs in the background. If client is given, its
+        upstream validators are stored with the entry and restored onto it
+        on a hit, along with cache_status ('hit', 'stale' or 'miss') and
+        cache_age.
+        """
+        entry = self.get(key)
+        if entry is not None and not refresh:
+            if self.is_fresh(entry):
+                self._count_lookup(key, 'hit')
+                return self._use(entry, client, 'hit')
+            if revalidate is not None and self.can_revalidate(entry):
+                self._count_lookup(key, 'stale')
+                self.revalidator.submit(key, revalidate)
+                return self._use(entry, client, 'stale')
+        if not refresh:
+            self._count_lookup(key, 'miss')
+
+        try:
+            return self._loaded(self._load(key, loader, ttl, client, stale_ttl), client)
+        except UpstreamUnavailable as e:
+            return self._stale_fallback(key, entry, client, e)
+
+    async def afetch(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Any, refresh: bool = False,
+                     client=None, stale_ttl: Optional[int] = None,
+                     revalidate: Optional[Callable[[], Any]] = None) -> Any:
+        """Async fetch(); loader is a coroutine function (revalidate is still sync)."""
+        entry = await self.backend.aget(key)
+        if entry is not None and not refresh:
+            if self.is_fresh(entry):
+                self._count_lookup(key, 'hit')
+                return self._use(entry, client, 'hit')
+            if revalidate is not None and self.can_revalidate(entry):
+                self._count_lookup(key, 'stale')
+                self.revalidator.submit(key, revalidate)
+                return self._use(entry, client, 'stale')
+        if not refresh:
+            self._count_lookup(key, 'miss')
+
+        try:
+            return self._loaded(await self._aload(key, loader, ttl, client, stale_ttl), client)
+        except UpstreamUnavailable as e:
+            return self._stale_fallback(key, entry, client, e)
+
+
+response_cache = ResponseCache()
+
+
+def revalidator_for(endpoint: str, refresh_with: Callable[[Any], Any], client) -> Optional[Callable]:
+    """
+    Background refresh for a stale-while-revalidate endpoint (YOTO_SWR_ENDPOINTS).
+
+    The refresh runs on a sync copy of the client, so it can't change the
+    token or validators of the request being answered from the stale entry.
+    """
+    if endpoint not in settings.YOTO_SWR_ENDPOINTS:
+        return None
+
+    def revalidate():
+        background_client = YotoAPIClient.__new__(YotoAPIClient)
+        background_client.__dict__.update(copy.copy(client.__dict__))
+        return refresh_with(background_client)
+    return revalidate
+
+
+def _indexed_library(client, cards: list) -> list:
+    """Queue a fresh listing for search indexing under the client's verified account."""
+    account = identity.verified_account(client)
+    return search.queue_library(account, cards) if account else cards
+
+
+def _indexed_card(client, detail: dict) -> dict:
+    account = identity.verified_account(client)
+    return search.queue_card(account, detail) if account else detail
+
+
+def get_library(client, refresh: bool = False) -> list:
+    """Cached YotoAPIClient.get_library(); fresh listings are queued for search indexing."""
+    key = response_cache.make_key(account_key(client), 'library')
+    revalidate = revalidator_for('library', lambda c: get_library(c, refresh=True), client)
+    return response_cache.fetch(key, lambda: _indexed_library(client, client.get_library()),
+                                settings.YOTO_CACHE_TTLS['library'], refresh, client, revalidate=revalidate)
+
+
+def get_players(client, refresh: bool = False) -> list:
+    """Cached YotoAPIClient.get_players()."""
+    key = response_cache.make_key(account_key(client), 'players')
+    revalidate = revalidator_for('players', lambda c: get_players(c, refresh=True), client)
+    return response_cache.fetch(key, client.get_players, settings.YOTO_CACHE_TTLS['players'],
+                                refresh, client, revalidate=revalidate)
+
+
+def _add_recent(recent: Optional[list], card_id: str) -> list:
+    recent = [c for c in (recent or []) if c != card_id]
+    return [card_id] + recent[:settings.YOTO_WARM_MAX_CARDS - 1]
+
+
+def note_recent_card(account: str, card_id: str):
+    """Remember that a card was opened, for the warm-up scheduler."""
+    key = response_cache.make_key(account, 'recent_cards')
+    backend = response_cache.backend
+    backend.set(key, _add_recent(backend.get(key), card_id), settings.YOTO_RECENT_CARDS_TTL)
+
+
+def recent_cards(account: str) -> list:
+    """Card IDs most recently opened by an account, newest first."""
+    return response_cache.backend.get(response_cache.make_key(account, 'recent_cards')) or []
+
+
+def get_card(client, card_id: str, playable: bool = True, refresh: bool = False,
+             remember: bool = True) -> dict:
+    """
+    Cached YotoAPIClient.get_card(); playable responses respect URL signatures.
+
+    Playable fetches are remembered as recently used unless remember is False.
+    """
+    endpoint = 'card_playable' if playable else 'card'
+    account = account_key(client)
+    if playable and remember:
+        note_recent_card(account, card_id)
+    key = response_cache.make_key(account, endpoint, card_id)
+    ttl = playable_ttl if playable else settings.YOTO_CACHE_TTLS['card']
+    # Signed track URLs cannot be served past their TTL, which already ends near expiry
+    return response_cache.fetch(key, lambda: _indexed_card(client, client.get_card(card_id, playable=playable)),
+                                ttl, refresh, client, stale_ttl=0 if playable else None)
+
+
+async def aget_library(client, refresh: bool = False) -> list:
+    """Cached AsyncYotoAPIClient.get_library(); fresh listings are queued for search indexing."""
+    key = response_cache.make_key(account_key(client), 'library')
+    revalidate = revalidator_for('library', lambda c: get_library(c, refresh=True), client)
+
+    async def load():
+        return _indexed_library(client, await client.get_library())
+    return await response_cache.afetch(key, load, settings.YOTO_CACHE_TTLS['library'],
+                                       refresh, client, revalidate=revalidate)
+
+
+async def aget_players(client, refresh: bool = False) -> list:
+    """Cached AsyncYotoAPIClient.get_players()."""
+    key = response_cache.make_key(account_key(client), 'players')
+    revalidate = revalidator_for('players', lambda c: get_players(c, refresh=True), client)
+    return await response_cache.afetch(key, client.get_players, settings.YOTO_CACHE_TTLS['players'],
+                                       refresh, client, revalidate=revalidate)
+
+
+async def aget_card(client, card_id: str, playable: bool = True, refresh: bool = False) -> dict:
+    """Cached AsyncYotoAPIClient.get_card()."""
+    endpoint = 'card_playable' if playable else 'card'
+    account = account_key(client)
+    if playable:
+        recent_key = response_cache.make_key(account, 'recent_cards')
+        recent = _add_recent(await response_cache.backend.aget(recent_key), card_id)
+        await response_cache.backend.aset(recent_key, recent, settings.YOTO_RECENT_CARDS_TTL)
+    key = response_cache.make_key(account, endpoint, card_id)
+    ttl = playable_ttl if playable else settings.YOTO_CACHE_TTLS['card']
+
+    async def load():
+        return _indexed_card(client, await client.get_card(card_id, playable=playable))
+    return await response_cache.afetch(key, load, ttl, refresh, client, stale_ttl=0 if playable else None)
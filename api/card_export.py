@@ -0,0 +1,383 @@
+"""
+Whole-card archives for offline use and backup.
+
+/api/card/<id>/export streams one TAR (default) or ZIP file holding every
+chapter's audio, the card's metadata as card.json and its cover, instead
+of the app downloading tracks one at a time. The archive is written while
+it is sent, so memory stays constant whatever the card's size: track
+bodies are relayed chunk by chunk from their signed URLs. Up to
+YOTO_EXPORT_PREFETCH upcoming tracks download in the background into
+bounded buffers while the current one is written.
+
+TAR exports know their exact length up front (each track's size is probed
+with a one-byte Range request), and the same card always produces the same
+bytes, so they honor Range and If-Range: an interrupted download resumes
+where it stopped. ZIP exports are written in a single pass and can't be
+resumed.
+"""
+import hashlib
+import json
+import logging
+import mimetypes
+import queue
+import re
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import requests
+from django.conf import settings
+
+from . import cache, images, media_store, transport
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'tar': 'application/x-tar', 'zip': 'application/zip'}
+BLOCK = tarfile.BLOCKSIZE
+
+_END = object()
+
+
+class ExportError(Exception):
+    """A track couldn't be sized or downloaded."""
+
+
+class Track(NamedTuple):
+    chapter: int
+    index: int
+    url: str
+
+
+class Member(NamedTuple):
+    """One archive entry: either inline data or a track fetched while writing."""
+    name: str
+    mtime: int
+    data: bytes = b''
+    track: Optional[Track] = None
+    size: Optional[int] = None
+
+
+def _safe_name(name: str, fallback: str) -> str:
+    name = re.sub(r'[\x00-\x1f/\\:*?"<>|]+', '_', name or '').strip(' ._')
+    return name[:80] or fallback
+
+
+def _mtime(card: Dict[str, Any]) -> int:
+    try:
+        return int(datetime.fromisoformat(card.get('updatedAt') or '').timestamp())
+    except ValueError:
+        return 0
+
+
+def _without_track_urls(value: Any) -> Any:
+    """A copy of a card detail minus the signed URLs, which expire and change per request."""
+    if isinstance(value, dict):
+        return {k: _without_track_urls(v) for k, v in value.items() if k != 'trackUrl'}
+    if isinstance(value, list):
+        return [_without_track_urls(v) for v in value]
+    return value
+
+
+def _fetch_cover(url: str) -> Optional[Tuple[bytes, str]]:
+    """(body, content_type) of a card's cover, or None if it can't be fetched."""
+    try:
+        if media_store.is_enabled():
+            content_hash, content_type = media_store.get_store().fetch(url)
+            path = media_store.get_store().open_object(content_hash)
+            return (path.read_bytes(), content_type) if path else None
+        response = transport.request('GET', url)
+        if response.status_code != 200:
+            logger.warning("Cover %s returned HTTP %s; exporting without it", url, response.status_code)
+            return None
+        return response.content, response.headers.get('Content-Type', 'application/octet-stream')
+    except (media_store.MediaStoreError, OSError, requests.RequestException) as e:
+        logger.warning("Couldn't fetch cover %s; exporting without it: %s", url, e)
+        return None
+
+
+def card_members(card_detail: Dict[str, Any]) -> List[Member]:
+    """The entries of a card's archive, in order, under a folder named after the card."""
+    card = card_detail.get('card', card_detail)
+    folder = _safe_name(card.get('title'), card.get('cardId') or 'card')
+    mtime = _mtime(card)
+    metadata = json.dumps(_without_track_urls(card_detail), indent=2, sort_keys=True, ensure_ascii=False)
+    members = [Member(f'{folder}/card.json', mtime, metadata.encode('utf-8'))]
+
+    url = images.cover_url(card)
+    cover = _fetch_cover(url) if url and media_store.is_allowed_source(url) else None
+    if cover:
+        ext = mimetypes.guess_extension(cover[1].split(';')[0].strip()) or '.img'
+        members.append(Member(f'{folder}/cover{ext}', mtime, cover[0]))
+
+    for c, chapter in enumerate(cache.get_chapters(card_detail)):
+        tracks = [t for t in chapter.get('tracks') or [] if t.get('trackUrl')]
+        for t, track in enumerate(tracks):
+            number = f'{c + 1:02d}' if len(tracks) == 1 else f'{c + 1:02d}-{t + 1:02d}'
+            title = _safe_name(track.get('title') or chapter.get('title'), 'Track')
+            ext = _safe_name(track.get('format'), 'mp3').lower()
+            members.append(Member(f'{folder}/{number} {title}.{ext}', mtime,
+                                  track=Track(c, t, track['trackUrl'])))
+    return members
+
+
+def parse_range(header: str, total: int) -> Optional[Tuple[int, int]]:
+    """
+    (first, last) byte of a single-range Range header, or None to send everything.
+
+    Raises ValueError if the range lies outside the archive.
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), total - 1) if last else total - 1
+    else:
+        start, end = max(total - int(last), 0), total - 1
+    if start > end or start >= total:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+class CardExport:
+    """The archive of one card in one format; iterate chunks() to produce it."""
+
+    def __init__(self, client, card_id: str, fmt: str = 'tar', refresh: bool = False):
+        self.client = client
+        self.card_id = card_id
+        self.format = fmt
+        self.card = cache.get_card(client, card_id, playable=True, refresh=refresh)
+        self.members = card_members(self.card)
+        self._resign_lock = threading.Lock()
+        self._resigned = False
+        if fmt == 'tar':
+            self.members = self._with_sizes(self.members)
+
+    @property
+    def filename(self) -> str:
+        return f'{self.members[0].name.split("/")[0]}.{self.format}'
+
+    # Track downloads
+
+    def _open(self, track: Track, start: int = 0, end: Optional[int] = None):
+        """A streaming upstream response for bytes start..end of a track (re-signing once on 403)."""
+        headers = {'Range': f'bytes={start}-{"" if end is None else end}'} if start or end is not None else {}
+        url = track.url
+        for attempt in range(2):
+            upstream = transport.request('GET', url, headers=headers, stream=True)
+            if upstream.status_code != 403 or attempt:
+                break
+            # The cached signature may have been revoked early; re-sign once
+            upstream.close()
+            url = self._resign(track)
+        if upstream.status_code not in (200, 206):
+            upstream.close()
+            raise ExportError(f'Track {track.chapter}/{track.index} returned HTTP {upstream.status_code}')
+        return upstream
+
+    def _resign(self, track: Track) -> str:
+        with self._resign_lock:
+            if not self._resigned:
+                self.card = cache.get_card(self.client, self.card_id, playable=True, refresh=True)
+                self._resigned = True
+        tracks = cache.get_chapters(self.card)[track.chapter].get('tracks') or []
+        return [t for t in tracks if t.get('trackUrl')][track.index]['trackUrl']
+
+    def _size(self, track: Track) -> int:
+        upstream = self._open(track, 0, 0)
+        try:
+            content_range = upstream.headers.get('Content-Range', '')
+            if upstream.status_code == 206 and '/' in content_range:
+                return int(content_range.rsplit('/', 1)[1])
+            return int(upstream.headers['Content-Length'])
+        except (KeyError, ValueError):
+            raise ExportError(f'Track {track.chapter}/{track.index} has no known size')
+        finally:
+            upstream.close()
+
+    def _with_sizes(self, members: List[Member]) -> List[Member]:
+        tracks = [m.track for m in members if m.track]
+        sizes = {}
+        if tracks:
+            with ThreadPoolExecutor(max_workers=min(settings.YOTO_BATCH_MAX_WORKERS, len(tracks))) as executor:
+                sizes = dict(zip(tracks, executor.map(self._size, tracks)))
+        return [m._replace(size=sizes[m.track] if m.track else len(m.data)) for m in members]
+
+    def _download(self, job: Tuple[Track, int, Optional[int]], out: queue.Queue, cancelled: threading.Event):
+        """Feed a track's chunks (then _END, or the error) into out until cancelled."""
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    out.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        track, start, end = job
+        try:
+            upstream = self._open(track, start, end)
+            try:
+                # A host that ignored the Range header sent the whole track
+                skip = start if upstream.status_code == 200 else 0
+                remaining = None if end is None else end - start + 1
+                for chunk in upstream.raw.stream(settings.YOTO_STREAM_CHUNK_SIZE, decode_content=False):
+                    if skip:
+                        chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                    if remaining is not None:
+                        chunk, remaining = chunk[:remaining], remaining - min(len(chunk), remaining)
+                    if chunk and not put(chunk):
+                        return
+                    if remaining == 0:
+                        break
+            finally:
+                upstream.close()
+            put(_END)
+        except Exception as e:
+            put(e)
+
+    def _prefetched(self, jobs: List[Tuple[Track, int, Optional[int]]]) -> Iterator[Iterator[bytes]]:
+        """
+        One chunk iterator per job, in order, downloaded ahead by a thread pool.
+
+        Jobs start in order on YOTO_EXPORT_PREFETCH workers and each buffers at
+        most YOTO_EXPORT_BUFFER_CHUNKS chunks, so the ones after the track
+        being written are bounded too.
+        """
+        cancelled = threading.Event()
+        executor = ThreadPoolExecutor(max(1, settings.YOTO_EXPORT_PREFETCH), thread_name_prefix='yoto-export')
+        buffers = []
+        try:
+            for job in jobs:
+                buffers.append(queue.Queue(max(1, settings.YOTO_EXPORT_BUFFER_CHUNKS)))
+                executor.submit(self._download, job, buffers[-1], cancelled)
+            for buffer in buffers:
+                yield self._drain(buffer)
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _drain(buffer: queue.Queue) -> Iterator[bytes]:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise ExportError(f'Track download failed: {item}') from item
+            yield item
+
+    # TAR
+
+    def _tar_segments(self) -> List[Tuple[int, Any]]:
+        """(size, bytes or Member) pieces of the TAR file in order."""
+        segments = []
+        for member in self.members:
+            info = tarfile.TarInfo(member.name)
+            info.size, info.mtime, info.mode = member.size, member.mtime, 0o644
+            header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+            segments.append((len(header), header))
+            segments.append((member.size, member if member.track else member.data))
+            padding = -member.size % BLOCK
+            if padding:
+                segments.append((padding, b'\0' * padding))
+        segments.append((2 * BLOCK, b'\0' * 2 * BLOCK))
+        return segments
+
+    @property
+    def size(self) -> Optional[int]:
+        """Length of the archive in bytes (TAR only)."""
+        if self.format != 'tar':
+            return None
+        return sum(size for size, _ in self._tar_segments())
+
+    @property
+    def etag(self) -> Optional[str]:
+        """Validator of the archive's exact bytes (TAR only), for If-Range."""
+        if self.format != 'tar':
+            return None
+        digest = hashlib.sha256()
+        for member in self.members:
+            digest.update(f'{member.name}\0{member.size}\0{member.mtime}\0'.encode('utf-8'))
+            digest.update(member.data)
+        return f'"{digest.hexdigest()[:32]}"'
+
+    def _tar_chunks(self, first: int, last: int) -> Iterator[bytes]:
+        # Which part of each segment falls within first..last
+        wanted, offset = [], 0
+        for size, piece in self._tar_segments():
+            lo, hi = max(first - offset, 0), min(last - offset, size - 1)
+            if lo <= hi:
+                wanted.append((piece, lo, hi))
+            offset += size
+
+        jobs = [(piece.track, lo, None if hi == piece.size - 1 else hi)
+                for piece, lo, hi in wanted if isinstance(piece, Member)]
+        downloads = self._prefetched(jobs)
+        try:
+            for piece, lo, hi in wanted:
+                if not isinstance(piece, Member):
+                    yield piece[lo:hi + 1]
+                    continue
+                received = 0
+                for chunk in next(downloads):
+                    received += len(chunk)
+                    yield chunk
+                if received != hi - lo + 1:
+                    raise ExportError(f'{piece.name} ended after {received} of {hi - lo + 1} bytes')
+        finally:
+            downloads.close()
+
+    # ZIP
+
+    def _zip_chunks(self) -> Iterator[bytes]:
+        sink = _Sink()
+        downloads = self._prefetched([(m.track, 0, None) for m in self.members if m.track])
+        try:
+            with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+                for member in self.members:
+                    info = zipfile.ZipInfo(member.name, time.gmtime(max(member.mtime, 315532800))[:6])
+                    if not member.track:
+                        # Audio is already compressed; only the metadata is worth deflating
+                        info.compress_type = (zipfile.ZIP_DEFLATED if member.name.endswith('.json')
+                                              else zipfile.ZIP_STORED)
+                        archive.writestr(info, member.data)
+                        yield sink.drain()
+                        continue
+                    with archive.open(info, 'w') as entry:
+                        for chunk in next(downloads):
+                            entry.write(chunk)
+                            yield sink.drain()
+                    yield sink.drain()
+            yield sink.drain()
+        finally:
+            downloads.close()
+
+    def chunks(self, byte_range: Optional[Tuple[int, int]] = None) -> Iterator[bytes]:
+        """The archive's bytes (only byte_range's, for TAR), produced as they are sent."""
+        if self.format == 'zip':
+            return (chunk for chunk in self._zip_chunks() if chunk)
+        first, last = byte_range or (0, self.size - 1)
+        return (chunk for chunk in self._tar_chunks(first, last) if chunk)
+
+
+class _Sink:
+    """Write-only file zipfile writes into; drain() takes what was written since."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
@@ -0,0 +1,83 @@
+"""
+Registry of live Yoto API clients, one per set of credentials.
+
+get_client_from_request() looks the request's credential headers up here
+instead of building a client from scratch. The registered client keeps the
+account's latest access token and its expiry across requests, so a token
+refreshed by one request is used by the next even if the browser hasn't
+picked up the new token yet, and expiry is known without a failed call.
+
+Each request gets its own fork() of the registered client, since clients
+also carry per-request state (cache status, upstream validators); forks
+write refreshed tokens back. Clients idle for YOTO_CLIENT_IDLE_TTL seconds
+are dropped, and at most YOTO_CLIENT_REGISTRY_SIZE are kept (least
+recently used first out).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Type
+
+from django.conf import settings
+
+from .yoto_client import YotoAPIClient
+
+Credentials = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+class ClientRegistry:
+    """Bounded, thread-safe LRU of clients keyed by a hash of their credentials."""
+
+    def __init__(self, max_size: int, idle_ttl: float):
+        self.max_size = max(1, max_size)
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        # key -> (client, time last used from time.monotonic())
+        self._clients: 'OrderedDict[str, Tuple[YotoAPIClient, float]]' = OrderedDict()
+
+    @staticmethod
+    def key_for(client_class: Type[YotoAPIClient], credentials: Credentials) -> str:
+        identity = '\0'.join([client_class.__name__] + [value or '' for value in credentials])
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def _evict(self, now: float):
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if len(self._clients) <= self.max_size and now - last_used < self.idle_ttl:
+                break
+            del self._clients[key]
+
+    def checkout(self, client_class: Type[YotoAPIClient], access_token: Optional[str],
+                 refresh_token: Optional[str], client_id: Optional[str],
+                 client_secret: Optional[str]) -> YotoAPIClient:
+        """A per-request fork of the registered client for these credentials."""
+        key = self.key_for(client_class, (access_token, refresh_token, client_id, client_secret))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.pop(key, None)
+            if entry is None:
+                client = client_class()
+                if client_id:
+                    client.client_id = client_id
+                if client_secret:
+                    client.client_secret = client_secret
+                if access_token:
+                    client.access_token = access_token
+                if refresh_token:
+                    client.refresh_token = refresh_token
+            else:
+                client = entry[0]
+            self._clients[key] = (client, now)
+            self._evict(now)
+        return client.fork()
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+registry = ClientRegistry(settings.YOTO_CLIENT_REGISTRY_SIZE, settings.YOTO_CLIENT_IDLE_TTL)
@@ -0,0 +1,106 @@
+"""
+Coalescing of identical concurrent upstream GETs.
+
+When several requests with the same credentials ask for the same endpoint
+and query parameters at once (several tabs of the app, or the play and save
+flows both loading a card), only the first caller reaches the Yoto API; the
+others wait for its result. Requests are only joined when they present the
+same bearer token, so nobody is answered with data their own token wouldn't
+have fetched. Every caller gets its own deep copy of the decoded body, since
+views may rewrite it in place.
+
+Coalescer serves the threaded (WSGI) path; async callers await a task of
+the running event loop instead, so coalescing there is per loop. The task
+belongs to no caller: it runs to completion even if the request that started
+it is cancelled. Failures are shared too: every caller raises the exception.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from . import identity, metrics
+
+
+def key_for(client, endpoint: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Coalescing key for a GET: (bearer token, URL, query parameters)."""
+    query = json.dumps(sorted((params or {}).items()), default=str)
+    request = f"{identity.credentials_key(client)}\0{client.base_url}{endpoint}\0{query}"
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    """A GET in flight that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class Coalescer:
+    """Runs at most one call per key at a time, sharing its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._futures: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Task]]' = \
+            weakref.WeakKeyDictionary()
+
+    def run(self, key: str, call: Callable[[], Any]) -> Any:
+        """Return call()'s result, or that of an identical call already in flight."""
+        with self._lock:
+            pending = self._calls.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.upstream_coalesced.inc()
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return copy.deepcopy(pending.result)
+
+        try:
+            pending.result = call()
+            return copy.deepcopy(pending.result)
+        except BaseException as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            pending.done.set()
+
+    async def arun(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Async run(); shares calls between coroutines on the same event loop."""
+        loop = asyncio.get_running_loop()
+        tasks = self._futures.setdefault(loop, {})
+        pending = tasks.get(key)
+        if pending is None:
+            pending = tasks[key] = loop.create_task(call())
+
+            def finished(task):
+                if tasks.get(key) is task:
+                    del tasks[key]
+                if not task.cancelled():
+                    task.exception()  # Retrieved here, so a call nobody awaits any more isn't logged as unhandled
+            pending.add_done_callback(finished)
+        else:
+            metrics.upstream_coalesced.inc()
+        # Shielded, so a cancelled caller doesn't cancel everyone's call
+        return copy.deepcopy(await asyncio.shield(pending))
+
+
+coalescer = Coalescer()
+
+
+def shared(result: Tuple[Any, Dict[str, str]], client) -> Any:
+    """Unpack a coalesced (body, validators) result onto client."""
+    data, validators = result
+    client.last_validators = dict(validators)
+    return data
@@ -0,0 +1,341 @@
+"""
+Local stand-in for the Yoto API, its OAuth server and the S3 audio host.
+
+Used by the test suite and by `manage.py fake_yoto` / `manage.py benchmark`
+to exercise the proxy without the real service. Point the proxy at it with
+YOTO_API_BASE_URL and YOTO_AUTH_BASE_URL (both the server's URL).
+
+Routes:
+    POST /oauth/token                 refresh_token and authorization_code grants
+    GET  /family                      family details
+    GET  /device-v2/devices/mine      {"devices": [...]}
+    GET  /devices/{id}                one device
+    GET  /content/mine                {"cards": [...]} (with ETag/If-None-Match)
+    GET  /content/{id}[?playable=..]  card detail, with presigned-style track URLs
+    GET  /s3/{card}/{chapter}/{track} audio bytes, honouring Range
+    GET  /redirect?to={url}           302 to url
+
+Latency (fixed plus random jitter) and errors (a random rate, or the next N
+responses via fail_next()) can be injected for load and resilience testing.
+Audio bodies can be sent slowly (audio_pace seconds per KiB) to check that
+they are relayed as they arrive.
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+REFRESH_TOKEN = 'fake-refresh-token'
+CLIENT_ID = 'fake-client-id'
+CLIENT_SECRET = 'fake-client-secret'
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).rstrip(b'=').decode('ascii')
+
+
+def make_token(subject: str = 'fake-user', ttl: int = 3600) -> str:
+    """An unsigned JWT carrying sub and exp, shaped like a Yoto access token."""
+    now = int(time.time())
+    return '.'.join([_b64({'alg': 'none', 'typ': 'JWT'}),
+                     _b64({'sub': subject, 'iat': now, 'exp': now + ttl, 'jti': random.getrandbits(64)}),
+                     'fake'])
+
+
+def _token_expiry(token: str) -> Optional[int]:
+    try:
+        payload = token.split('.')[1]
+        return int(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+    except (IndexError, KeyError, ValueError):
+        return None
+
+
+class FakeYotoAPI:
+    """
+    Threaded HTTP server with a generated library of cards.
+
+    Any bearer token is accepted unless it has been revoke()d or is a JWT
+    whose exp has passed, in which case the API answers 403 as Yoto does.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, cards: int = 20,
+                 chapters: int = 5, tracks: int = 1, audio_bytes: int = 256 * 1024,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 token_ttl: int = 3600, url_ttl: int = 3600, subject: str = 'fake-user'):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.url_ttl = url_ttl
+        self.subject = subject
+        self.chapters = chapters
+        self.tracks = tracks
+        self.audio = bytes(range(256)) * (audio_bytes // 256) + bytes(audio_bytes % 256)
+        # Seconds to pause after each KiB of an audio body
+        self.audio_pace = 0.0
+
+        updated = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.cards: List[dict] = [self._make_card(i, updated + timedelta(hours=i)) for i in range(cards)]
+        self.devices = [{'deviceId': f'player-{i}', 'name': f'Player {i + 1}', 'online': True}
+                        for i in range(2)]
+
+        self._lock = threading.Lock()
+        self._revoked: set = set()
+        self._failures: List[int] = []
+        self.requests: Dict[str, int] = {}
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    # -- lifecycle ----------------------------------------------------------
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeYotoAPI':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-yoto', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeYotoAPI':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -- test controls --------------------------------------------------------
+
+    def issue_token(self) -> str:
+        return make_token(self.subject, self.token_ttl)
+
+    def revoke(self, token: str):
+        """Make the API reject token with 403 from now on."""
+        with self._lock:
+            self._revoked.add(token)
+
+    def fail_next(self, status: int = 503, count: int = 1):
+        """Answer the next count API/OAuth requests with status."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def request_count(self, route: str) -> int:
+        return self.requests.get(route, 0)
+
+    # -- data -----------------------------------------------------------------
+
+    def _make_card(self, i: int, updated: datetime) -> dict:
+        card_id = f'card{i:04d}'
+        return {
+            'cardId': card_id,
+            'title': f'Card {i + 1}',
+            'createdAt': updated.isoformat().replace('+00:00', 'Z'),
+            'updatedAt': updated.isoformat().replace('+00:00', 'Z'),
+            'metadata': {'author': f'Author {i % 7}', 'category': ('stories', 'music', 'radio')[i % 3],
+                         'cover': {'imageL': f'https://card-content.yotoplay.com/fake/{card_id}.png'},
+                         'media': {'duration': (i % 4 + 1) * 300}},
+        }
+
+    def _card_detail(self, card: dict, playable: bool) -> dict:
+        signed_at = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        chapters = []
+        for c in range(self.chapters):
+            tracks = []
+            for t in range(self.tracks):
+                track = {'key': f'{c:02d}-{t:02d}', 'title': f'Track {t + 1}', 'duration': 120,
+                         'format': 'mp3', 'type': 'audio'}
+                if playable:
+                    track['trackUrl'] = (f'{self.url}/s3/{card["cardId"]}/{c}/{t}'
+                                         f'?X-Amz-Date={signed_at}&X-Amz-Expires={self.url_ttl}'
+                                         f'&X-Amz-Signature=fake')
+                tracks.append(track)
+            chapters.append({'key': f'{c:02d}', 'title': f'Chapter {c + 1}', 'tracks': tracks,
+                             'display': {'icon16x16': f'https://card-content.yotoplay.com/fake/icon{c}.png'}})
+        detail = dict(card, content={'chapters': chapters})
+        return {'card': detail}
+
+    def find_card(self, card_id: str) -> Optional[dict]:
+        return next((card for card in self.cards if card['cardId'] == card_id), None)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeYoto/1.0'
+
+    @property
+    def fake(self) -> FakeYotoAPI:
+        return self.server.fake
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'', content_type: str = 'application/json',
+              headers: Optional[dict] = None, pace: float = 0.0):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if not pace:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), 1024):
+            self.wfile.write(body[start:start + 1024])
+            self.wfile.flush()
+            time.sleep(pace)
+
+    def _send_json(self, data, status: int = 200, headers: Optional[dict] = None):
+        self._send(status, json.dumps(data).encode('utf-8'), headers=headers)
+
+    def _count(self, route: str):
+        with self.fake._lock:
+            self.fake.requests[route] = self.fake.requests.get(route, 0) + 1
+
+    def _inject(self) -> bool:
+        """Apply latency and error injection; True if an error was sent."""
+        fake = self.fake
+        delay = fake.latency + (random.uniform(0, fake.jitter) if fake.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        with fake._lock:
+            status = fake._failures.pop(0) if fake._failures else None
+        if status is None and fake.error_rate and random.random() < fake.error_rate:
+            status = 503
+        if status is None:
+            return False
+        headers = {'Retry-After': '1'} if status in (429, 503) else None
+        self._send_json({'error': 'injected failure', 'status': status}, status, headers)
+        return True
+
+    def _authorized(self) -> bool:
+        auth = self.headers.get('Authorization', '')
+        token = auth[7:] if auth.startswith('Bearer ') else ''
+        expiry = _token_expiry(token)
+        with self.fake._lock:
+            revoked = token in self.fake._revoked
+        if not token or revoked or (expiry is not None and expiry < time.time()):
+            self._send_json({'error': 'Forbidden'}, 403)
+            return False
+        return True
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if path != '/oauth/token':
+            self._count('unknown')
+            return self._send_json({'error': 'Not found'}, 404)
+
+        self._count('token')
+        if self._inject():
+            return
+        try:
+            data = json.loads(raw) if raw.strip().startswith(b'{') else \
+                {k: v[0] for k, v in parse_qs(raw.decode('utf-8')).items()}
+        except ValueError:
+            return self._send_json({'error': 'invalid_request'}, 400)
+
+        grant = data.get('grant_type')
+        if grant == 'refresh_token' and data.get('refresh_token') and data.get('client_id'):
+            pass
+        elif grant == 'authorization_code' and data.get('code') and data.get('client_id'):
+            pass
+        else:
+            return self._send_json({'error': 'invalid_grant'}, 400)
+
+        self._send_json({
+            'access_token': self.fake.issue_token(),
+            'refresh_token': data.get('refresh_token') or REFRESH_TOKEN,
+            'token_type': 'Bearer',
+            'expires_in': self.fake.token_ttl,
+        })
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        path, query = parsed.path, parse_qs(parsed.query)
+
+        if path.startswith('/s3/'):
+            self._count('audio')
+            return self._send_audio()
+        if path == '/redirect':
+            self._count('redirect')
+            return self._send(302, headers={'Location': query.get('to', ['/'])[0]})
+
+        fake = self.fake
+        routes = (
+            (r'/family', 'family', lambda: self._send_json({'family': {'familyId': 'fake-family', 'name': 'Fake'}})),
+            (r'/device-v2/devices/mine', 'devices', lambda: self._send_json({'devices': fake.devices})),
+            (r'/devices/(?P<id>[^/]+)', 'device', lambda id: self._send_device(id)),
+            (r'/content/mine', 'library', lambda: self._send_library()),
+            (r'/content/(?P<id>[^/]+)', 'card', lambda id: self._send_card(id, query)),
+        )
+        for pattern, route, handler in routes:
+            match = re.fullmatch(pattern, path)
+            if match:
+                self._count(route)
+                if self._inject() or not self._authorized():
+                    return
+                return handler(**match.groupdict())
+        self._count('unknown')
+        self._send_json({'error': 'Not found'}, 404)
+
+    def _send_device(self, device_id: str):
+        device = next((d for d in self.fake.devices if d['deviceId'] == device_id), None)
+        if device is None:
+            return self._send_json({'error': 'Not found'}, 404)
+        self._send_json({'device': device})
+
+    def _send_library(self):
+        body = json.dumps({'cards': self.fake.cards}).encode('utf-8')
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, headers={'ETag': etag})
+        self._send(200, body, headers={'ETag': etag})
+
+    def _send_card(self, card_id: str, query: dict):
+        card = self.fake.find_card(card_id)
+        if card is None:
+            return self._send_json({'error': 'Not found'}, 404)
+        playable = query.get('playable', ['false'])[0] == 'true'
+        self._send_json(self.fake._card_detail(card, playable))
+
+    def _send_audio(self):
+        audio = self.fake.audio
+        total = len(audio)
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        if not match or match.groups() == ('', ''):
+            return self._send(200, audio, 'audio/mpeg', {'Accept-Ranges': 'bytes'}, self.fake.audio_pace)
+
+        first, last = match.groups()
+        if first:
+            start, end = int(first), int(last) if last else total - 1
+        else:
+            start, end = max(total - int(last), 0), total - 1
+        if start >= total or start > end:
+            return self._send(416, b'', 'audio/mpeg', {'Content-Range': f'bytes */{total}'})
+        end = min(end, total - 1)
+        self._send(206, audio[start:end + 1], 'audio/mpeg',
+                   {'Accept-Ranges': 'bytes', 'Content-Range': f'bytes {start}-{end}/{total}'}, self.fake.audio_pace)
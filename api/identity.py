@@ -0,0 +1,80 @@
+"""
+Which account a request's bearer token belongs to.
+
+Cached responses, coalesced calls and player pollers are shared per
+account, so every device of a household benefits from one upstream call.
+The account id inside an access token (its 'sub' claim) can't be taken at
+face value, though: the proxy can't check the token's signature, and a
+forged token could name any account. A token is therefore only mapped to
+its account once the Yoto API has accepted it (or the token endpoint has
+issued it); until then a request's data is kept apart under a hash of the
+credentials it presented.
+
+Verified tokens are remembered in the response cache backend, so all
+workers sharing it agree, until the token expires.
+"""
+import base64
+import hashlib
+import json
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+# How long a verified token is trusted when it carries no exp claim
+DEFAULT_TTL = 3600
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:32]
+
+
+def _claims(token: str) -> dict:
+    """The unverified claims of a JWT, or {}."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (IndexError, ValueError, AttributeError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def _key(token: str) -> str:
+    return f'yoto-identity:{_digest(token)}'
+
+
+def vouch(token: Optional[str]):
+    """Record that the Yoto API accepted (or issued) token, mapping it to its account."""
+    if not token:
+        return
+    backend = caches[settings.YOTO_CACHE_ALIAS]
+    key = _key(token)
+    if backend.get(key) is not None:
+        return
+    claims = _claims(token)
+    # The claims can be trusted now that the issuer has accepted the token
+    account = _digest(claims['sub']) if isinstance(claims.get('sub'), str) else _digest(token)
+    ttl = DEFAULT_TTL
+    if isinstance(claims.get('exp'), (int, float)):
+        ttl = int(claims['exp'] - time.time())
+    if ttl > 0:
+        backend.set(key, account, ttl)
+
+
+def verified_account(client) -> Optional[str]:
+    """The account of the client's access token, if the Yoto API has accepted it."""
+    if not client.access_token:
+        return None
+    return caches[settings.YOTO_CACHE_ALIAS].get(_key(client.access_token))
+
+
+def credentials_key(client) -> str:
+    """Hash of the credentials a client presents (its access token, else its refresh token)."""
+    return _digest(client.access_token or client.refresh_token or '')
+
+
+def account_key(client) -> str:
+    """The verified account of a client, else the hash of its unverified credentials."""
+    return verified_account(client) or credentials_key(client)
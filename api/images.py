@@ -0,0 +1,173 @@
+"""
+Chapter icon sprite atlases and resized cover thumbnails.
+
+A card's chapter and track icons are fetched once (through the media
+store), packed into a single PNG atlas, and described by a coordinate map,
+so the browser loads one image per card instead of one per chapter.
+Covers are resized to the nearest of YOTO_THUMBNAIL_WIDTHS and encoded
+as WebP (or PNG).
+
+Generated images are kept in the media store like downloaded ones, keyed
+by their inputs, so they are built once and evicted with everything else.
+Needs Pillow; without it is_available() is False and the views answer 501.
+With the media store disabled (YOTO_MEDIA_STORE_ENABLED) they answer 404.
+"""
+import hashlib
+import io
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from . import cache, media_store
+
+try:
+    from PIL import Image, features
+except ImportError:  # pragma: no cover - optional dependency
+    Image = features = None
+
+ICON_SIZE = 16
+FORMATS = {'webp': 'image/webp', 'png': 'image/png'}
+
+
+def is_available() -> bool:
+    return Image is not None
+
+
+def derived_key(*parts: Any) -> str:
+    """Media store index key for a generated image."""
+    return hashlib.sha256(':'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def chapter_icons(card: Dict[str, Any]) -> Dict[str, str]:
+    """{path: icon URL} for a card's chapters ('<c>') and tracks ('<c>/<t>')."""
+    icons = {}
+    for c, chapter in enumerate(cache.get_chapters(card)):
+        icon = (chapter.get('display') or {}).get('icon16x16')
+        if icon:
+            icons[str(c)] = icon
+        for t, track in enumerate(chapter.get('tracks') or []):
+            icon = (track.get('display') or {}).get('icon16x16')
+            if icon:
+                icons[f'{c}/{t}'] = icon
+    return icons
+
+
+def atlas_layout(count: int, size: int = ICON_SIZE) -> Tuple[int, int, List[Tuple[int, int]]]:
+    """(width, height, [(x, y), ...]) of a near-square grid of count tiles."""
+    if count <= 0:
+        return 0, 0, []
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    positions = [((i % columns) * size, (i // columns) * size) for i in range(count)]
+    return columns * size, rows * size, positions
+
+
+def _open(content_hash: str) -> 'Image.Image':
+    path = media_store.get_store().open_object(content_hash)
+    if path is None:
+        raise media_store.MediaStoreError('Media was evicted, please retry')
+    with Image.open(path) as image:
+        image.load()
+        return image
+
+
+def _encode(image: 'Image.Image', fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, 'WEBP', quality=settings.YOTO_THUMBNAIL_QUALITY, method=4)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def build_sprite(card: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pack a card's icons into one atlas; returns the coordinate map.
+
+    {'sprite': <hash>, 'width', 'height', 'size', 'icons': {path: [x, y]},
+     'errors': {path: message}}. Identical icons share one tile.
+    """
+    store = media_store.get_store()
+    icons = chapter_icons(card)
+    urls = list(dict.fromkeys(icons.values()))
+
+    def fetch(url):
+        try:
+            return url, store.fetch(url)[0], None
+        except media_store.MediaStoreError as e:
+            return url, None, str(e)
+
+    hashes, failures = {}, {}
+    if urls:
+        with ThreadPoolExecutor(max_workers=min(settings.YOTO_BATCH_MAX_WORKERS, len(urls))) as executor:
+            for url, content_hash, error in executor.map(fetch, urls):
+                if content_hash:
+                    hashes[url] = content_hash
+                else:
+                    failures[url] = error
+
+    # The same picture from different URLs also shares a tile
+    tiles = list(dict.fromkeys(hashes.values()))
+    width, height, positions = atlas_layout(len(tiles))
+    key = derived_key('sprite', ICON_SIZE, *tiles)
+    found = store.lookup_key(key) if tiles else None
+    if tiles and found is None:
+        atlas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for content_hash, position in zip(tiles, positions):
+            icon = _open(content_hash).convert('RGBA')
+            if icon.size != (ICON_SIZE, ICON_SIZE):
+                icon = icon.resize((ICON_SIZE, ICON_SIZE), Image.LANCZOS)
+            atlas.paste(icon, position)
+        sprite = store.put(key, _encode(atlas, 'png'), FORMATS['png'])
+    else:
+        sprite = found[0] if found else None
+
+    tile_at = dict(zip(tiles, positions))
+    return {
+        'sprite': sprite,
+        'width': width,
+        'height': height,
+        'size': ICON_SIZE,
+        'icons': {path: list(tile_at[hashes[url]]) for path, url in icons.items() if url in hashes},
+        'errors': {path: failures[url] for path, url in icons.items() if url in failures},
+    }
+
+
+def thumbnail_width(requested: Optional[int]) -> int:
+    """The smallest configured width at least as wide as requested (else the largest)."""
+    widths = sorted(settings.YOTO_THUMBNAIL_WIDTHS)
+    if requested is None:
+        return widths[-1]
+    return next((w for w in widths if w >= requested), widths[-1])
+
+
+def thumbnail_format(requested: Optional[str], accept: str = '') -> str:
+    """webp or png: as requested, else WebP when the browser accepts it and Pillow can write it."""
+    webp = features.check('webp')
+    if requested in FORMATS:
+        return requested if requested != 'webp' or webp else 'png'
+    return 'webp' if webp and 'image/webp' in accept else 'png'
+
+
+def build_thumbnail(cover_url: str, width: int, fmt: str) -> Tuple[str, str]:
+    """(hash, content_type) of the cover scaled to width (never enlarged)."""
+    store = media_store.get_store()
+    source = store.fetch(cover_url)[0]
+    key = derived_key('thumbnail', source, width, fmt)
+    found = store.lookup_key(key)
+    if found:
+        return found
+
+    image = _open(source)
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    return store.put(key, _encode(image, fmt), FORMATS[fmt]), FORMATS[fmt]
+
+
+def cover_url(card: Dict[str, Any]) -> Optional[str]:
+    card = card.get('card', card)
+    cover = (card.get('metadata') or {}).get('cover') or {}
+    return cover.get('imageL') or cover.get('imageM') or cover.get('imageS')
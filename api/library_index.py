@@ -0,0 +1,190 @@
+"""
+Sorted, filtered and cursor-paginated views of an account's library.
+
+/api/library/?limit=50&sort=-updatedAt&category=stories returns one page of
+cards plus a nextCursor for the next one, so the first screen of a large
+library renders from a small response. Pages are cut from a per-account
+in-memory LibraryIndex built from the cached /content/mine listing. When
+the listing changes, only the entries of cards whose fingerprint (see
+library_sync) changed are recomputed.
+
+Cursors are keyset cursors (the sort value and cardId of the last card
+returned), so paging stays consistent when cards are added or removed
+between pages.
+"""
+import base64
+import binascii
+import bisect
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .library_sync import fingerprint
+
+SORT_KEYS = ('title', 'updatedAt', 'duration')
+# The type of each sort key's values (see sort_values), checked on cursors
+SORT_TYPES = {'title': str, 'updatedAt': str, 'duration': (int, float)}
+# Query parameters that select the paginated response shape
+PAGE_PARAMS = ('limit', 'cursor', 'sort', 'q', 'category', 'author')
+
+
+def _metadata(card: Dict[str, Any]) -> Dict[str, Any]:
+    return card.get('metadata') or {}
+
+
+def sort_values(card: Dict[str, Any]) -> Dict[str, Any]:
+    """The comparable value of each sort key for a card."""
+    duration = (_metadata(card).get('media') or {}).get('duration')
+    return {
+        'title': (card.get('title') or '').casefold(),
+        'updatedAt': str(card.get('updatedAt') or ''),
+        'duration': float(duration) if isinstance(duration, (int, float)) else 0.0,
+    }
+
+
+class LibraryQuery:
+    """Parsed paging, sort and filter parameters."""
+
+    def __init__(self, params):
+        raw_sort = params.get('sort') or 'title'
+        self.descending = raw_sort.startswith('-')
+        self.sort = raw_sort.lstrip('-')
+        if self.sort not in SORT_KEYS:
+            raise ValueError(f'sort must be one of {", ".join(SORT_KEYS)} (prefix with - for descending)')
+        try:
+            limit = int(params.get('limit') or settings.YOTO_LIBRARY_PAGE_SIZE)
+        except ValueError:
+            raise ValueError('limit must be a number')
+        self.limit = min(max(limit, 1), settings.YOTO_LIBRARY_MAX_PAGE_SIZE)
+        self.text = (params.get('q') or '').strip().casefold()
+        self.category = params.get('category') or None
+        self.author = params.get('author') or None
+        self.after = self._decode_cursor(params.get('cursor')) if params.get('cursor') else None
+
+    @staticmethod
+    def wanted(params) -> bool:
+        """True if the request asked for a page rather than the full listing."""
+        return any(params.get(name) for name in PAGE_PARAMS)
+
+    def _decode_cursor(self, cursor: str) -> Tuple[Any, str]:
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            sort, descending, value, card_id = json.loads(base64.urlsafe_b64decode(padded))
+        except (binascii.Error, ValueError, TypeError):
+            raise ValueError('Invalid cursor')
+        if sort != self.sort or descending != self.descending:
+            raise ValueError('cursor was issued for a different sort order')
+        # A cursor is compared against the index's (value, cardId) pairs, so
+        # anything of another type would fail there instead of here
+        if (not isinstance(value, SORT_TYPES[self.sort]) or isinstance(value, bool)
+                or not isinstance(card_id, str)):
+            raise ValueError('Invalid cursor')
+        if self.sort == 'duration':
+            value = float(value)
+        return value, card_id
+
+    def encode_cursor(self, value: Any, card_id: str) -> str:
+        raw = json.dumps([self.sort, self.descending, value, card_id], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def matches(self, card: Dict[str, Any]) -> bool:
+        metadata = _metadata(card)
+        if self.category and metadata.get('category') != self.category:
+            return False
+        if self.author and metadata.get('author') != self.author:
+            return False
+        if self.text and self.text not in (card.get('title') or '').casefold():
+            return False
+        return True
+
+
+class LibraryIndex:
+    """One account's library with lazily built orderings per sort key."""
+
+    def __init__(self, library: List[Dict[str, Any]], previous: Optional['LibraryIndex'] = None):
+        self.cards: Dict[str, Dict[str, Any]] = {}
+        self.prints: Dict[str, str] = {}
+        self.values: Dict[str, Dict[str, Any]] = {}
+        reused = previous.values if previous is not None else {}
+        for card in library:
+            card_id = card.get('cardId')
+            if not card_id:
+                continue
+            self.cards[card_id] = card
+            self.prints[card_id] = fingerprint(card)
+            unchanged = previous is not None and previous.prints.get(card_id) == self.prints[card_id]
+            self.values[card_id] = reused[card_id] if unchanged else sort_values(card)
+        self._orders: Dict[str, List[Tuple[Any, str]]] = {}
+        self._lock = threading.Lock()
+
+    def same_as(self, library: List[Dict[str, Any]]) -> bool:
+        if len(library) != len(self.cards):
+            return False
+        return all(self.prints.get(card.get('cardId')) == fingerprint(card) for card in library)
+
+    def order(self, sort: str) -> List[Tuple[Any, str]]:
+        """(value, cardId) pairs in ascending order of sort."""
+        order = self._orders.get(sort)
+        if order is None:
+            with self._lock:
+                order = self._orders.get(sort)
+                if order is None:
+                    order = self._orders[sort] = sorted(
+                        (values[sort], card_id) for card_id, values in self.values.items())
+        return order
+
+    def page(self, query: LibraryQuery) -> Dict[str, Any]:
+        """{'items', 'nextCursor', 'total'} for a query."""
+        order = self.order(query.sort)
+        if query.descending:
+            end = bisect.bisect_left(order, query.after) if query.after else len(order)
+            candidates = (order[i] for i in range(end - 1, -1, -1))
+        else:
+            start = bisect.bisect_right(order, query.after) if query.after else 0
+            candidates = (order[i] for i in range(start, len(order)))
+
+        items: List[Dict[str, Any]] = []
+        next_cursor = None
+        for value, card_id in candidates:
+            card = self.cards[card_id]
+            if not query.matches(card):
+                continue
+            if len(items) == query.limit:
+                last = items[-1]['cardId']
+                next_cursor = query.encode_cursor(self.values[last][query.sort], last)
+                break
+            items.append(card)
+
+        total = sum(1 for card in self.cards.values() if query.matches(card))
+        return {'items': items, 'nextCursor': next_cursor, 'total': total}
+
+
+class IndexRegistry:
+    """Per-account indexes, least recently used dropped first."""
+
+    def __init__(self, max_accounts: int):
+        self.max_accounts = max(1, max_accounts)
+        self._lock = threading.Lock()
+        self._indexes: 'OrderedDict[str, LibraryIndex]' = OrderedDict()
+
+    def index_for(self, account: str, library: List[Dict[str, Any]]) -> LibraryIndex:
+        """The account's index, rebuilt (incrementally) if library has changed."""
+        with self._lock:
+            index = self._indexes.pop(account, None)
+        if index is None or not index.same_as(library):
+            index = LibraryIndex(library, previous=index)
+        with self._lock:
+            self._indexes[account] = index
+            while len(self._indexes) > self.max_accounts:
+                self._indexes.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+indexes = IndexRegistry(settings.YOTO_LIBRARY_INDEX_ACCOUNTS)
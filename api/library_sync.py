@@ -0,0 +1,95 @@
+"""
+Incremental library sync for /api/library/sync.
+
+Every sync response carries a syncToken naming a server-side snapshot of
+the library: a {cardId: fingerprint} map stored per account in the
+response cache for YOTO_SYNC_SNAPSHOT_TTL seconds. A client that sends its
+last token back as ?since= gets only the cards added, changed or removed
+since then, so a refresh costs O(changes) on the wire instead of
+re-sending the whole library. Unknown or expired tokens fall back to a
+full listing (full: true), after which the client replaces its copy.
+
+Snapshots are keyed by a hash of their content, so unchanged libraries
+reuse the same token and devices on the same account share snapshots.
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from . import cache
+
+Fingerprints = Dict[str, str]
+
+
+def fingerprint(card: Dict[str, Any]) -> str:
+    """A card's version: its updatedAt, or a hash of its content if it has none."""
+    if card.get('updatedAt'):
+        return str(card['updatedAt'])
+    body = json.dumps(card, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()[:16]
+
+
+def fingerprints(library: List[Dict[str, Any]]) -> Fingerprints:
+    return {card['cardId']: fingerprint(card) for card in library if card.get('cardId')}
+
+
+def snapshot_token(prints: Fingerprints) -> str:
+    """Content-addressed token for a snapshot."""
+    body = json.dumps(sorted(prints.items()), separators=(',', ':'))
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()[:24]
+
+
+def diff(previous: Optional[Fingerprints], library: List[Dict[str, Any]], token: str) -> Dict[str, Any]:
+    """
+    The sync payload for library relative to the previous snapshot.
+
+    With no previous snapshot every card is returned under 'added' and
+    'full' is true.
+    """
+    if previous is None:
+        return {'syncToken': token, 'full': True, 'added': library, 'changed': [], 'removed': []}
+    added, changed = [], []
+    seen = set()
+    for card in library:
+        card_id = card.get('cardId')
+        if not card_id:
+            continue
+        seen.add(card_id)
+        if card_id not in previous:
+            added.append(card)
+        elif previous[card_id] != fingerprint(card):
+            changed.append(card)
+    removed = [card_id for card_id in previous if card_id not in seen]
+    return {'syncToken': token, 'full': False, 'added': added, 'changed': changed, 'removed': removed}
+
+
+def _snapshot_key(account: str, token: str) -> str:
+    return cache.response_cache.make_key(account, 'sync', token)
+
+
+def sync_library(client, since: Optional[str] = None, refresh: bool = False) -> Dict[str, Any]:
+    """Library changes since the snapshot named by since (all cards if unknown)."""
+    library = cache.get_library(client, refresh=refresh)
+    account = cache.account_key(client)
+    backend = cache.response_cache.backend
+
+    prints = fingerprints(library)
+    token = snapshot_token(prints)
+    previous = backend.get(_snapshot_key(account, since)) if since else None
+    backend.set(_snapshot_key(account, token), prints, settings.YOTO_SYNC_SNAPSHOT_TTL)
+    return diff(previous, library, token)
+
+
+async def async_sync_library(client, since: Optional[str] = None, refresh: bool = False) -> Dict[str, Any]:
+    """Async sync_library()."""
+    library = await cache.aget_library(client, refresh=refresh)
+    account = cache.account_key(client)
+    backend = cache.response_cache.backend
+
+    prints = fingerprints(library)
+    token = snapshot_token(prints)
+    previous = await backend.aget(_snapshot_key(account, since)) if since else None
+    await backend.aset(_snapshot_key(account, token), prints, settings.YOTO_SYNC_SNAPSHOT_TTL)
+    return diff(previous, library, token)
@@ -0,0 +1,106 @@
+"""
+Logging helpers for the Yoto proxy.
+
+Modules log through `logging.getLogger(__name__)` with %-style arguments, so
+messages below YOTO_LOG_LEVEL cost a level check and nothing else. Records
+that are emitted pass through RedactingFilter (tokens, secrets and OAuth
+codes are masked) and are handed to a QueueLogHandler, which only enqueues
+them; a background listener thread does the formatting and the stdout write,
+so request threads never contend on the stream lock.
+
+The handlers are wired up by the LOGGING setting.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import time
+
+# Any JWT (header.payload.signature, base64url) such as Yoto access tokens
+_JWT = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]*')
+# "Bearer <token>" as found in Authorization headers
+_BEARER = re.compile(r'(Bearer\s+)[^\s\'",}]+', re.IGNORECASE)
+# key=value / "key": "value" pairs whose value is a credential
+_SECRET_FIELD = re.compile(
+    r'''(?<![\w-])(?P<key>(?:access|refresh|id)_?token|client_?secret|code|authorization|x-[a-z-]*(?:token|secret))'''
+    r'''(?P<sep>["']?\s*[:=]\s*["']?)(?P<value>[^\s"'&,}]+)''',
+    re.IGNORECASE,
+)
+
+REDACTED = '[redacted]'
+
+
+def redact(text: str) -> str:
+    """Mask tokens, secrets and authorization codes in a log message."""
+    text = _JWT.sub(REDACTED, text)
+    text = _BEARER.sub(r'\1' + REDACTED, text)
+    return _SECRET_FIELD.sub(lambda m: m.group('key') + m.group('sep') + REDACTED, text)
+
+
+class RedactingFilter(logging.Filter):
+    """Render each record's message (and traceback) with credentials masked."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers (YOTO_LOG_FORMAT=json)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                    + '.%03dZ' % record.msecs,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Non-blocking handler: records are queued and written by a listener thread.
+
+    The listener writes to a StreamHandler (stderr by default) that uses this
+    handler's formatter. Filters on this handler (e.g. RedactingFilter) run
+    in the calling thread, before the record is queued.
+    """
+
+    def __init__(self, stream=None, maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener formats the record; only make it safe to hand over
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # Drop rather than block a request when the writer falls behind
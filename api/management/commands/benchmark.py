@@ -0,0 +1,126 @@
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from api import transport
+from api.benchmark import run_load
+from api.fakeyoto import CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN, FakeYotoAPI
+
+ENDPOINTS = ('library', 'players', 'card', 'batch', 'track')
+
+
+class Command(BaseCommand):
+    help = ("Measure proxy throughput and latency percentiles against a local fake Yoto API "
+            "(in process), or against a running server with --target.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('endpoints', nargs='*',
+                            help=f"Endpoints to drive: {', '.join(ENDPOINTS)} (default: library players card)")
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=10,
+                            help='Concurrent requests')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Bypass the server-side response cache (?refresh=1)')
+        parser.add_argument('--target',
+                            help='Base URL of a running proxy (e.g. http://127.0.0.1:8000) to drive over HTTP '
+                                 'instead of in process; start it against `manage.py fake_yoto`')
+        parser.add_argument('--cards', type=int, default=20,
+                            help='Cards in the fake library (in-process mode)')
+        parser.add_argument('--latency', type=float, default=0.02,
+                            help='Fake upstream latency in seconds (in-process mode)')
+        parser.add_argument('--jitter', type=float, default=0.01,
+                            help='Fake upstream latency jitter in seconds (in-process mode)')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction of fake upstream requests that fail with 503 (in-process mode)')
+        parser.add_argument('--json', action='store_true',
+                            help='Print results as JSON lines')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'] or ['library', 'players', 'card']
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+        headers = {
+            'X-Refresh-Token': REFRESH_TOKEN,
+            'X-Client-Id': CLIENT_ID,
+            'X-Client-Secret': CLIENT_SECRET,
+        }
+
+        if options['target']:
+            target = options['target'].rstrip('/')
+            # The fake API accepts any bearer token; a refresh is only needed against real upstreams
+            headers['X-Access-Token'] = 'benchmark-token'
+            self._run(endpoints, options, headers, self._http_caller(target, headers), 20)
+            return
+
+        fake = FakeYotoAPI(cards=options['cards'], latency=options['latency'],
+                           jitter=options['jitter'], error_rate=options['error_rate']).start()
+        headers['X-Access-Token'] = fake.issue_token()
+        try:
+            with override_settings(YOTO_API_BASE_URL=fake.url, YOTO_AUTH_BASE_URL=fake.url):
+                caches[settings.YOTO_CACHE_ALIAS].clear()
+                self._run(endpoints, options, headers, self._client_caller(headers), options['cards'])
+            if not options['json']:
+                self.stdout.write(f"Fake upstream requests: {dict(sorted(fake.requests.items()))}")
+        finally:
+            fake.stop()
+
+    def _client_caller(self, headers):
+        """Issue requests through Django's test client, one client per thread."""
+        local = threading.local()
+        host = next((h for h in settings.ALLOWED_HOSTS if h != '*' and not h.startswith('.')), '127.0.0.1')
+
+        def call(method, path, body=None):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client(HTTP_HOST=host)
+            if method == 'POST':
+                response = client.post(path, body, content_type='application/json', headers=headers)
+            else:
+                response = client.get(path, headers=headers)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            return response.status_code
+        return call
+
+    def _http_caller(self, target, headers):
+        """Issue requests over HTTP with the shared keep-alive session."""
+        def call(method, path, body=None):
+            response = transport.request(method, target + path, headers=headers,
+                                         data=json.dumps(body) if body is not None else None)
+            return response.status_code
+        return call
+
+    def _run(self, endpoints, options, headers, call, cards):
+        suffix = '?refresh=1' if options['no_cache'] else ''
+        card_ids = [f'card{i:04d}' for i in range(max(cards, 1))]
+        requests = {
+            'library': lambda i: call('GET', f'/api/library/{suffix}'),
+            'players': lambda i: call('GET', '/api/players/'),
+            'card': lambda i: call('GET', f'/api/card/{card_ids[i % len(card_ids)]}/{suffix}'),
+            'batch': lambda i: call('POST', '/api/cards/batch' + suffix,
+                                    {'cardIds': card_ids, 'playable': False}),
+            'track': lambda i: call('GET', f'/api/card/{card_ids[i % len(card_ids)]}/track/0'),
+        }
+
+        if not options['json']:
+            self.stdout.write(f"{'endpoint':<10} {'requests':>8} {'errors':>6} {'rps':>8} "
+                              f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name in endpoints:
+            result = run_load(name, requests[name], options['requests'], options['concurrency'])
+            summary = result.summary()
+            if options['json']:
+                self.stdout.write(json.dumps(summary))
+            else:
+                self.stdout.write(
+                    f"{name:<10} {summary['requests']:>8} {summary['errors']:>6} {summary['rps']:>8} "
+                    f"{summary['p50_ms']:>8} {summary['p95_ms']:>8} {summary['p99_ms']:>8} {summary['max_ms']:>8}"
+                )
+            if result.errors == len(result.statuses):
+                raise CommandError(f"Every {name} request failed (statuses: {sorted(set(result.statuses))})")
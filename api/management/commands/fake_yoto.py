@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from api.fakeyoto import CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN, FakeYotoAPI
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the Yoto API, OAuth server and audio host."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--cards', type=int, default=20,
+                            help='Cards in the generated library')
+        parser.add_argument('--chapters', type=int, default=5,
+                            help='Chapters per card')
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds added to every API response')
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help='Random extra latency, up to this many seconds')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction of API requests answered with 503')
+
+    def handle(self, *args, **options):
+        fake = FakeYotoAPI(
+            host=options['host'], port=options['port'], cards=options['cards'],
+            chapters=options['chapters'], latency=options['latency'],
+            jitter=options['jitter'], error_rate=options['error_rate'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Fake Yoto API listening on {fake.url}"))
+        self.stdout.write("Point the proxy at it with:")
+        self.stdout.write(f"  YOTO_API_BASE_URL={fake.url}")
+        self.stdout.write(f"  YOTO_AUTH_BASE_URL={fake.url}")
+        self.stdout.write(f"Credentials: client id {CLIENT_ID}, client secret {CLIENT_SECRET}, "
+                          f"refresh token {REFRESH_TOKEN}; any bearer token is accepted.")
+        try:
+            fake.serve_forever()
+        except KeyboardInterrupt:
+            pass
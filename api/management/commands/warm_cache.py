@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.warmup import CacheWarmer
+
+
+class Command(BaseCommand):
+    help = "Keep the Yoto response cache warm using the server's .env credentials."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Warm the cache once and exit')
+        parser.add_argument('--interval', type=int, default=settings.YOTO_WARM_INTERVAL,
+                            help='Maximum seconds between runs (shortened to beat URL signature expiry)')
+        parser.add_argument('--concurrency', type=int, default=settings.YOTO_WARM_CONCURRENCY,
+                            help='Parallel upstream card fetches')
+        parser.add_argument('--cards', type=int, default=settings.YOTO_WARM_MAX_CARDS,
+                            help='How many recently opened cards to warm')
+
+    def handle(self, *args, **options):
+        if not settings.USE_ENV_CREDENTIALS:
+            raise CommandError("warm_cache requires USE_ENV_CREDENTIALS=true and credentials in .env")
+
+        if 'locmem' in settings.CACHES[settings.YOTO_CACHE_ALIAS]['BACKEND'].lower():
+            self.stderr.write(self.style.WARNING(
+                "The 'yoto' cache is in-process (locmem), so this command cannot warm the web server's "
+                "cache. Use a shared YOTO_CACHE_BACKEND (file or Redis) or set YOTO_WARM_IN_PROCESS=true."
+            ))
+
+        warmer = CacheWarmer(options['concurrency'], options['interval'], options['cards'])
+        if options['once']:
+            delay = warmer.warm_once()
+            self.stdout.write(self.style.SUCCESS(f"Cache warmed; next run would be in {delay}s"))
+            return
+
+        try:
+            warmer.run_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,268 @@
+"""
+Optional server-side store for card artwork and chapter icons.
+
+Media is downloaded once per server rather than once per device. Files are
+content-addressed (SHA-256 of the bytes) under YOTO_MEDIA_STORE_DIR, so the
+same image referenced from several cards or URLs is stored once. Total size
+is capped at YOTO_MEDIA_STORE_MAX_BYTES with least-recently-used eviction,
+and a single download at a tenth of that.
+
+Only hosts in YOTO_MEDIA_ALLOWED_HOSTS are fetched from, and redirects are
+followed only to those hosts too.
+
+Layout:
+    objects/<h[:2]>/<h>   file contents, named by their hash
+    index/<k[:2]>/<k>     JSON {"hash", "content_type"} for source URL key k
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Optional, Tuple
+from urllib.parse import quote, urljoin, urlparse
+
+from django.conf import settings
+
+from . import cache, transport
+
+# Redirects followed (each to an allowed host) before a download is given up
+MAX_REDIRECTS = 5
+
+
+class MediaStoreError(Exception):
+    """Raised when a media file cannot be fetched or stored."""
+
+
+def is_enabled() -> bool:
+    return settings.YOTO_MEDIA_STORE_ENABLED
+
+
+def is_allowed_source(url: str) -> bool:
+    """Only fetch over HTTP(S) from configured hosts (and their subdomains)."""
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if parsed.scheme not in ('http', 'https') or not host:
+        return False
+    return any(host == allowed or host.endswith('.' + allowed)
+               for allowed in settings.YOTO_MEDIA_ALLOWED_HOSTS)
+
+
+def source_key(url: str) -> str:
+    """Index key for a URL, ignoring query strings such as signatures."""
+    parsed = urlparse(url)
+    return hashlib.sha256(f"{parsed.netloc}{parsed.path}".encode('utf-8')).hexdigest()
+
+
+class MediaStore:
+    """Content-addressed file store with a size cap and LRU eviction."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # One object may take up at most a tenth of the store
+        self.max_object_bytes = max(1, max_bytes // 10)
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    def _object_path(self, content_hash: str) -> Path:
+        return self.root / 'objects' / content_hash[:2] / content_hash
+
+    def _index_path(self, key: str) -> Path:
+        return self.root / 'index' / key[:2] / key
+
+    def _iter_objects(self):
+        objects = self.root / 'objects'
+        if objects.is_dir():
+            yield from (p for p in objects.glob('*/*') if p.is_file())
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(p.stat().st_size for p in self._iter_objects())
+            return self._total_bytes
+
+    def open_object(self, content_hash: str) -> Optional[Path]:
+        """Return the path of a stored object and mark it as recently used."""
+        if len(content_hash) != 64 or not all(c in '0123456789abcdef' for c in content_hash):
+            return None
+        path = self._object_path(content_hash)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def lookup(self, url: str) -> Optional[Tuple[str, str]]:
+        """Return (hash, content_type) for a previously stored URL."""
+        return self.lookup_key(source_key(url))
+
+    def lookup_key(self, key: str) -> Optional[Tuple[str, str]]:
+        """Return (hash, content_type) stored under an index key."""
+        try:
+            entry = json.loads(self._index_path(key).read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+        if self.open_object(entry['hash']) is None:
+            return None
+        return entry['hash'], entry['content_type']
+
+    def _place(self, tmp_name: str, content_hash: str, size: int, key: str, content_type: str):
+        """Move a hashed temporary file into place and index it under key."""
+        path = self._object_path(content_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.total_bytes()  # Size the store before adding to it
+        if path.exists():
+            os.unlink(tmp_name)
+            os.utime(path)
+        else:
+            os.replace(tmp_name, path)
+            self._add_bytes(size)
+
+        index_path = self._index_path(key)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        index_path.write_text(json.dumps({'hash': content_hash, 'content_type': content_type}))
+        self.evict()
+
+    def put(self, key: str, data: bytes, content_type: str) -> str:
+        """Store generated bytes (e.g. a resized image) under an index key; returns their hash."""
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            tmp.write(data)
+        content_hash = hashlib.sha256(data).hexdigest()
+        self._place(tmp.name, content_hash, len(data), key, content_type)
+        return content_hash
+
+    def fetch(self, url: str) -> Tuple[str, str]:
+        """
+        Return (hash, content_type) for url, downloading it if not stored yet.
+
+        The body is streamed to a temporary file while it is hashed, then
+        moved into place; identical content from another URL is kept once.
+        """
+        found = self.lookup(url)
+        if found:
+            return found
+
+        response = self._open(url)
+
+        content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        tmp_dir = self.root / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        tmp = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        try:
+            with tmp:
+                for chunk in response.iter_content(settings.YOTO_STREAM_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_object_bytes:
+                        raise MediaStoreError(f"Media is larger than {self.max_object_bytes} bytes")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+        except Exception as e:
+            os.unlink(tmp.name)
+            if isinstance(e, MediaStoreError):
+                raise
+            raise MediaStoreError(f"Failed to download media: {e}") from e
+        finally:
+            response.close()
+
+        content_hash = digest.hexdigest()
+        self._place(tmp.name, content_hash, size, source_key(url), content_type)
+        return content_hash, content_type
+
+    def _open(self, url: str):
+        """Start downloading url, following redirects only to allowed hosts."""
+        for _ in range(MAX_REDIRECTS + 1):
+            if not is_allowed_source(url):
+                raise MediaStoreError(f"Media host not allowed: {urlparse(url).hostname}")
+            try:
+                response = transport.request('GET', url, stream=True, allow_redirects=False)
+                if not response.is_redirect:
+                    response.raise_for_status()
+            except Exception as e:
+                raise MediaStoreError(f"Failed to download media: {e}") from e
+            if not response.is_redirect:
+                declared = response.headers.get('Content-Length', '')
+                if declared.isdigit() and int(declared) > self.max_object_bytes:
+                    response.close()
+                    raise MediaStoreError(f"Media is larger than {self.max_object_bytes} bytes")
+                return response
+            url = urljoin(url, response.headers['Location'])
+            response.close()
+        raise MediaStoreError("Failed to download media: too many redirects")
+
+    def _add_bytes(self, size: int):
+        total = self.total_bytes()
+        with self._lock:
+            self._total_bytes = total + size
+
+    def evict(self):
+        """Delete least-recently-used objects until the store is under 90% of its cap."""
+        if self.total_bytes() <= self.max_bytes:
+            return
+        with self._lock:
+            objects = sorted(((p.stat().st_mtime, p.stat().st_size, p) for p in self._iter_objects()),
+                             key=lambda item: item[0])
+            total = sum(size for _, size, _ in objects)
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in objects:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            # Index entries pointing at evicted objects are treated as misses
+            self._total_bytes = total
+
+
+_store: Optional[MediaStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> MediaStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MediaStore(settings.YOTO_MEDIA_STORE_DIR, settings.YOTO_MEDIA_STORE_MAX_BYTES)
+    return _store
+
+
+def proxied_url(url: str) -> str:
+    """URL under which the media store serves the given source URL."""
+    return f"/api/media/fetch?url={quote(url, safe='')}"
+
+
+def _rewrite(container: Any, field: str):
+    if isinstance(container, dict) and isinstance(container.get(field), str) \
+            and is_allowed_source(container[field]):
+        container[field] = proxied_url(container[field])
+
+
+def rewrite_card_media(card: Any) -> Any:
+    """Point a card's cover and chapter/track icons at the media store (in place)."""
+    if not isinstance(card, dict):
+        return card
+    inner = card.get('card', card)
+    cover = (inner.get('metadata') or {}).get('cover')
+    for field in ('imageL', 'imageM', 'imageS'):
+        _rewrite(cover, field)
+    for chapter in cache.get_chapters(card):
+        _rewrite(chapter.get('display'), 'icon16x16')
+        for track in chapter.get('tracks') or []:
+            _rewrite(track.get('display'), 'icon16x16')
+    return card
+
+
+def rewrite_library_media(cards: Any) -> Any:
+    """rewrite_card_media() for every card in a library listing."""
+    if isinstance(cards, list):
+        for card in cards:
+            rewrite_card_media(card)
+    return cards
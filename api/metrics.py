@@ -0,0 +1,247 @@
+"""
+Request timing and counters for the Yoto proxy, exposed at /api/metrics.
+
+MetricsMiddleware times every request and, through the timed() hook,
+collects a per-request breakdown of where the time went (credential
+parsing, token refresh, upstream calls, serialization). The breakdown is
+sent back in a Server-Timing header for browser devtools, and everything is
+aggregated into Prometheus-style counters and histograms.
+
+Metrics live in process memory; with several workers, each reports its own.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(labels)} {value:g}' for labels, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in self._values.items()]
+        lines = []
+        for labels, counts in items:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_labels(labels, ("le", f"{bound:g}"))} {count:g}')
+            lines.append(f'{self.name}_bucket{_format_labels(labels, ("le", "+Inf"))} {counts[-2]:g}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {counts[-2]:g}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {counts[-1]:.6f}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'yoto_request_duration_seconds', 'Time to handle a request, by endpoint.')
+requests_total = registry.counter(
+    'yoto_requests_total', 'Requests handled, by endpoint, method and status.')
+request_bytes = registry.counter(
+    'yoto_request_bytes_total', 'Request body bytes received, by endpoint.')
+response_bytes = registry.counter(
+    'yoto_response_bytes_total', 'Response body bytes sent (after compression), by endpoint.')
+phase_duration = registry.histogram(
+    'yoto_phase_duration_seconds', 'Time spent in a request phase (credentials, refresh, upstream, serialize).')
+upstream_responses = registry.counter(
+    'yoto_upstream_responses_total', 'Yoto API responses, by status code.')
+upstream_bytes = registry.counter(
+    'yoto_upstream_bytes_total', 'Response body bytes received from the Yoto API.')
+upstream_rejected = registry.counter(
+    'yoto_upstream_rejected_total', 'Upstream calls refused locally (circuit open or rate limited), by host.')
+upstream_coalesced = registry.counter(
+    'yoto_upstream_coalesced_total', 'Upstream GETs answered by an identical call already in flight.')
+token_refreshes = registry.counter(
+    'yoto_token_refreshes_total', 'Token refresh calls to the Yoto login endpoint, by outcome.')
+cache_lookups = registry.counter(
+    'yoto_cache_lookups_total', 'Response cache lookups, by endpoint and result (hit/miss).')
+
+
+def render_pool_stats(stats: Dict) -> str:
+    """Prometheus lines for transport.get_pool_stats() (connection reuse and pool headroom)."""
+    lines = [
+        '# HELP yoto_upstream_connections_total Upstream connections opened/reused by the shared pool.',
+        '# TYPE yoto_upstream_connections_total counter',
+        f'yoto_upstream_connections_total{{state="opened"}} {stats.get("opened", 0)}',
+        f'yoto_upstream_connections_total{{state="reused"}} {stats.get("reused", 0)}',
+        '# HELP yoto_upstream_pool_available Idle keep-alive connections, by host.',
+        '# TYPE yoto_upstream_pool_available gauge',
+    ]
+    for host, host_stats in stats.get('hosts', {}).items():
+        lines.append(f'yoto_upstream_pool_available{_format_labels(_labels({"host": host}))} '
+                     f'{host_stats["available"]}')
+    return '\n'.join(lines) + '\n'
+
+
+# Phase durations of the request being handled: {phase: seconds}
+_current_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = \
+    contextvars.ContextVar('yoto_request_timings', default=None)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Time a block as one phase of the current request (and globally)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        phase_duration.observe(elapsed, phase=phase)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + elapsed
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing header value; durations in milliseconds."""
+    entries = [f'{phase};dur={seconds * 1000:.1f}' for phase, seconds in timings.items()]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def content_length(request) -> int:
+    """The request's Content-Length, or 0 when it is missing or malformed."""
+    try:
+        return max(int(request.META.get('CONTENT_LENGTH') or 0), 0)
+    except ValueError:
+        return 0
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status and byte counts per endpoint and adds a
+    Server-Timing header with the request's phase breakdown.
+
+    Works for both sync and async views, so it is placed first in
+    MIDDLEWARE to include the time spent in the other middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = {}
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = {}
+        token = _current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        return self._finish(request, response, timings, time.perf_counter() - start)
+
+    def _finish(self, request, response, timings, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = (match.url_name or match.route) if match else 'unmatched'
+
+        request_duration.observe(elapsed, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        request_bytes.inc(content_length(request), endpoint=endpoint)
+        if not response.streaming:
+            response_bytes.inc(len(response.content), endpoint=endpoint)
+
+        response['Server-Timing'] = server_timing(timings, elapsed)
+        return response
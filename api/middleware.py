@@ -0,0 +1,109 @@
+"""
+HTTP middleware for the Yoto proxy.
+"""
+import gzip
+from typing import Optional
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:  # pragma: no cover - depends on Python version
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/', 'image/svg+xml')
+
+
+def available_encodings():
+    """Supported content codings, most preferred first."""
+    encodings = []
+    if zstd is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick our most preferred coding that the client accepts (q > 0)."""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.lower()] = q
+
+    for encoding in available_encodings():
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Encode body; level defaults to the configured level for the coding."""
+    if encoding == 'zstd':
+        level = settings.YOTO_ZSTD_LEVEL if level is None else level
+        if hasattr(zstd, 'ZstdCompressor'):
+            return zstd.ZstdCompressor(level=level).compress(body)
+        return zstd.compress(body, level=level)
+    if encoding == 'br':
+        level = settings.YOTO_BROTLI_QUALITY if level is None else level
+        return brotli.compress(body, quality=level)
+    level = settings.YOTO_GZIP_LEVEL if level is None else level
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress text and JSON responses with zstd, brotli or gzip.
+
+    Like django.middleware.gzip.GZipMiddleware, but negotiates the best
+    coding available (brotli/zstd when their modules are installed). Bodies
+    that are streamed, already encoded or smaller than
+    YOTO_COMPRESSION_MIN_BYTES are left alone.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < settings.YOTO_COMPRESSION_MIN_BYTES:
+            return response
+
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The encoded bytes differ from the identity representation
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
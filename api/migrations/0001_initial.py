@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+# External-content FTS5 index over SearchEntry, kept in sync by triggers
+FTS_SQL = [
+    """CREATE VIRTUAL TABLE api_searchentry_fts USING fts5(
+        title, body, content='api_searchentry', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER api_searchentry_ai AFTER INSERT ON api_searchentry BEGIN
+        INSERT INTO api_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER api_searchentry_ad AFTER DELETE ON api_searchentry BEGIN
+        INSERT INTO api_searchentry_fts(api_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER api_searchentry_au AFTER UPDATE ON api_searchentry BEGIN
+        INSERT INTO api_searchentry_fts(api_searchentry_fts, rowid, title, body)
+        VALUES ('delete', old.id, old.title, old.body);
+        INSERT INTO api_searchentry_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+    END""",
+]
+
+DROP_FTS_SQL = [
+    'DROP TRIGGER IF EXISTS api_searchentry_au',
+    'DROP TRIGGER IF EXISTS api_searchentry_ad',
+    'DROP TRIGGER IF EXISTS api_searchentry_ai',
+    'DROP TABLE IF EXISTS api_searchentry_fts',
+]
+
+
+def create_fts(apps, schema_editor):
+    """Add the FTS5 index on SQLite builds that have it; api.search falls back to LIKE otherwise."""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+    for statement in FTS_SQL:
+        schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_FTS_SQL:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=64)),
+                ('card_id', models.CharField(max_length=64)),
+                ('path', models.CharField(blank=True, default='', max_length=32)),
+                ('kind', models.CharField(choices=[('card', 'Card'), ('chapter', 'Chapter'), ('track', 'Track')], max_length=8)),
+                ('title', models.TextField(blank=True, default='')),
+                ('body', models.TextField(blank=True, default='')),
+                ('card_title', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'card_id', 'path'), name='api_searchentry_unique_path')],
+            },
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
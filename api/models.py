@@ -1,3 +1,33 @@
 from django.db import models
 
-# Create your models here.
+
+class SearchEntry(models.Model):
+    """
+    One searchable card, chapter or track of an account's library.
+
+    Rows are mirrored into the api_searchentry_fts FTS5 table by triggers
+    (see migration 0001); api.search keeps them up to date.
+    """
+
+    CARD = 'card'
+    CHAPTER = 'chapter'
+    TRACK = 'track'
+    KINDS = [(CARD, 'Card'), (CHAPTER, 'Chapter'), (TRACK, 'Track')]
+
+    account = models.CharField(max_length=64)
+    card_id = models.CharField(max_length=64)
+    # '' for the card itself, '<chapter>' or '<chapter>/<track>' (0-based indexes)
+    path = models.CharField(max_length=32, blank=True, default='')
+    kind = models.CharField(max_length=8, choices=KINDS)
+    title = models.TextField(blank=True, default='')
+    # Secondary text: author, category, description
+    body = models.TextField(blank=True, default='')
+    card_title = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'card_id', 'path'], name='api_searchentry_unique_path'),
+        ]
+
+    def __str__(self):
+        return f'{self.card_id}/{self.path}: {self.title}'
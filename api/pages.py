@@ -0,0 +1,114 @@
+"""
+Preloaded HTML/JS documents served by the page views.
+
+Each page is read from static/ once, transformed (e.g. SERVER_CONFIG
+injection into app.html), hashed for a strong ETag and compressed in every
+coding the server supports, so requests are answered from memory without
+disk I/O or string work. With DEBUG on, a page is rebuilt when its file's
+mtime changes.
+"""
+import hashlib
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from .middleware import available_encodings, choose_encoding, compress
+
+# Pages are compressed once per process, so use the strongest settings
+PRECOMPRESS_LEVELS = {'gzip': 9, 'br': 11, 'zstd': 19}
+
+
+class PreparedPage:
+    """One document with its identity body, compressed variants and ETags."""
+
+    def __init__(self, path: str, content_type: str, mtime: float, body: bytes):
+        self.path = path
+        self.content_type = content_type
+        self.mtime = mtime
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.variants: Dict[Optional[str], bytes] = {None: body}
+        self.etags: Dict[Optional[str], str] = {None: f'"{digest}"'}
+        for encoding in available_encodings():
+            compressed = compress(body, encoding, PRECOMPRESS_LEVELS[encoding])
+            if len(compressed) < len(body):
+                self.variants[encoding] = compressed
+                self.etags[encoding] = f'"{digest}-{encoding}"'
+
+    def response(self, request) -> HttpResponse:
+        """Serve the best variant for the request, or 304 if the client's copy is current."""
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding not in self.variants:
+            encoding = None
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            known = set(self.etags.values())
+            client_etags = {etag.removeprefix('W/') for etag in parse_etags(if_none_match)}
+            if '*' in client_etags or known & client_etags:
+                response = HttpResponseNotModified()
+                response['ETag'] = self.etags[encoding]
+                return response
+
+        response = HttpResponse(self.variants[encoding], content_type=self.content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['ETag'] = self.etags[encoding]
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class PageCache:
+    """Builds PreparedPages on first use and keeps them for the process lifetime."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pages: Dict[str, PreparedPage] = {}
+        self._sources: Dict[str, tuple] = {}
+
+    def register(self, name: str, filename: str, content_type: str,
+                 transform: Optional[Callable[[str], str]] = None):
+        self._sources[name] = (filename, content_type, transform)
+
+    def _build(self, name: str) -> PreparedPage:
+        filename, content_type, transform = self._sources[name]
+        path = os.path.join(settings.BASE_DIR, 'static', filename)
+        mtime = os.stat(path).st_mtime
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        if transform:
+            content = transform(content)
+        return PreparedPage(path, content_type, mtime, content.encode('utf-8'))
+
+    def get(self, name: str) -> PreparedPage:
+        page = self._pages.get(name)
+        if page is not None and settings.DEBUG and os.stat(page.path).st_mtime != page.mtime:
+            page = None
+        if page is None:
+            with self._lock:
+                page = self._build(name)
+                self._pages[name] = page
+        return page
+
+    def preload(self):
+        """Build every registered page now (called from the WSGI/ASGI entry points)."""
+        for name in self._sources:
+            self.get(name)
+
+
+def inject_server_config(content: str) -> str:
+    """Insert window.SERVER_CONFIG before </head> in app.html."""
+    config_script = f'<script>window.SERVER_CONFIG = {{useEnvCredentials: {"true" if settings.USE_ENV_CREDENTIALS else "false"}}};</script>'
+    return content.replace('</head>', config_script + '</head>')
+
+
+pages = PageCache()
+pages.register('app', 'app.html', 'text/html', inject_server_config)
+pages.register('setup-local', 'setup-local.html', 'text/html')
+pages.register('setup-server', 'setup-server.html', 'text/html')
+pages.register('sw', 'sw.js', 'application/javascript')
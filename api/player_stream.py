@@ -0,0 +1,252 @@
+"""
+Server-sent player status for /api/players/stream.
+
+One PlayerPoller per account polls /device-v2/devices/mine every
+YOTO_PLAYER_POLL_INTERVAL seconds, however many tabs are listening, and
+pushes only what changed between polls to each subscriber's queue:
+
+    event: players   {"players": [...]}                       (on connect)
+    event: changes   {"added": [...], "changed": [{"deviceId", <changed fields>}],
+                      "removed": ["<deviceId>", ...]}
+
+Polls go through the response cache, so /api/players/ stays fresh too.
+A poller stops once its last subscriber has gone. Streams end after
+YOTO_PLAYER_STREAM_MAX_AGE seconds so they don't pin a worker forever;
+clients reconnect (EventSource does so by itself after the retry delay).
+EventSource can't send the X-Access-Token header, so a client has to read
+the stream with fetch() (or another HTTP client that can set headers).
+
+Under WSGI each stream is a generator blocking on its subscriber queue.
+Under ASGI, Django would collect such a generator into a list before
+sending anything, so astream_events() waits on an asyncio queue instead,
+fed from the poller thread through the event loop.
+
+Pollers are shared by account only once the Yoto API has accepted the
+subscriber's token (see api.identity); each keeps polling with the client it
+started with and only switches to a newer subscriber's when that one fails.
+"""
+import asyncio
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+from . import cache, identity
+from .resilience import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Events buffered per subscriber; a tab that falls further behind misses updates
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def diff_players(previous: List[Dict[str, Any]], current: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Added, changed (only the fields that differ) and removed devices; None if nothing changed."""
+    before = {p.get('deviceId'): p for p in previous}
+    after = {p.get('deviceId'): p for p in current}
+    added = [p for device_id, p in after.items() if device_id not in before]
+    removed = [device_id for device_id in before if device_id not in after]
+    changed = []
+    for device_id, player in after.items():
+        old = before.get(device_id)
+        if old is None:
+            continue
+        fields = {k: v for k, v in player.items() if old.get(k) != v}
+        fields.update({k: None for k in old if k not in player})
+        if fields:
+            changed.append({'deviceId': device_id, **fields})
+    if not (added or changed or removed):
+        return None
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+
+def format_event(event: str, data: Any) -> str:
+    """One text/event-stream message."""
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class LoopQueue:
+    """A subscriber queue read on an event loop and fed from the poller thread."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            pass  # The loop has closed; the stream is being torn down
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+
+class PlayerPoller:
+    """Polls one account's players on a background thread and fans out changes."""
+
+    def __init__(self, account: str, client, interval: float):
+        self.account = account
+        self.client = client
+        # The newest subscriber's client, tried if polling with self.client fails
+        self._spare = None
+        self.interval = interval
+        self.players: Optional[List[Dict[str, Any]]] = None
+        self._subscribers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'yoto-players-{account[:8]}', daemon=True)
+
+    def start(self) -> 'PlayerPoller':
+        self._thread.start()
+        return self
+
+    def subscribe(self, client, subscriber=None):
+        """
+        A queue of (event, data) tuples, seeded with the current players if known.
+
+        subscriber is the queue to publish to (anything with put_nowait(),
+        such as a LoopQueue); a new queue.Queue by default.
+        """
+        if subscriber is None:
+            subscriber = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if client is not self.client:
+                self._spare = client
+            self._subscribers.append(subscriber)
+            if self.players is not None:
+                subscriber.put_nowait(('players', {'players': self.players}))
+        return subscriber
+
+    def unsubscribe(self, subscriber) -> int:
+        """Remove a subscriber; returns how many are left."""
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+            return len(self._subscribers)
+
+    def stop(self):
+        self._stop.set()
+
+    def poll(self) -> float:
+        """Fetch the players once and publish any changes; returns the delay until the next poll."""
+        with self._lock:
+            client = copy.copy(self.client)
+        try:
+            players = cache.get_players(client, refresh=True)
+        except UpstreamUnavailable as e:
+            return max(self.interval, e.retry_after or 0)
+        except Exception as e:
+            logger.warning("Player poll failed: %s", e)
+            with self._lock:
+                # The newest subscriber's tokens are the least likely to be stale
+                if self._spare is not None:
+                    self.client, self._spare = self._spare, None
+            return self.interval
+
+        with self._lock:
+            # Swap the snapshot and pick the audience together, so a tab that
+            # joins now gets the new snapshot and not also its diff
+            previous, self.players = self.players, players
+            subscribers = list(self._subscribers)
+        if previous is None:
+            message = ('players', {'players': players})
+        else:
+            changes = diff_players(previous, players)
+            message = ('changes', changes) if changes else None
+        if message:
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    pass
+        return self.interval
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.poll())
+
+
+class PlayerHub:
+    """The process-wide set of pollers, one per account with subscribers."""
+
+    def __init__(self):
+        self._pollers: Dict[str, PlayerPoller] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, client, subscriber=None):
+        """
+        Join (or start) the poller for client's account; returns (poller, queue).
+
+        Callers make sure the Yoto API has accepted client's token first;
+        otherwise it only gets a poller of its own.
+        """
+        account = identity.account_key(client)
+        with self._lock:
+            poller = self._pollers.get(account)
+            if poller is None:
+                poller = PlayerPoller(account, client, settings.YOTO_PLAYER_POLL_INTERVAL)
+                self._pollers[account] = poller.start()
+            return poller, poller.subscribe(client, subscriber)
+
+    def unsubscribe(self, poller: PlayerPoller, subscriber):
+        with self._lock:
+            if poller.unsubscribe(subscriber) == 0 and self._pollers.get(poller.account) is poller:
+                del self._pollers[poller.account]
+                poller.stop()
+
+    def active_accounts(self) -> int:
+        return len(self._pollers)
+
+
+hub = PlayerHub()
+
+
+def stream_events(client) -> Iterator[str]:
+    """The text/event-stream body for one subscriber."""
+    poller, subscriber = hub.subscribe(client)
+    keepalive = settings.YOTO_PLAYER_STREAM_KEEPALIVE
+    deadline = time.monotonic() + settings.YOTO_PLAYER_STREAM_MAX_AGE
+    try:
+        yield f'retry: {int(settings.YOTO_PLAYER_POLL_INTERVAL * 1000)}\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event, data = subscriber.get(timeout=min(keepalive, remaining))
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event, data)
+    finally:
+        hub.unsubscribe(poller, subscriber)
+
+
+async def astream_events(client) -> AsyncIterator[str]:
+    """stream_events() for ASGI: waits on the event loop instead of blocking a thread."""
+    poller, subscriber = hub.subscribe(client, LoopQueue(asyncio.get_running_loop(), SUBSCRIBER_QUEUE_SIZE))
+    keepalive = settings.YOTO_PLAYER_STREAM_KEEPALIVE
+    deadline = time.monotonic() + settings.YOTO_PLAYER_STREAM_MAX_AGE
+    try:
+        yield f'retry: {int(settings.YOTO_PLAYER_POLL_INTERVAL * 1000)}\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event, data = await asyncio.wait_for(subscriber.queue.get(), min(keepalive, remaining))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(event, data)
+    finally:
+        hub.unsubscribe(poller, subscriber)
@@ -0,0 +1,206 @@
+"""
+Shared protection for upstream hosts: a circuit breaker and a rate limiter.
+
+Every YotoAPIClient in the process goes through the same UpstreamGuard for a
+given host, so a struggling upstream is seen (and protected) collectively:
+
+- The circuit breaker opens after YOTO_BREAKER_FAILURES consecutive failures
+  (connection errors, timeouts, 5xx, 429) and then fails calls immediately
+  with UpstreamUnavailable for YOTO_BREAKER_RESET seconds, or for as long as
+  a Retry-After header asked. After that, one probe request is let through
+  (half-open); its outcome closes or re-opens the circuit.
+- A token bucket caps the request rate at YOTO_RATE_LIMIT per second (bursts
+  of YOTO_RATE_BURST). The rate halves on every 429 and creeps back up on
+  success. Callers wait at most YOTO_RATE_MAX_WAIT seconds for a token
+  before failing with UpstreamUnavailable.
+
+Callers such as the response cache fall back to stale data when a request
+fails with UpstreamUnavailable.
+"""
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+FAILURE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream is being protected; retry after retry_after seconds."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker counting consecutive failures."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self._probing = False
+
+    def before_call(self):
+        """Raise UpstreamUnavailable unless a call may go ahead now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now >= self.opened_until:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            retry_after = max(self.opened_until - now, 1.0)
+        raise UpstreamUnavailable(
+            f"{self.name} is unavailable (circuit open); retry in {retry_after:.0f}s", retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if retry_after is None and self.state == CLOSED and self.failures < self.failure_threshold:
+                return
+            # Open on the threshold, on a failed probe, or when told when to come back
+            delay = max(self.reset_timeout, retry_after or 0)
+            if self.state != OPEN:
+                logger.warning("Circuit for %s opened for %.0fs after %d failure(s)",
+                               self.name, delay, self.failures)
+            self.state = OPEN
+            self.opened_until = max(self.opened_until, time.monotonic() + delay)
+
+
+class TokenBucket:
+    """Token bucket with additive-increase/multiplicative-decrease rate."""
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> float:
+        """
+        Take a token; return the seconds the caller must wait before using it.
+
+        Raises UpstreamUnavailable if that wait would exceed max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if wait > max_wait:
+                raise UpstreamUnavailable("Upstream rate limit reached; retry shortly", wait)
+            self._tokens -= 1
+            return wait
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class UpstreamGuard:
+    """Breaker plus (optional) rate limiter for one upstream host."""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.breaker = CircuitBreaker(host, settings.YOTO_BREAKER_FAILURES, settings.YOTO_BREAKER_RESET)
+        self.bucket = (TokenBucket(settings.YOTO_RATE_LIMIT, settings.YOTO_RATE_BURST)
+                       if settings.YOTO_RATE_LIMIT > 0 else None)
+
+    def acquire(self) -> float:
+        """Check the breaker and take a rate token; returns seconds to wait first."""
+        self.breaker.before_call()
+        if self.bucket is None:
+            return 0.0
+        return self.bucket.reserve(settings.YOTO_RATE_MAX_WAIT)
+
+    def record(self, status: int, retry_after: Optional[str] = None):
+        """Feed an upstream response status (and its Retry-After) back."""
+        if status in FAILURE_STATUSES:
+            self.breaker.record_failure(parse_retry_after(retry_after) if status in (429, 503) else None)
+            if status == 429 and self.bucket is not None:
+                self.bucket.slow_down()
+        else:
+            self.breaker.record_success()
+            if self.bucket is not None:
+                self.bucket.speed_up()
+
+    def record_error(self):
+        """A call that raised instead of answering (connection error, timeout, ...)."""
+        self.breaker.record_failure()
+
+    def snapshot(self) -> Dict:
+        return {
+            'state': self.breaker.state,
+            'failures': self.breaker.failures,
+            'rate': self.bucket.rate if self.bucket else None,
+        }
+
+
+_guards: Dict[str, UpstreamGuard] = {}
+_guards_lock = threading.Lock()
+
+
+def guard_for(url: str) -> UpstreamGuard:
+    """The process-wide guard for url's host."""
+    host = urlparse(url).netloc
+    guard = _guards.get(host)
+    if guard is None:
+        with _guards_lock:
+            guard = _guards.setdefault(host, UpstreamGuard(host))
+    return guard
+
+
+def reset():
+    """Forget all breaker and rate state (tests)."""
+    with _guards_lock:
+        _guards.clear()
@@ -0,0 +1,128 @@
+"""
+Response helpers for the Yoto proxy endpoints.
+
+api_response() wraps proxied data in the usual {'status', 'data'} envelope
+and makes it conditional: every response carries an ETag (the upstream one
+when Yoto sends it, otherwise a hash of the payload), and requests whose
+If-None-Match/If-Modified-Since still match get an empty 304.
+
+Payloads are serialized once, compactly, with orjson when it is installed,
+and can be trimmed with a ?fields= projection.
+"""
+import hashlib
+import json
+from typing import Any, List, Optional
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def json_dumps(data: Any) -> bytes:
+    """Serialize to compact UTF-8 JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def payload_etag(body: bytes) -> str:
+    """Strong ETag derived from a serialized payload."""
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def parse_fields(request) -> Optional[List[List[str]]]:
+    """Parse ?fields=a,b.c into [['a'], ['b', 'c']]; None if not given."""
+    raw = request.GET.get('fields', '')
+    fields = [f.strip().split('.') for f in raw.split(',') if f.strip()]
+    return fields or None
+
+
+def _project_item(item: Any, fields: List[List[str]]) -> Any:
+    if not isinstance(item, dict):
+        return item
+    result: dict = {}
+    for path in fields:
+        source, target = item, result
+        for i, part in enumerate(path):
+            if not isinstance(source, dict) or part not in source:
+                break
+            if i == len(path) - 1:
+                target[part] = source[part]
+            else:
+                source = source[part]
+                target = target.setdefault(part, {})
+    return result
+
+
+def project(data: Any, fields: Optional[List[List[str]]]) -> Any:
+    """
+    Keep only the given (dotted) fields.
+
+    Lists are projected item by item, so ?fields=cardId,title,metadata.cover
+    trims every card of a library listing.
+    """
+    if not fields:
+        return data
+    if isinstance(data, list):
+        return [_project_item(item, fields) for item in data]
+    return _project_item(data, fields)
+
+
+def _token_changed(request, client) -> bool:
+    return bool(client and client.access_token
+                and client.access_token != request.headers.get('X-Access-Token'))
+
+
+def api_response(request, data: Any, client=None, include_token: bool = False,
+                 items_key: Optional[str] = None):
+    """
+    Build a conditional success response for proxied data.
+
+    Upstream validators are taken from client.last_validators when present.
+    With include_token, the client's access token is added as newAccessToken
+    (as create_response_with_tokens does); a refreshed token always forces a
+    full response so the browser receives it. With items_key, ?fields=
+    applies to the list in data[items_key] (a page) rather than to data.
+    """
+    fields = parse_fields(request)
+    with metrics.timed('serialize'):
+        if items_key and fields:
+            payload = json_dumps({**data, items_key: project(data[items_key], fields)})
+        else:
+            payload = json_dumps(project(data, fields))
+
+    validators = getattr(client, 'last_validators', None) or {}
+    # The upstream ETag describes the full entity, not a projection of it
+    etag = (not fields and validators.get('ETag')) or payload_etag(payload)
+    last_modified: Optional[int] = parse_http_date_safe(validators.get('Last-Modified', ''))
+
+    response = None
+    if request.method in ('GET', 'HEAD') and not _token_changed(request, client):
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        body = b'{"status":"success","data":' + payload
+        if include_token and client and client.access_token:
+            body += b',"newAccessToken":' + json_dumps(client.access_token)
+        response = HttpResponse(body + b'}', content_type='application/json')
+
+    response['ETag'] = etag
+    cache_status = getattr(client, 'cache_status', None)
+    if cache_status:
+        response['X-Cache'] = cache_status
+        if client.cache_age is not None:
+            response['Age'] = str(client.cache_age)
+    if 'Last-Modified' in validators:
+        response['Last-Modified'] = validators['Last-Modified']
+    # Let the browser keep the body but revalidate it on every use; the data
+    # is per-account, so it must not be shared between credentials
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('X-Access-Token',))
+    return response
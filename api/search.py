@@ -0,0 +1,186 @@
+"""
+Full-text search over an account's cards, chapters and tracks.
+
+Library listings and card details are indexed as they come back from the
+Yoto API (see the loaders in api.cache) into SearchEntry rows, which an
+FTS5 table in the SQLite database mirrors. /api/search?q= then answers
+from the database alone, without calling the Yoto API.
+
+Queries are tokenized and case-folded, every term must match, and each
+term matches as a prefix ("gruf" finds "Gruffalo"). Writes go through one
+background thread: it keeps SQLite to a single writer and keeps indexing
+off the request path. Unchanged entries are left alone, so re-indexing an
+unchanged library doesn't rewrite it.
+
+Without FTS5 (another database, or an SQLite built without it) search
+falls back to case-insensitive substring matching.
+"""
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+
+from .models import SearchEntry
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'api_searchentry_fts'
+
+_writer: Optional[ThreadPoolExecutor] = None
+_fts: Optional[bool] = None
+
+Entries = Dict[str, Tuple[str, str, str]]  # path -> (kind, title, body)
+
+
+def _text(*parts: Any) -> str:
+    return ' '.join(str(p) for p in parts if isinstance(p, (str, int, float)) and str(p).strip())
+
+
+def card_entries(card: Dict[str, Any]) -> Entries:
+    """The card-level entry of a library card or card detail."""
+    card = card.get('card', card)
+    metadata = card.get('metadata') or {}
+    body = _text(metadata.get('author'), metadata.get('category'), metadata.get('description'))
+    return {'': (SearchEntry.CARD, card.get('title') or '', body)}
+
+
+def detail_entries(detail: Dict[str, Any]) -> Entries:
+    """Entries for a card detail: the card, its chapters and their tracks."""
+    entries = card_entries(detail)
+    card = detail.get('card', detail)
+    for c, chapter in enumerate((card.get('content') or {}).get('chapters') or []):
+        entries[str(c)] = (SearchEntry.CHAPTER, chapter.get('title') or '', '')
+        for t, track in enumerate(chapter.get('tracks') or []):
+            if track.get('title') and track.get('title') != chapter.get('title'):
+                entries[f'{c}/{t}'] = (SearchEntry.TRACK, track['title'], _text(track.get('format')))
+    return entries
+
+
+def _sync_entries(account: str, wanted: Dict[str, Entries], card_title: Dict[str, str], scope: Q):
+    """Make the rows in scope of the cards in wanted ({card_id: {path: entry}}) match it."""
+    existing = {(row.card_id, row.path): row for row in SearchEntry.objects.filter(scope)}
+    stale, fresh = [], []
+    for (card_id, path), row in existing.items():
+        entry = wanted.get(card_id, {}).get(path)
+        if entry is None:
+            if card_id in wanted:
+                stale.append(row.pk)
+        elif (row.kind, row.title, row.body, row.card_title) != (*entry, card_title[card_id]):
+            stale.append(row.pk)
+    for card_id, entries in wanted.items():
+        for path, (kind, title, body) in entries.items():
+            row = existing.get((card_id, path))
+            if row is None or row.pk in stale:
+                fresh.append(SearchEntry(account=account, card_id=card_id, path=path, kind=kind,
+                                         title=title, body=body, card_title=card_title[card_id]))
+    if not (stale or fresh):
+        return
+    with transaction.atomic():
+        SearchEntry.objects.filter(pk__in=stale).delete()
+        SearchEntry.objects.bulk_create(fresh)
+
+
+def index_library(account: str, cards: List[Dict[str, Any]]):
+    """Index the card-level entries of a full library listing (removes cards no longer in it)."""
+    wanted = {card['cardId']: card_entries(card) for card in cards if card.get('cardId')}
+    titles = {card_id: entries[''][1] for card_id, entries in wanted.items()}
+    _sync_entries(account, wanted, titles, Q(account=account, path=''))
+    SearchEntry.objects.filter(account=account).exclude(card_id__in=list(wanted)).delete()
+
+
+def index_card(account: str, detail: Dict[str, Any]):
+    """Index a card detail's card, chapter and track entries."""
+    card_id = detail.get('card', detail).get('cardId')
+    if not card_id:
+        return
+    entries = detail_entries(detail)
+    _sync_entries(account, {card_id: entries}, {card_id: entries[''][1]}, Q(account=account, card_id=card_id))
+
+
+def _run(job, *args):
+    try:
+        job(*args)
+    except DatabaseError as e:
+        logger.warning("Search indexing failed (has `manage.py migrate` been run?): %s", e)
+    except Exception:
+        logger.exception("Search indexing failed")
+    finally:
+        connection.close()
+
+
+def _submit(job, *args):
+    global _writer
+    if not settings.YOTO_SEARCH_INDEX:
+        return
+    if _writer is None:
+        _writer = ThreadPoolExecutor(1, thread_name_prefix='yoto-search')
+    _writer.submit(_run, job, *args)
+
+
+def queue_library(account: str, cards: list) -> list:
+    """Index a library listing in the background; returns it unchanged."""
+    if isinstance(cards, list):
+        _submit(index_library, account, cards)
+    return cards
+
+
+def queue_card(account: str, detail: dict) -> dict:
+    """Index a card detail in the background; returns it unchanged."""
+    if isinstance(detail, dict):
+        _submit(index_card, account, detail)
+    return detail
+
+
+def flush():
+    """Wait for queued indexing to finish (tests, management commands)."""
+    if _writer is not None:
+        _writer.submit(lambda: None).result()
+
+
+def terms(query: str) -> List[str]:
+    """Case-folded word tokens of a query."""
+    return re.findall(r'\w+', query.casefold())
+
+
+def fts_available() -> bool:
+    global _fts
+    if _fts is None:
+        _fts = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _fts
+
+
+def _result(row: SearchEntry) -> Dict[str, Any]:
+    chapter, _, track = row.path.partition('/')
+    return {
+        'cardId': row.card_id,
+        'cardTitle': row.card_title,
+        'kind': row.kind,
+        'title': row.title,
+        'chapter': int(chapter) if chapter else None,
+        'track': int(track) if track else None,
+    }
+
+
+def search(account: str, query: str, limit: int) -> List[Dict[str, Any]]:
+    """Best matches for query among the account's entries, cards first on ties."""
+    words = terms(query)
+    if not words:
+        return []
+    if fts_available():
+        # Quoted terms can't be read as FTS operators; * makes each a prefix match
+        match = ' '.join(f'"{word}"*' for word in words)
+        rows = SearchEntry.objects.raw(
+            f'SELECT e.* FROM {FTS_TABLE} JOIN api_searchentry e ON e.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s AND e.account = %s '
+            f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0), e.path LIMIT %s',
+            [match, account, limit])
+        return [_result(row) for row in rows]
+
+    matches = Q(account=account)
+    for word in words:
+        matches &= Q(title__icontains=word) | Q(body__icontains=word)
+    return [_result(row) for row in SearchEntry.objects.filter(matches).order_by('card_title', 'path')[:limit]]
@@ -1,3 +1,1037 @@
-from django.test import TestCase
+import asyncio
+import atexit
+import base64
+import copy
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, Client, SimpleTestCase, override_settings
+
+from . import (async_views, cache, clients, coalesce, identity, images, log, media_store, middleware, player_stream, resilience,
+               search, transport, warmup)
+from .async_client import AsyncYotoAPIClient, close_async_pool, get_async_pool
+from .benchmark import percentile, run_load
+from .fakeyoto import CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN, FakeYotoAPI, make_token
+from .models import SearchEntry
+from .pages import pages
+from .tokens import token_manager
+from .yoto_client import YotoAPIClient
+
+
+class FakeYotoTestCase(SimpleTestCase):
+    """Runs one fake Yoto API per test class and points the proxy at it."""
+
+    fake_options = {'cards': 5, 'chapters': 3, 'audio_bytes': 4096}
+    search_index = False
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeYotoAPI(**cls.fake_options).start()
+        cls.addClassCleanup(cls.fake.stop)
+        cls.enterClassContext(override_settings(YOTO_API_BASE_URL=cls.fake.url,
+                                                 YOTO_AUTH_BASE_URL=cls.fake.url,
+                                                 YOTO_SEARCH_INDEX=cls.search_index))
+
+    def setUp(self):
+        caches[settings.YOTO_CACHE_ALIAS].clear()
+        resilience.reset()
+        clients.registry.clear()
+        self.fake.requests.clear()
+        self.fake._failures.clear()
+        self.token = self.fake.issue_token()
+        self.headers = {
+            'X-Access-Token': self.token,
+            'X-Refresh-Token': REFRESH_TOKEN,
+            'X-Client-Id': CLIENT_ID,
+            'X-Client-Secret': CLIENT_SECRET,
+        }
+
+    def tearDown(self):
+        token_manager.forget(token_manager.key_for(REFRESH_TOKEN, CLIENT_ID))
+
+    def asgi_get(self, url, headers=None, until=None, timeout=5.0):
+        """
+        GET url through Django's ASGIHandler; returns (status, body, complete).
+
+        With until, reading stops (and the client disconnects) as soon as
+        until(body) holds; complete tells whether the response had ended by
+        then. Fails if any message takes longer than timeout to arrive.
+        """
+        path, _, query = url.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': path, 'query_string': query.encode('ascii'),
+            'headers': [(name.lower().encode('ascii'), value.encode('ascii')) for name, value in (headers or {}).items()],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+        }
+
+        async def run():
+            messages = asyncio.Queue()
+            disconnected = asyncio.Event()
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            task = asyncio.create_task(ASGIHandler()(scope, receive, messages.put))
+            body, complete = b'', False
+            try:
+                start = await asyncio.wait_for(messages.get(), timeout)
+                while not complete and not (until and until(body)):
+                    message = await asyncio.wait_for(messages.get(), timeout)
+                    body += message.get('body', b'')
+                    complete = not message.get('more_body', False)
+            finally:
+                disconnected.set()
+                await asyncio.wait_for(task, timeout)
+                await close_async_pool()
+            return start['status'], body, complete
+        return asyncio.run(run())
+
+
+class FakeYotoAPITests(FakeYotoTestCase):
+    def make_client(self):
+        client = YotoAPIClient()
+        client.access_token = self.token
+        return client
+
+    def test_library_and_card(self):
+        client = self.make_client()
+        self.assertEqual(len(client.get_library()), 5)
+        card = client.get_card('card0001', playable=True)
+        self.assertEqual(len(cache.get_chapters(card)), 3)
+        self.assertGreater(cache.playable_ttl(card), 0)
+
+    def test_audio_honours_range(self):
+        card = self.make_client().get_card('card0000')
+        url = next(cache.iter_track_urls(card))
+        response = transport.request('GET', url, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers['Content-Range'], 'bytes 10-19/4096')
+        self.assertEqual(len(response.content), 10)
+
+    def test_injected_failure(self):
+        self.fake.fail_next(500)
+        with self.assertRaises(Exception), self.assertLogs('api', 'WARNING'):
+            self.make_client().get_players()
+        self.assertEqual(len(self.make_client().get_players()), 2)
+
+    def test_identical_gets_are_coalesced(self):
+        self.fake.latency = 0.2
+        self.addCleanup(setattr, self.fake, 'latency', 0)
+        with ThreadPoolExecutor(4) as executor:
+            cards = list(executor.map(lambda _: self.make_client().get_card('card0001', playable=False), range(4)))
+        self.assertEqual(self.fake.request_count('card'), 1)
+        self.assertEqual(cards[0], cards[3])
+        self.assertIsNot(cards[0], cards[3])
+
+    def test_gets_with_other_tokens_are_not_coalesced(self):
+        self.fake.latency = 0.2
+        self.addCleanup(setattr, self.fake, 'latency', 0)
+        tokens = [self.token, self.fake.issue_token()]
+        for token in tokens:
+            identity.vouch(token)  # Both verified for the same account
+
+        def get_card(token):
+            client = YotoAPIClient()
+            client.access_token = token
+            return client.get_card('card0001', playable=False)
+        with ThreadPoolExecutor(2) as executor:
+            list(executor.map(get_card, tokens))
+        self.assertEqual(self.fake.request_count('card'), 2)
+
+    def test_cancelled_async_leader_does_not_fail_followers(self):
+        coalescer = coalesce.Coalescer()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return {'cardId': 'card0001'}
+
+        async def leader_cancelled():
+            leader = asyncio.ensure_future(coalescer.arun('key', call))
+            follower = asyncio.ensure_future(coalescer.arun('key', call))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower, leader.cancelled()
+
+        self.assertEqual(asyncio.run(leader_cancelled()), ({'cardId': 'card0001'}, True))
+
+    def test_identical_async_gets_are_coalesced(self):
+        self.fake.latency = 0.2
+        self.addCleanup(setattr, self.fake, 'latency', 0)
+
+        async def fetch_all():
+            clients = [AsyncYotoAPIClient() for _ in range(4)]
+            for client in clients:
+                client.access_token = self.token
+            try:
+                return await asyncio.gather(*(c.get_card('card0002', playable=False) for c in clients))
+            finally:
+                await close_async_pool()
+
+        cards = asyncio.run(fetch_all())
+        self.assertEqual(self.fake.request_count('card'), 1)
+        self.assertEqual(cards[0], cards[3])
+
+    def test_revoked_token_is_refreshed(self):
+        self.fake.revoke(self.token)
+        client = self.make_client()
+        client.refresh_token = REFRESH_TOKEN
+        client.client_id = CLIENT_ID
+        client.client_secret = CLIENT_SECRET
+        with self.assertLogs('api', 'INFO'):
+            self.assertEqual(len(client.get_players()), 2)
+        self.assertNotEqual(client.access_token, self.token)
+        self.assertEqual(self.fake.request_count('token'), 1)
+
+    def test_concurrent_refreshes_are_single_flight(self):
+        self.fake.latency = 0.2
+        self.addCleanup(setattr, self.fake, 'latency', 0)
+
+        def refresh(_):
+            return token_manager.refresh(REFRESH_TOKEN, CLIENT_ID, CLIENT_SECRET, stale_token=self.token)
+        with ThreadPoolExecutor(6) as executor:
+            states = list(executor.map(refresh, range(6)))
+        self.assertEqual(self.fake.request_count('token'), 1)
+        self.assertEqual(len({state.access_token for state in states}), 1)
+        self.assertNotEqual(states[0].access_token, self.token)
+
+
+class TransportTests(FakeYotoTestCase):
+    def setUp(self):
+        super().setUp()
+        # Build a new shared session so each test sees its own settings
+        self.addCleanup(setattr, transport, '_session', transport._session)
+        self.addCleanup(lambda: transport._session and transport._session.close())
+        transport._session = None
+
+    def get_players(self):
+        return transport.request('GET', f'{self.fake.url}/device-v2/devices/mine',
+                                 headers={'Authorization': f'Bearer {self.token}'})
+
+    def test_connections_are_reused(self):
+        before = transport.pool_stats.snapshot()
+        for _ in range(3):
+            self.assertEqual(self.get_players().status_code, 200)
+        stats = transport.get_pool_stats()
+        self.assertEqual(stats['opened'] - before['opened'], 1)
+        self.assertEqual(stats['reused'] - before['reused'], 2)
+        host = stats['hosts']['127.0.0.1']
+        self.assertEqual((host['connections_opened'], host['requests']), (1, 3))
+
+    @override_settings(YOTO_HTTP_POOL_SIZE=3, YOTO_HTTP_POOL_BLOCK=True, YOTO_HTTP_MAX_RETRIES=1,
+                       YOTO_HTTP_BACKOFF_FACTOR=0)
+    def test_pool_size_and_retries_are_configured(self):
+        adapter = transport.get_session().get_adapter(self.fake.url)
+        self.assertEqual(adapter.poolmanager.connection_from_url(self.fake.url).pool.maxsize, 3)
+        self.assertTrue(adapter.poolmanager.connection_pool_kw['block'])
+        self.assertEqual((adapter.max_retries.total, adapter.max_retries.backoff_factor), (1, 0))
+
+        # One 503 is retried transparently; a second exhausts the budget
+        self.fake.fail_next(503)
+        self.assertEqual(self.get_players().status_code, 200)
+        self.assertEqual(self.fake.request_count('devices'), 2)
+        self.fake.fail_next(503, count=2)
+        self.assertEqual(self.get_players().status_code, 503)
+        self.assertEqual(self.fake.request_count('devices'), 4)
+
+        stats = transport.get_pool_stats()
+        self.assertEqual((stats['pool_size'], stats['pool_block'], stats['max_retries']), (3, True, 1))
+
+
+class AsyncClientTests(FakeYotoTestCase):
+    def run_async(self, make_coroutine):
+        """Run a coroutine on a new event loop, closing that loop's shared pool afterwards."""
+        async def main():
+            try:
+                return await make_coroutine()
+            finally:
+                await close_async_pool()
+        return asyncio.run(main())
+
+    def make_client(self, token=None):
+        client = AsyncYotoAPIClient()
+        client.access_token = token or self.token
+        client.refresh_token = REFRESH_TOKEN
+        client.client_id = CLIENT_ID
+        client.client_secret = CLIENT_SECRET
+        return client
+
+    def test_expired_token_is_refreshed_first(self):
+        client = self.make_client()
+        client.token_expiry = datetime.now() - timedelta(seconds=1)
+        self.assertEqual(len(self.run_async(client.get_players)), 2)
+        self.assertNotEqual(client.access_token, self.token)
+        self.assertEqual((self.fake.request_count('token'), self.fake.request_count('devices')), (1, 1))
+
+    def test_forbidden_request_is_retried_after_refresh(self):
+        self.fake.revoke(self.token)
+        client = self.make_client()
+        with self.assertLogs('api', 'INFO'):
+            self.assertEqual(len(self.run_async(client.get_players)), 2)
+        self.assertNotEqual(client.access_token, self.token)
+        self.assertEqual((self.fake.request_count('token'), self.fake.request_count('devices')), (1, 2))
+
+    def test_async_views_coalesce_identical_requests(self):
+        self.fake.latency = 0.2
+        self.addCleanup(setattr, self.fake, 'latency', 0)
+        factory = AsyncRequestFactory()
+
+        async def fetch_all():
+            requests = [factory.get('/api/card/card0003/', headers=self.headers) for _ in range(4)]
+            return await asyncio.gather(*(async_views.get_card_detail(r, 'card0003') for r in requests))
+
+        responses = self.run_async(fetch_all)
+        self.assertEqual({r.status_code for r in responses}, {200})
+        self.assertEqual(json.loads(responses[0].content)['data'], json.loads(responses[3].content)['data'])
+        self.assertEqual(self.fake.request_count('card'), 1)
+
+    @override_settings(YOTO_HTTP_ASYNC_MAX_CONNECTIONS=7, YOTO_HTTP_POOL_SIZE=3, YOTO_HTTP_MAX_RETRIES=1)
+    def test_pool_limits_are_applied(self):
+        async def pool_limits():
+            pool = get_async_pool()
+            self.assertIs(get_async_pool(), pool)
+            connections = pool._transport._pool
+            return connections._max_connections, connections._max_keepalive_connections, connections._retries
+        self.assertEqual(self.run_async(pool_limits), (7, 3, 1))
+
+
+class ProxyViewTests(FakeYotoTestCase):
+    def test_library_is_cached_and_conditional(self):
+        first = self.client.get('/api/library/', headers=self.headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(first.json()['data']), 5)
+        self.assertIn('Server-Timing', first)
+
+        second = self.client.get('/api/library/', headers={**self.headers, 'If-None-Match': first['ETag']})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(self.fake.request_count('library'), 1)
+
+    def test_forged_token_does_not_share_cache(self):
+        self.assertEqual(self.client.get('/api/library/', headers=self.headers).status_code, 200)
+        # Same claims as the real token, but a signature the upstream rejects
+        forged = self.token.rsplit('.', 1)[0] + '.forged'
+        self.fake.revoke(forged)
+        with self.assertLogs('api', 'WARNING'):
+            response = self.client.get('/api/library/', headers={'X-Access-Token': forged})
+        self.assertNotEqual(response.status_code, 200)
+        self.assertEqual(self.fake.request_count('library'), 2)
+
+    @override_settings(USE_ENV_CREDENTIALS=True, YOTO_CLIENT_ID=CLIENT_ID, YOTO_CLIENT_SECRET=CLIENT_SECRET)
+    def test_token_exchange_with_server_credentials(self):
+        body = {'code': 'auth-code', 'redirectUri': 'http://testserver/callback'}
+        response = self.client.post('/api/auth/token-account', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['refresh_token'], REFRESH_TOKEN)
+        self.assertEqual(self.fake.request_count('token'), 1)
+
+    def test_library_pages(self):
+        url = '/api/library/?limit=2&sort=-duration&fields=cardId'
+        first = self.client.get(url, headers=self.headers).json()['data']
+        self.assertEqual(first['total'], 5)
+        self.assertEqual([c['cardId'] for c in first['items']], ['card0003', 'card0002'])
+        second = self.client.get(f"{url}&cursor={first['nextCursor']}", headers=self.headers).json()['data']
+        self.assertEqual([c['cardId'] for c in second['items']], ['card0001', 'card0004'])
+        last = self.client.get(f"{url}&cursor={second['nextCursor']}", headers=self.headers).json()['data']
+        self.assertEqual(([c['cardId'] for c in last['items']], last['nextCursor']), (['card0000'], None))
+
+        music = self.client.get('/api/library/?category=music&q=card', headers=self.headers).json()['data']
+        self.assertEqual([c['cardId'] for c in music['items']], ['card0001', 'card0004'])
+        self.assertEqual(self.client.get('/api/library/?sort=author', headers=self.headers).status_code, 400)
+        self.assertEqual(self.fake.request_count('library'), 1)
+
+    def test_bad_cursor_is_rejected(self):
+        for raw in (b'["title",false,1,"card0001"]', b'["title",false,"a",5]', b'{"a":1}', b'"abc"', b'\xff\xfe'):
+            cursor = base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+            response = self.client.get(f'/api/library/?cursor={cursor}', headers=self.headers)
+            self.assertEqual(response.status_code, 400, raw)
+        self.assertEqual(self.client.get('/api/library/?cursor=%C3%A9', headers=self.headers).status_code, 400)
+
+    def expire(self, endpoint, age=5):
+        client = YotoAPIClient()
+        client.access_token = self.token
+        backend = cache.response_cache.backend
+        key = cache.response_cache.make_key(cache.account_key(client), endpoint)
+        entry = backend.get(key)
+        entry['expires_at'] = entry['stored_at'] = time.time() - age
+        backend.set(key, entry, 3600)
+
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_players_stale_while_revalidate(self):
+        first = self.client.get('/api/players/', headers=self.headers)
+        self.assertEqual(first['X-Cache'], 'miss')
+        self.expire('players')
+
+        stale = self.client.get('/api/players/', headers=self.headers)
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale['X-Cache'], 'stale')
+        self.assertGreaterEqual(int(stale['Age']), 5)
+        self.wait_for(lambda: self.fake.request_count('devices') == 2)
+
+        self.wait_for(lambda: self.client.get('/api/players/', headers=self.headers)['X-Cache'] == 'hit')
+        self.assertEqual(self.fake.request_count('devices'), 2)
+
+    @override_settings(YOTO_SWR_STALE_TTL=60)
+    def test_long_expired_entry_is_not_served_stale(self):
+        self.client.get('/api/players/', headers=self.headers)
+        self.expire('players', age=120)
+
+        response = self.client.get('/api/players/', headers=self.headers)
+        self.assertEqual(response['X-Cache'], 'miss')
+        self.assertEqual(self.fake.request_count('devices'), 2)
+
+    def test_library_sync_returns_changes(self):
+        full = self.client.get('/api/library/sync', headers=self.headers).json()['data']
+        self.assertTrue(full['full'])
+        self.assertEqual(len(full['added']), 5)
+
+        cards = copy.deepcopy(self.fake.cards)
+        self.addCleanup(setattr, self.fake, 'cards', cards)
+        self.fake.cards = copy.deepcopy(cards[1:])
+        self.fake.cards[0].update(title='Renamed', updatedAt='2030-01-01T00:00:00Z')
+        delta = self.client.get(f"/api/library/sync?since={full['syncToken']}&refresh=1",
+                                headers=self.headers).json()['data']
+        self.assertFalse(delta['full'])
+        self.assertEqual((delta['added'], delta['removed']), ([], ['card0000']))
+        self.assertEqual([c['title'] for c in delta['changed']], ['Renamed'])
+
+        unchanged = self.client.get(f"/api/library/sync?since={delta['syncToken']}",
+                                    headers=self.headers).json()['data']
+        self.assertEqual(unchanged['syncToken'], delta['syncToken'])
+        self.assertEqual(unchanged['added'] + unchanged['changed'] + unchanged['removed'], [])
+
+    @override_settings(YOTO_PLAYER_POLL_INTERVAL=0.05)
+    def test_players_stream_pushes_changes(self):
+        devices = copy.deepcopy(self.fake.devices)
+        self.addCleanup(setattr, self.fake, 'devices', devices)
+        first = self.client.get('/api/players/stream', headers=self.headers)
+        second = self.client.get('/api/players/stream', headers=self.headers)
+        self.assertEqual(first['Content-Type'], 'text/event-stream')
+        events, other = iter(first.streaming_content), iter(second.streaming_content)
+        next(events), next(other)  # retry: hints
+        self.assertIn(b'event: players', next(events))
+        self.assertIn(b'event: players', next(other))
+        self.assertEqual(player_stream.hub.active_accounts(), 1)
+
+        self.fake.devices = copy.deepcopy(devices)
+        self.fake.devices[0]['online'] = False
+        change = next(events).decode()
+        self.assertIn('event: changes', change)
+        self.assertIn('{"deviceId":"player-0","online":false}', change)
+
+        first.close()
+        second.close()
+        self.assertEqual(player_stream.hub.active_accounts(), 0)
+
+    @override_settings(YOTO_PLAYER_POLL_INTERVAL=0.05, YOTO_PLAYER_STREAM_MAX_AGE=30)
+    def test_players_stream_over_asgi(self):
+        status, body, complete = self.asgi_get('/api/players/stream', self.headers,
+                                               until=lambda body: b'event: players' in body)
+        self.assertEqual(status, 200)
+        self.assertIn(b'event: players', body)
+        self.assertFalse(complete)  # Sent while the stream was still open
+        self.assertEqual(player_stream.hub.active_accounts(), 0)
+
+    def test_players_stream_needs_an_accepted_token(self):
+        forged = self.token.rsplit('.', 1)[0] + '.forged'
+        self.fake.revoke(forged)
+        with self.assertLogs('api', 'WARNING'):
+            response = self.client.get('/api/players/stream', headers={'X-Access-Token': forged})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(player_stream.hub.active_accounts(), 0)
+
+    def test_player_poller_keeps_a_working_client(self):
+        first, second = YotoAPIClient(), YotoAPIClient()
+        first.access_token, second.access_token = self.token, self.fake.issue_token()
+        poller = player_stream.PlayerPoller('account', first, interval=1)
+        poller.subscribe(first)
+        poller.subscribe(second)
+        self.assertIs(poller.client, first)
+
+        self.fake.revoke(self.token)
+        with self.assertLogs('api', 'WARNING'):
+            poller.poll()
+        self.assertIs(poller.client, second)
+        poller.poll()
+        self.assertEqual(len(poller.players), 2)
+
+    def test_refreshed_token_is_kept_between_requests(self):
+        self.fake.revoke(self.token)
+        with self.assertLogs('api', 'INFO'):
+            first = self.client.get('/api/card/card0000/', headers=self.headers)
+        new_token = first.json()['newAccessToken']
+        self.assertNotEqual(new_token, self.token)
+
+        # The browser hasn't stored the new token yet, but the registry has
+        second = self.client.get('/api/card/card0001/', headers=self.headers)
+        self.assertEqual(second.json()['newAccessToken'], new_token)
+        self.assertEqual(self.fake.request_count('token'), 1)
+        self.assertEqual(self.fake.request_count('card'), 3)
+        self.assertEqual(len(clients.registry), 1)
+
+    def test_token_is_refreshed_in_the_background_before_expiry(self):
+        timers = []
+
+        class Timer:
+            """Records the scheduled refresh instead of waiting for it."""
+
+            def __init__(self, interval, function, args=()):
+                self.interval, self.function, self.args = interval, function, args
+                timers.append(self)
+
+            def start(self):
+                pass
+
+            def cancel(self):
+                pass
+
+        self.fake.token_ttl = 400
+        self.addCleanup(setattr, self.fake, 'token_ttl', 3600)
+        with mock.patch('api.tokens.threading.Timer', Timer), override_settings(YOTO_TOKEN_REFRESH_LEAD=300):
+            first = token_manager.refresh(REFRESH_TOKEN, CLIENT_ID, CLIENT_SECRET, stale_token=self.token)
+            self.assertEqual(len(timers), 1)
+            self.assertLess(timers[0].interval, (first.expiry - datetime.now()).total_seconds())
+            timers[0].function(*timers[0].args)
+
+        # Renewed once, while the first token was still good
+        self.assertTrue(first.is_fresh())
+        self.assertEqual(self.fake.request_count('token'), 2)
+        renewed = token_manager.current(REFRESH_TOKEN, CLIENT_ID)
+        self.assertNotEqual(renewed.access_token, first.access_token)
+
+        def get_card(index):
+            return Client().get(f'/api/card/card{index:04d}/', headers=self.headers).json()
+        with ThreadPoolExecutor(5) as executor:
+            bodies = list(executor.map(get_card, range(5)))
+        self.assertEqual({body['newAccessToken'] for body in bodies}, {renewed.access_token})
+        self.assertEqual(self.fake.request_count('token'), 2)
+
+    def test_bootstrap_loads_sections_in_parallel(self):
+        self.fake.latency = 0.2
+        self.addCleanup(setattr, self.fake, 'latency', 0)
+        started = time.monotonic()
+        response = self.client.get('/api/bootstrap', headers=self.headers)
+        self.assertLess(time.monotonic() - started, 0.5)
+        data = response.json()['data']
+        self.assertEqual(list(data), ['players', 'library', 'family'])
+        self.assertEqual(len(data['library']['data']), 5)
+        self.assertEqual(data['family']['data']['family']['familyId'], 'fake-family')
+        self.assertIn('players;dur=', response['Server-Timing'])
+
+    def test_bootstrap_reports_section_errors(self):
+        self.fake.fail_next(500)
+        with self.assertLogs('api', 'WARNING'):
+            response = self.client.get('/api/bootstrap?sections=family', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['family']['status'], 'error')
+        self.assertEqual(self.client.get('/api/bootstrap?sections=cards', headers=self.headers).status_code, 400)
+
+    def test_card_detail(self):
+        response = self.client.get('/api/card/card0002/', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['card']['cardId'], 'card0002')
+
+    def test_cards_batch(self):
+        response = self.client.post('/api/cards/batch', {'cardIds': ['card0000', 'card0001'], 'playable': False},
+                                    content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.fake.request_count('card'), 2)
+        self.assertIn('upstream;dur=', response['Server-Timing'])
+
+    def test_cards_batch_refreshes_once_for_all_cards(self):
+        self.fake.revoke(self.token)
+        with self.assertLogs('api', 'INFO'):
+            response = self.client.post('/api/cards/batch', {'cardIds': ['card0000', 'card0001', 'card0002']},
+                                        content_type='application/json', headers=self.headers)
+        data = response.json()
+        self.assertEqual((len(data['data']['cards']), data['data']['errors']), (3, {}))
+        self.assertNotEqual(data['newAccessToken'], self.token)
+        self.assertEqual(self.fake.request_count('token'), 1)
+
+    def test_playable_is_parsed_alike(self):
+        def has_urls(card):
+            return any(cache.iter_track_urls(card))
+        for value, expected in (('false', False), ('0', False), ('true', True)):
+            single = self.client.get(f'/api/card/card0000/?playable={value}', headers=self.headers)
+            batch = self.client.post('/api/cards/batch', {'cardIds': ['card0000'], 'playable': value},
+                                     content_type='application/json', headers=self.headers)
+            self.assertEqual(has_urls(single.json()['data']), expected)
+            self.assertEqual(has_urls(batch.json()['data']['cards']['card0000']), expected)
+
+    @override_settings(YOTO_STREAM_CHUNK_SIZE=1024)
+    def test_stream_track_relays_as_it_arrives_over_asgi(self):
+        self.fake.audio_pace = 0.4
+        self.addCleanup(setattr, self.fake, 'audio_pace', 0.0)
+        # The download takes over 1.2s, so a buffered body would miss the timeout
+        status, body, complete = self.asgi_get('/api/card/card0000/track/0', self.headers, timeout=1.0)
+        self.assertEqual((status, complete), (200, True))
+        self.assertEqual(body, self.fake.audio)
+
+    def test_stream_track_forwards_range(self):
+        response = self.client.get('/api/card/card0000/track/1', headers={**self.headers, 'Range': 'bytes=0-99'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(len(b''.join(response.streaming_content)), 100)
+
+    def test_upstream_error(self):
+        self.fake.fail_next(500)
+        with self.assertLogs('api', 'ERROR'):
+            response = self.client.get('/api/players/', headers=self.headers)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['status'], 'error')
+
+    def test_metrics(self):
+        self.client.get('/api/library/', headers=self.headers)
+        body = self.client.get('/api/metrics').content.decode()
+        self.assertIn('yoto_requests_total{endpoint="get_library",method="GET",status="200"}', body)
+        self.assertIn('yoto_cache_lookups_total{endpoint="library",result="miss"}', body)
+
+    def test_metrics_ignore_malformed_content_length(self):
+        response = self.client.get('/api/library/', headers=self.headers, CONTENT_LENGTH='bogus')
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(FakeYotoTestCase):
+    databases = {'default'}
+    search_index = True
+
+    def setUp(self):
+        super().setUp()
+        SearchEntry.objects.all().delete()
+
+    def search(self, query):
+        return self.client.get('/api/search', {'q': query}, headers=self.headers).json()['data']
+
+    def test_search_library_and_chapters(self):
+        self.client.get('/api/library/', headers=self.headers)
+        self.client.get('/api/card/card0002/', headers=self.headers)
+        search.flush()
+        upstream_calls = dict(self.fake.requests)
+
+        # Title matches ('Card 3') rank above body matches ('Author 3')
+        self.assertEqual([r['cardId'] for r in self.search('CARD 3')], ['card0002', 'card0003'])
+        self.assertEqual([r['cardId'] for r in self.search('radi')], ['card0002'])
+        chapters = self.search('chap')
+        self.assertEqual({(r['cardId'], r['kind']) for r in chapters}, {('card0002', 'chapter')})
+        self.assertEqual(sorted(r['chapter'] for r in chapters), [0, 1, 2])
+        self.assertEqual(self.search('"*'), [])
+        self.assertEqual(self.fake.requests, upstream_calls)
+
+    def test_search_needs_an_accepted_token(self):
+        self.client.get('/api/library/', headers=self.headers)
+        search.flush()
+        forged = self.token.rsplit('.', 1)[0] + '.forged'
+        self.fake.revoke(forged)
+        with self.assertLogs('api', 'WARNING'):
+            response = self.client.get('/api/search', {'q': 'card'}, headers={'X-Access-Token': forged})
+        self.assertEqual(response.status_code, 401)
+
+        # A token not seen before is checked upstream, then searches its account
+        other = {**self.headers, 'X-Access-Token': self.fake.issue_token()}
+        response = self.client.get('/api/search', {'q': 'card'}, headers=other)
+        self.assertEqual(len(response.json()['data']), 5)
+        self.assertEqual(self.fake.request_count('library'), 3)
+
+    def test_removed_cards_leave_the_index(self):
+        self.client.get('/api/card/card0000/', headers=self.headers)
+        cards = copy.deepcopy(self.fake.cards)
+        self.addCleanup(setattr, self.fake, 'cards', cards)
+        self.fake.cards = copy.deepcopy(cards[1:])
+        self.client.get('/api/library/?refresh=1', headers=self.headers)
+        search.flush()
+        self.assertFalse(SearchEntry.objects.filter(card_id='card0000').exists())
+        self.assertEqual(SearchEntry.objects.count(), 4)
+
+
+class LogRedactionTests(SimpleTestCase):
+    def test_redact(self):
+        token = make_token()
+        self.assertNotIn(token, log.redact(f'Authorization: Bearer {token}'))
+        self.assertEqual(log.redact('refresh_token=abc123&x=1'), f'refresh_token={log.REDACTED}&x=1')
+        self.assertEqual(log.redact('{"client_secret": "s3cret"}'), f'{{"client_secret": "{log.REDACTED}"}}')
+        self.assertEqual(log.redact('GET /content/mine -> 200'), 'GET /content/mine -> 200')
+
+    def test_queued_records_are_redacted(self):
+        stream = io.StringIO()
+        handler = log.QueueLogHandler(stream)
+        handler.addFilter(log.RedactingFilter())
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        logger = logging.getLogger('api.tests.redaction')
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+
+        token = make_token()
+        logger.warning("Refresh with %s failed", {'refresh_token': 'r-secret', 'access_token': token})
+        try:
+            raise ValueError(f'Bearer {token}')
+        except ValueError:
+            logger.exception("Upstream call failed")
+        # Drain the queue now rather than at exit
+        handler.listener.stop()
+        atexit.unregister(handler.listener.stop)
+
+        output = stream.getvalue()
+        self.assertIn('Refresh with', output)
+        self.assertIn('Traceback', output)
+        for secret in (token, 'r-secret'):
+            self.assertNotIn(secret, output)
+
+
+class PageTests(SimpleTestCase):
+    def test_app_page_is_served_from_memory(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'window.SERVER_CONFIG', response.content)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertIs(pages.get('app'), pages.get('app'))
+
+    def test_precompressed_variants(self):
+        plain = self.client.get('/')
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertNotEqual(response['ETag'], plain['ETag'])
+
+        # Any variant's ETag revalidates the page
+        revalidated = self.client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+
+
+class ResponseFormatTests(FakeYotoTestCase):
+    def test_fields_projection(self):
+        full = self.client.get('/api/library/', headers=self.headers)
+        trimmed = self.client.get('/api/library/?fields=cardId,metadata.author', headers=self.headers)
+        cards = trimmed.json()['data']
+        self.assertEqual(len(cards), 5)
+        self.assertEqual(cards[0], {'cardId': 'card0000', 'metadata': {'author': 'Author 0'}})
+        self.assertNotEqual(trimmed['ETag'], full['ETag'])
+
+    def test_choose_encoding(self):
+        preferred = middleware.available_encodings()[0]
+        self.assertEqual(middleware.choose_encoding('gzip, br, zstd'), preferred)
+        self.assertEqual(middleware.choose_encoding('br;q=0, gzip'), 'gzip')
+        self.assertEqual(middleware.choose_encoding('*'), preferred)
+        self.assertIsNone(middleware.choose_encoding('identity'))
+        self.assertIsNone(middleware.choose_encoding(''))
+
+    @override_settings(YOTO_COMPRESSION_MIN_BYTES=0)
+    def test_responses_are_compressed(self):
+        plain = self.client.get('/api/library/', headers=self.headers)
+        response = self.client.get('/api/library/', headers={**self.headers, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+
+@override_settings(YOTO_MEDIA_ALLOWED_HOSTS=['127.0.0.1'])
+class MediaStoreTests(FakeYotoTestCase):
+    def setUp(self):
+        super().setUp()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.store = media_store.MediaStore(root.name, 10 * 4096)
+
+    def test_content_is_hashed_and_stored_once(self):
+        content_hash, content_type = self.store.fetch(f'{self.fake.url}/s3/card0000/0/0?sig=1')
+        self.assertEqual(content_hash, hashlib.sha256(self.fake.audio).hexdigest())
+        self.assertEqual(content_type, 'audio/mpeg')
+        self.assertEqual(self.store.open_object(content_hash).read_bytes(), self.fake.audio)
+
+        # A new signature is the same source; other URLs with the same bytes share the object
+        self.assertEqual(self.store.fetch(f'{self.fake.url}/s3/card0000/0/0?sig=2')[0], content_hash)
+        self.assertEqual(self.fake.request_count('audio'), 1)
+        self.assertEqual(self.store.fetch(f'{self.fake.url}/s3/card0001/0/0')[0], content_hash)
+        self.assertEqual(len(list(self.store._iter_objects())), 1)
+        self.assertEqual(self.store.total_bytes(), len(self.fake.audio))
+
+    def test_redirects_only_to_allowed_hosts(self):
+        source = f'{self.fake.url}/s3/card0000/0/0'
+        elsewhere = source.replace('127.0.0.1', 'localhost')
+        with self.assertRaisesRegex(media_store.MediaStoreError, 'not allowed'):
+            self.store.fetch(f'{self.fake.url}/redirect?to={elsewhere}')
+        self.assertEqual(self.fake.request_count('audio'), 0)
+        self.assertEqual(self.store.fetch(f'{self.fake.url}/redirect?to={source}')[0],
+                         hashlib.sha256(self.fake.audio).hexdigest())
+
+    def test_oversized_download_is_dropped(self):
+        store = media_store.MediaStore(self.store.root, 10 * 1024)
+        with self.assertRaisesRegex(media_store.MediaStoreError, 'larger than'):
+            store.fetch(f'{self.fake.url}/s3/card0000/0/0')
+        self.assertEqual(list((store.root / 'tmp').glob('*')), [])
+        self.assertEqual(store.total_bytes(), 0)
+
+    def test_least_recently_used_objects_are_evicted(self):
+        hashes = []
+        for i in range(3):
+            hashes.append(self.store.put(f'key{i}', bytes([i]) * 16 * 1024, 'application/octet-stream'))
+            os.utime(self.store.open_object(hashes[-1]), (i, i))
+        self.assertIsNone(self.store.lookup_key('key0'))
+        self.assertIsNotNone(self.store.lookup_key('key2'))
+        self.assertLessEqual(self.store.total_bytes(), self.store.max_bytes)
+
+    @override_settings(YOTO_MEDIA_STORE_ENABLED=True)
+    def test_fetch_view_refuses_other_hosts(self):
+        response = self.client.get('/api/media/fetch', {'url': 'https://example.com/cover.png'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ImageTests(FakeYotoTestCase):
+    def test_atlas_layout(self):
+        self.assertEqual(images.atlas_layout(0), (0, 0, []))
+        width, height, positions = images.atlas_layout(5)
+        self.assertEqual((width, height), (48, 32))
+        self.assertEqual(positions[:4], [(0, 0), (16, 0), (32, 0), (0, 16)])
+
+    def test_chapter_icons(self):
+        card = self.client.get('/api/card/card0000/', headers=self.headers).json()['data']
+        self.assertEqual(list(images.chapter_icons(card)), ['0', '1', '2'])
+
+    @skipIf(images.is_available(), 'Pillow is installed')
+    @override_settings(YOTO_MEDIA_STORE_ENABLED=True)
+    def test_images_need_pillow(self):
+        response = self.client.get('/api/card/card0000/icons', headers=self.headers)
+        self.assertEqual(response.status_code, 501)
+
+    def test_images_need_media_store(self):
+        for url in ('/api/card/card0000/icons', '/api/card/card0000/cover', f'/api/media/object/{"0" * 64}.png'):
+            self.assertEqual(self.client.get(url, headers=self.headers).status_code, 404, url)
+
+    def use_cover(self, width, height):
+        """Serve card0000's cover (a width x height PNG) from the fake, through a fresh media store."""
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.addCleanup(setattr, media_store, '_store', media_store._store)
+        media_store._store = media_store.MediaStore(root.name, 1024 * 1024)
+
+        buffer = io.BytesIO()
+        images.Image.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+        self.addCleanup(setattr, self.fake, 'audio', self.fake.audio)
+        self.fake.audio = buffer.getvalue()
+        cards = copy.deepcopy(self.fake.cards)
+        self.addCleanup(setattr, self.fake, 'cards', cards)
+        self.fake.cards = copy.deepcopy(cards)
+        self.fake.cards[0]['metadata']['cover'] = {'imageL': f'{self.fake.url}/s3/cover.png'}
+
+    @skipUnless(images.is_available(), 'needs Pillow')
+    @override_settings(YOTO_MEDIA_STORE_ENABLED=True, YOTO_MEDIA_ALLOWED_HOSTS=['127.0.0.1'],
+                       YOTO_THUMBNAIL_WIDTHS=[64, 128])
+    def test_cover_thumbnail(self):
+        self.use_cover(200, 100)
+        response = self.client.get('/api/card/card0000/cover?width=100&format=png', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        with images.Image.open(io.BytesIO(b''.join(response.streaming_content))) as thumbnail:
+            self.assertEqual(thumbnail.size, (128, 64))
+        response.close()
+
+        # Built once: the same width and format is served from the store
+        again = self.client.get('/api/card/card0000/cover?width=128&format=png', headers=self.headers)
+        self.assertEqual(again['ETag'], response['ETag'])
+        again.close()
+        self.assertEqual(self.fake.request_count('audio'), 1)
+
+    @skipUnless(images.is_available(), 'needs Pillow')
+    @override_settings(YOTO_MEDIA_STORE_ENABLED=True)
+    def test_cover_width_is_validated(self):
+        for width in ('0', '-64', 'wide'):
+            response = self.client.get(f'/api/card/card0000/cover?width={width}', headers=self.headers)
+            self.assertEqual(response.status_code, 400, width)
+
+
+# Fake covers live on the real CDN; leave them out of the archives
+@override_settings(YOTO_MEDIA_ALLOWED_HOSTS=[], YOTO_STREAM_CHUNK_SIZE=1000, YOTO_EXPORT_BUFFER_CHUNKS=2)
+class CardExportTests(FakeYotoTestCase):
+    def export(self, fmt, **headers):
+        response = self.client.get(f'/api/card/card0001/export?format={fmt}', headers={**self.headers, **headers})
+        return response, b''.join(response.streaming_content)
+
+    def test_tar_export(self):
+        response, body = self.export('tar')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn('attachment', response['Content-Disposition'])
+        with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+            names = archive.getnames()
+            self.assertEqual(len(names), 4)
+            self.assertTrue(names[0].endswith('/card.json'))
+            metadata = archive.extractfile(names[0]).read()
+            self.assertNotIn(b'trackUrl', metadata)
+            self.assertEqual(json.loads(metadata)['card']['cardId'], 'card0001')
+            for name in names[1:]:
+                self.assertEqual(archive.extractfile(name).read(), self.fake.audio)
+
+    def test_tar_export_resumes(self):
+        response, body = self.export('tar')
+        response, rest = self.export('tar', Range='bytes=3000-', **{'If-Range': response['ETag']})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 3000-{len(body) - 1}/{len(body)}')
+        self.assertEqual(rest, body[3000:])
+        response, _ = self.export('tar', Range='bytes=3000-', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_export_streams_over_asgi(self):
+        self.fake.audio_pace = 0.4
+        self.addCleanup(setattr, self.fake, 'audio_pace', 0.0)
+        # Three tracks of over 1.2s each: an archive built in memory first would miss the timeout
+        status, body, complete = self.asgi_get('/api/card/card0001/export?format=zip', self.headers, timeout=1.0)
+        self.assertEqual((status, complete), (200, True))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.read(archive.namelist()[-1]), self.fake.audio)
+
+    def test_zip_export(self):
+        response, body = self.export('zip')
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            self.assertEqual(len(names), 4)
+            self.assertEqual(archive.read(names[-1]), self.fake.audio)
+
+
+@override_settings(YOTO_BREAKER_FAILURES=2, YOTO_BREAKER_RESET=60)
+class ResilienceTests(FakeYotoTestCase):
+    def test_circuit_opens_and_fails_fast(self):
+        self.fake.fail_next(500, 2)
+        with self.assertLogs('api', 'WARNING'):
+            for _ in range(2):
+                self.client.get('/api/players/', headers=self.headers)
+        response = self.client.get('/api/players/', headers=self.headers)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.fake.request_count('devices'), 2)
+
+    def test_retry_after_opens_circuit(self):
+        guard = resilience.guard_for(self.fake.url)
+        with self.assertLogs('api.resilience', 'WARNING'):
+            guard.record(429, '120')
+        with self.assertRaises(resilience.UpstreamUnavailable) as raised:
+            guard.acquire()
+        self.assertGreater(raised.exception.retry_after, 100)
+
+    def test_half_open_probe_closes_circuit(self):
+        breaker = resilience.CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+        with self.assertLogs('api.resilience', 'INFO'):
+            breaker.record_failure()
+            breaker.before_call()  # The probe is let through
+            with self.assertRaises(resilience.UpstreamUnavailable):
+                breaker.before_call()
+            breaker.record_success()
+        self.assertEqual(breaker.state, resilience.CLOSED)
+
+    @override_settings(YOTO_BREAKER_RESET=0)
+    def test_failed_probe_is_released(self):
+        guard = resilience.guard_for(self.fake.url)
+        with self.assertLogs('api.resilience', 'WARNING'):
+            guard.record(500)
+            guard.record(500)
+            # The probe is let through, then fails with something other than a transport error
+            with self.assertRaises(TypeError):
+                YotoAPIClient()._send('POST', f'{self.fake.url}/card', {}, json=object())
+        guard.acquire()  # Not stuck half-open waiting for a probe that never reports back
+
+    def test_stale_library_served_while_open(self):
+        self.client.get('/api/library/', headers=self.headers)
+        with self.assertLogs('api', 'INFO'):
+            resilience.guard_for(self.fake.url).record(503, '60')
+            response = self.client.get('/api/library/?refresh=1', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['data']), 5)
+        self.assertEqual(self.fake.request_count('library'), 1)
+
+    def test_rate_limiter_waits_then_refuses(self):
+        bucket = resilience.TokenBucket(rate=10, burst=1)
+        self.assertEqual(bucket.reserve(max_wait=1), 0)
+        self.assertGreater(bucket.reserve(max_wait=1), 0)
+        with self.assertRaises(resilience.UpstreamUnavailable):
+            bucket.reserve(max_wait=0.01)
+
+
+class WarmupTests(FakeYotoTestCase):
+    def setUp(self):
+        super().setUp()
+        env = self.settings(USE_ENV_CREDENTIALS=True, YOTO_ACCESS_TOKEN=self.token, YOTO_REFRESH_TOKEN=REFRESH_TOKEN,
+                            YOTO_CLIENT_ID=CLIENT_ID, YOTO_CLIENT_SECRET=CLIENT_SECRET)
+        env.enable()
+        self.addCleanup(env.disable)
+
+    def test_warm_cache_command_fills_the_cache(self):
+        self.client.get('/api/library/', headers=self.headers)
+        self.client.get('/api/card/card0001/', headers=self.headers)
+        # Only the list of recently opened cards survives, as after a restart with a shared cache
+        client = YotoAPIClient()
+        client.access_token = self.token
+        cache.response_cache.backend.delete(
+            cache.response_cache.make_key(cache.account_key(client), 'card_playable', 'card0001'))
+
+        with self.assertLogs('api.warmup', 'INFO'):
+            call_command('warm_cache', '--once', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(self.fake.request_count('library'), 2)
+        self.assertEqual(self.fake.request_count('card'), 2)
+
+        library = self.client.get('/api/library/', headers=self.headers)
+        card = self.client.get('/api/card/card0001/', headers=self.headers)
+        self.assertEqual((library['X-Cache'], card['X-Cache']), ('hit', 'hit'))
+        self.assertEqual(self.fake.request_count('library'), 2)
+        self.assertEqual(self.fake.request_count('card'), 2)
+
+    @override_settings(YOTO_ACCESS_TOKEN='')
+    def test_failed_warm_up_does_not_block_startup(self):
+        self.fake.fail_next(503)
+        stop = threading.Event()
+        worker = threading.Thread(target=warmup.CacheWarmer(2, 600, 10).run_forever, args=(stop,), daemon=True)
+        with self.assertLogs('api', 'WARNING') as logs:
+            worker.start()
+            deadline = time.monotonic() + 5
+            while not any(r.name == 'api.warmup' for r in logs.records) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # The worker waits for its next run; the proxy keeps serving meanwhile
+            response = self.client.get('/api/players/', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(worker.is_alive())
+        self.assertTrue(any('Cache warm-up failed' in line for line in logs.output))
+        stop.set()
+        worker.join(1)
+        self.assertFalse(worker.is_alive())
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_percentile(self):
+        values = [i / 100 for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 0.5)
+        self.assertEqual(percentile(values, 99), 0.99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_run_load_counts_errors(self):
+        result = run_load('test', lambda i: 500 if i % 4 == 0 else 200, requests=20, concurrency=4)
+        summary = result.summary()
+        self.assertEqual(summary['requests'], 20)
+        self.assertEqual(summary['errors'], 5)
@@ -0,0 +1,199 @@
+"""
+Process-wide OAuth token manager for the Yoto API.
+
+Token refreshes are single-flight per account: when several concurrent
+requests find the same access token expired, one of them POSTs to the token
+endpoint and the others wait for its result. Tokens that are still in use are
+refreshed in the background shortly before they expire, so requests rarely
+pay the refresh latency inline.
+"""
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import requests
+from django.conf import settings
+
+from . import identity, metrics, transport
+
+logger = logging.getLogger(__name__)
+
+
+def token_url() -> str:
+    """OAuth token endpoint (YOTO_AUTH_BASE_URL/oauth/token)."""
+    return f"{settings.YOTO_AUTH_BASE_URL}/oauth/token"
+
+
+class TokenState:
+    """An access token obtained by the manager, plus what is needed to renew it."""
+
+    def __init__(self, access_token: str, expiry: datetime, refresh_token: str,
+                 client_id: str, client_secret: str):
+        self.access_token = access_token
+        self.expiry = expiry
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+
+    def is_fresh(self) -> bool:
+        return datetime.now() < self.expiry
+
+
+class _Flight:
+    """A refresh in progress that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[TokenState] = None
+
+
+class TokenManager:
+    """Shares refreshed tokens between all clients of the same account."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, TokenState] = {}
+        self._flights: Dict[str, _Flight] = {}
+        self._last_used: Dict[str, float] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self.refresh_count = 0
+
+    @staticmethod
+    def key_for(refresh_token: Optional[str], client_id: Optional[str]) -> str:
+        identity = f"{client_id or ''}:{refresh_token or ''}"
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def current(self, refresh_token: Optional[str], client_id: Optional[str]) -> Optional[TokenState]:
+        """Return the latest unexpired token for an account, if the manager has one."""
+        key = self.key_for(refresh_token, client_id)
+        with self._lock:
+            state = self._tokens.get(key)
+            if state is None:
+                return None
+            self._last_used[key] = time.monotonic()
+            return state if state.is_fresh() else None
+
+    def refresh(self, refresh_token: str, client_id: str, client_secret: str,
+                stale_token: Optional[str] = None) -> Optional[TokenState]:
+        """
+        Return a fresh token for the account, refreshing at most once at a time.
+
+        stale_token is the access token the caller found expired or rejected;
+        if another caller has already replaced it, the newer token is returned
+        without contacting the token endpoint. Returns None if refresh fails.
+        """
+        key = self.key_for(refresh_token, client_id)
+        with self._lock:
+            self._last_used[key] = time.monotonic()
+            state = self._tokens.get(key)
+            if state is not None and state.is_fresh() and state.access_token != stale_token:
+                return state
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait(sum(transport.default_timeout()))
+            return flight.result
+
+        try:
+            # Prefer the stored refresh token in case the server rotated it
+            if state is not None:
+                refresh_token = state.refresh_token
+            flight.result = self._fetch(key, refresh_token, client_id, client_secret)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.result
+
+    def forget(self, key: str):
+        """Drop everything held for an account and cancel its background refresh."""
+        with self._lock:
+            self._tokens.pop(key, None)
+            self._last_used.pop(key, None)
+            timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _fetch(self, key: str, refresh_token: str, client_id: str,
+               client_secret: str) -> Optional[TokenState]:
+        data = {
+            'grant_type': 'refresh_token',
+            'refresh_token': refresh_token,
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'audience': 'https://api.yotoplay.com'
+        }
+
+        try:
+            with metrics.timed('refresh'):
+                response = transport.post(token_url(), json=data)
+            response.raise_for_status()
+            token_data = response.json()
+        except requests.exceptions.RequestException as e:
+            logger.warning("Token refresh failed: %s", e)
+            metrics.token_refreshes.inc(outcome='failure')
+            return None
+        metrics.token_refreshes.inc(outcome='success')
+
+        expires_in = token_data.get('expires_in', 3600)  # Default to 1 hour
+        state = TokenState(
+            access_token=token_data.get('access_token'),
+            expiry=datetime.now() + timedelta(seconds=expires_in - 60),  # Refresh 1 min early
+            refresh_token=token_data.get('refresh_token') or refresh_token,
+            client_id=client_id,
+            client_secret=client_secret,
+        )
+        # Issued by the token endpoint itself, so its account can be trusted
+        identity.vouch(state.access_token)
+        with self._lock:
+            self._tokens[key] = state
+            self.refresh_count += 1
+        self._schedule(key, state)
+        return state
+
+    def _schedule(self, key: str, state: TokenState):
+        """Arrange a background refresh YOTO_TOKEN_REFRESH_LEAD seconds before expiry."""
+        delay = (state.expiry - datetime.now()).total_seconds() - settings.YOTO_TOKEN_REFRESH_LEAD
+        timer = threading.Timer(max(delay, 30), self._background_refresh, args=(key,))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.get(key)
+            self._timers[key] = timer
+        if previous is not None:
+            previous.cancel()
+        timer.start()
+
+    def _background_refresh(self, key: str):
+        with self._lock:
+            state = self._tokens.get(key)
+            last_used = self._last_used.get(key, 0)
+        if state is None:
+            return
+
+        # Stop renewing tokens nobody has used for a while
+        if time.monotonic() - last_used > settings.YOTO_TOKEN_IDLE_TIMEOUT:
+            self.forget(key)
+            return
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+            else:
+                return  # A request is already refreshing this account
+        try:
+            flight.result = self._fetch(key, state.refresh_token, state.client_id, state.client_secret)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
+token_manager = TokenManager()
@@ -0,0 +1,181 @@
+"""
+Shared HTTP transport for outbound calls to Yoto (API, OAuth and S3).
+
+Every YotoAPIClient reuses a single process-wide requests.Session so that
+TCP/TLS connections are kept alive and pooled between proxied calls instead
+of paying a fresh handshake for every request.
+"""
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict, Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+class PoolStats:
+    """Thread-safe counters describing how the connection pool is used."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.waiting = 0
+        self.max_waiting = 0
+
+    def checkout_started(self, exhausted: bool):
+        """Record a checkout; exhausted means no idle connection was available."""
+        if not exhausted:
+            return
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def checkout_finished(self, exhausted: bool, reused: bool):
+        """Record the outcome of a checkout started with checkout_started()."""
+        with self._lock:
+            if exhausted:
+                self.waiting -= 1
+            if reused:
+                self.reused += 1
+            else:
+                self.opened += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """Return a consistent copy of the counters."""
+        with self._lock:
+            return {
+                'opened': self.opened,
+                'reused': self.reused,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class _CountingPoolMixin:
+    """Connection pool mixin that reports checkouts to pool_stats."""
+
+    def _get_conn(self, timeout=None):
+        exhausted = self.pool is not None and self.pool.empty()
+        pool_stats.checkout_started(exhausted)
+        conn = None
+        try:
+            conn = super()._get_conn(timeout=timeout)
+            return conn
+        finally:
+            # A connection that still holds a socket is a kept-alive reuse;
+            # anything else will open a new TCP/TLS connection on first use.
+            pool_stats.checkout_finished(exhausted, getattr(conn, 'sock', None) is not None)
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools report usage statistics."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _build_retry() -> Retry:
+    """Retry policy for idempotent requests and connection failures."""
+    return Retry(
+        total=settings.YOTO_HTTP_MAX_RETRIES,
+        backoff_factor=settings.YOTO_HTTP_BACKOFF_FACTOR,
+        status_forcelist=(502, 503, 504),
+        # Long Retry-After waits are left to the circuit breaker (api.resilience)
+        # rather than slept through inside a worker thread
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    # The session is shared by every account, so never let upstream cookies
+    # leak from one user's request into another's.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    adapter = PooledHTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=settings.YOTO_HTTP_POOL_SIZE,
+        pool_block=settings.YOTO_HTTP_POOL_BLOCK,
+        max_retries=_build_retry(),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def default_timeout() -> tuple:
+    """(connect, read) timeout applied when a caller does not pass one."""
+    return (settings.YOTO_HTTP_CONNECT_TIMEOUT, settings.YOTO_HTTP_READ_TIMEOUT)
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request through the shared session.
+
+    Accepts the same arguments as requests.request(); a default
+    connect/read timeout is applied if none is given.
+    """
+    kwargs.setdefault('timeout', default_timeout())
+    return get_session().request(method, url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """Send a POST request through the shared session."""
+    return request('POST', url, **kwargs)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Return pool counters plus the configured limits, for sizing the pool."""
+    stats: Dict[str, Any] = pool_stats.snapshot()
+    stats['pool_size'] = settings.YOTO_HTTP_POOL_SIZE
+    stats['pool_block'] = settings.YOTO_HTTP_POOL_BLOCK
+    stats['max_retries'] = settings.YOTO_HTTP_MAX_RETRIES
+    stats['hosts'] = {}
+
+    if _session is not None:
+        adapter = _session.get_adapter('https://')
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['hosts'][pool.host] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'available': pool.pool.qsize() if pool.pool is not None else 0,
+            }
+    return stats
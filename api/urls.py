@@ -1,15 +1,35 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI, serve the upstream proxy endpoints from the async views
+if settings.YOTO_ASYNC_VIEWS:
+    from . import async_views as proxy_views
+else:
+    proxy_views = views
+
 urlpatterns = [
     path('check-config/', views.check_config, name='check_config'),
     path('start-oauth/', views.start_oauth, name='start_oauth'),
     path('auth/token', views.exchange_token, name='exchange_token'),
     path('auth/token-account', views.exchange_token_account, name='exchange_token_account'),
     path('test/', views.test_connection, name='test_connection'),
-    path('family/', views.get_family, name='get_family'),
-    path('players/', views.get_players, name='get_players'),
+    path('transport/stats/', views.transport_stats, name='transport_stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('bootstrap', proxy_views.bootstrap, name='bootstrap'),
+    path('family/', proxy_views.get_family, name='get_family'),
+    path('players/', proxy_views.get_players, name='get_players'),
+    path('players/stream', views.players_stream, name='players_stream'),
     path('players/<str:player_id>/', views.get_player_detail, name='get_player_detail'),
-    path('library/', views.get_library, name='get_library'),
-    path('card/<str:card_id>/', views.get_card_detail, name='get_card_detail'),
+    path('library/', proxy_views.get_library, name='get_library'),
+    path('library/sync', proxy_views.sync_library, name='sync_library'),
+    path('search', views.search_library, name='search_library'),
+    path('card/<str:card_id>/', proxy_views.get_card_detail, name='get_card_detail'),
+    path('card/<str:card_id>/track/<int:chapter_index>', views.stream_track, name='stream_track'),
+    path('cards/batch', proxy_views.get_cards_batch, name='get_cards_batch'),
+    path('card/<str:card_id>/icons', views.card_icons, name='card_icons'),
+    path('card/<str:card_id>/cover', views.card_cover, name='card_cover'),
+    path('card/<str:card_id>/export', views.export_card, name='export_card'),
+    path('media/fetch', views.media_fetch, name='media_fetch'),
+    path('media/object/<str:content_hash>.<str:ext>', views.media_object, name='media_object'),
 ]
@@ -1,58 +1,102 @@
-from django.http import JsonResponse
+import contextvars
+import copy
+import logging
+import math
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
 from django.conf import settings
+from django.db import DatabaseError
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import content_disposition_header
+from .async_client import open_stream
 from .yoto_client import YotoAPIClient
+from . import (cache, card_export, clients, identity, images, library_index, library_sync, media_store,
+               metrics, player_stream, search, tokens, transport)
+from .library_index import LibraryQuery
+from .pages import pages
+from .resilience import UpstreamUnavailable
+from .responses import api_response, json_dumps
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import json
 
+logger = logging.getLogger(__name__)
 
-def get_client_from_request(request):
-    """Get YotoAPIClient configured with credentials from request headers or environment."""
-    print("=== get_client_from_request called ===")
-    print(f"All request headers: {dict(request.headers)}")
-    
-    client = YotoAPIClient()
+
+def get_client_from_request(request, client_class=YotoAPIClient):
+    """
+    Get YotoAPIClient configured with credentials from request headers or environment.
     
-    # Get user's tokens from headers (stored in their browser's IndexedDB)
-    access_token = request.headers.get('X-Access-Token')
-    refresh_token = request.headers.get('X-Refresh-Token')
-    client_id = request.headers.get('X-Client-Id')
-    client_secret = request.headers.get('X-Client-Secret')
+    Clients come from the per-account registry (api.clients), so a token
+    refreshed by an earlier request is reused.
+    """
+    with metrics.timed('credentials'):
+        # Get user's tokens from headers (stored in their browser's IndexedDB)
+        access_token = request.headers.get('X-Access-Token')
+        refresh_token = request.headers.get('X-Refresh-Token')
+        client_id = request.headers.get('X-Client-Id')
+        client_secret = request.headers.get('X-Client-Secret')
     
-    print(f"Headers received:")
-    print(f"  X-Access-Token: {'present' if access_token else 'missing'}")
-    print(f"  X-Refresh-Token: {'present' if refresh_token else 'missing'}")
-    print(f"  X-Client-Id: {'present' if client_id else 'missing'}")
-    print(f"  X-Client-Secret: {'present' if client_secret else 'missing'}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Credential headers present: %s", [
+                name for name, value in (('X-Access-Token', access_token), ('X-Refresh-Token', refresh_token),
+                                         ('X-Client-Id', client_id), ('X-Client-Secret', client_secret))
+                if value
+            ])
     
-    # If USE_ENV_CREDENTIALS is enabled, use server-side CLIENT credentials from settings
-    # but still use user's tokens from headers
-    if settings.USE_ENV_CREDENTIALS:
-        print("Using environment CLIENT credentials from settings")
-        client.client_id = settings.YOTO_CLIENT_ID
-        client.client_secret = settings.YOTO_CLIENT_SECRET
-        print(f"Set client_id from env: {'present' if client.client_id else 'missing'}")
-        print(f"Set client_secret from env: {'present' if client.client_secret else 'missing'}")
-    else:
-        # Use client credentials from headers
-        if client_id:
-            client.client_id = client_id
-            print(f"Set client_id: {client_id[:30]}...")
-        if client_secret:
-            client.client_secret = client_secret
-            print(f"Set client_secret: {client_secret[:30]}...")
+        # If USE_ENV_CREDENTIALS is enabled, use server-side CLIENT credentials from settings
+        # but still use user's tokens from headers
+        if settings.USE_ENV_CREDENTIALS:
+            client_id = settings.YOTO_CLIENT_ID
+            client_secret = settings.YOTO_CLIENT_SECRET
     
-    # Always use user's tokens from headers
-    if access_token:
-        client.access_token = access_token
-        print(f"Set access_token: {access_token[:30]}...")
-    if refresh_token:
-        client.refresh_token = refresh_token
-        print(f"Set refresh_token: {refresh_token[:30]}...")
+        # Requests without tokens are rejected by the views; don't register them
+        if not access_token and not refresh_token:
+            client = client_class()
+            if client_id:
+                client.client_id = client_id
+            if client_secret:
+                client.client_secret = client_secret
+            return client
         
-    return client
+        return clients.registry.checkout(client_class, access_token, refresh_token, client_id, client_secret)
+
+
+def wants_refresh(request):
+    """True if the caller asked to bypass the server-side response cache."""
+    return request.GET.get('refresh', '').lower() in ('1', 'true')
+
+
+def is_asgi(request):
+    """
+    True if the request is served over ASGI.
+
+    Django collects a sync streaming body into a list before sending it over
+    ASGI (and an async one over WSGI), so streaming views pick their body to
+    match the server.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def wants_playable(value):
+    """
+    Parse a playable flag from a query parameter or JSON body; defaults to True.
+
+    The single-card and batch endpoints both read it through here, so the
+    same value means the same thing on either.
+    """
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() not in ('0', 'false', 'no', 'off')
 
 
 def create_response_with_tokens(client, data, status='success'):
@@ -66,7 +110,18 @@ def create_response_with_tokens(client, data, status='success'):
     if client.access_token:
         response_data['newAccessToken'] = client.access_token
     
-    return JsonResponse(response_data)
+    return HttpResponse(json_dumps(response_data), content_type='application/json')
+
+
+def unavailable_response(e):
+    """503 for calls refused by the upstream circuit breaker or rate limiter."""
+    response = JsonResponse({
+        'status': 'error',
+        'message': str(e)
+    }, status=503)
+    if e.retry_after:
+        response['Retry-After'] = str(math.ceil(e.retry_after))
+    return response
 
 
 @require_http_methods(["GET"])
@@ -77,74 +132,52 @@ def setup_page(request):
         from django.shortcuts import redirect
         return redirect('/')
     
-    # Read the static setup-local.html file and render it directly
-    import os
-    from django.http import HttpResponse
-    
-    setup_file_path = os.path.join(settings.BASE_DIR, 'static', 'setup-local.html')
-    with open(setup_file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    return HttpResponse(content, content_type='text/html')
+    return pages.get('setup-local').response(request)
 
 
 @require_http_methods(["GET"])
 def setup_account_only_page(request):
     """Render the account-only setup page for server deployments."""
-    import os
-    from django.http import HttpResponse
-    
-    setup_file_path = os.path.join(settings.BASE_DIR, 'static', 'setup-server.html')
-    with open(setup_file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    return HttpResponse(content, content_type='text/html')
+    return pages.get('setup-server').response(request)
 
 
 @require_http_methods(["GET"])
 def app_page(request):
-    """Render the main app page."""
-    import os
-    from django.conf import settings
-    from django.http import HttpResponse
-    
-    app_file_path = os.path.join(settings.BASE_DIR, 'static', 'app.html')
-    with open(app_file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Inject server config as JavaScript variable
-    config_script = f'<script>window.SERVER_CONFIG = {{useEnvCredentials: {"true" if settings.USE_ENV_CREDENTIALS else "false"}}};</script>'
-    # Insert before closing </head> tag
-    content = content.replace('</head>', config_script + '</head>')
-    
-    return HttpResponse(content, content_type='text/html')
+    """Render the main app page (SERVER_CONFIG is injected when the page is preloaded)."""
+    return pages.get('app').response(request)
 
 
 def service_worker(request):
     """Serve the service worker from root."""
-    import os
-    from django.conf import settings
-    from django.http import HttpResponse
-    
-    sw_file_path = os.path.join(settings.BASE_DIR, 'static', 'sw.js')
-    with open(sw_file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    return HttpResponse(content, content_type='application/javascript')
+    return pages.get('sw').response(request)
 
 
 @require_http_methods(["GET"])
 def check_config(request):
     """Check if server is using environment credentials."""
     use_env = settings.USE_ENV_CREDENTIALS
-    print(f"=== check_config called ===")
-    print(f"USE_ENV_CREDENTIALS: {use_env}")
     return JsonResponse({
         'status': 'success',
         'useEnvCredentials': use_env
     })
 
 
+@require_http_methods(["GET"])
+def transport_stats(request):
+    """Report upstream connection pool statistics for pool sizing."""
+    return JsonResponse({
+        'status': 'success',
+        'data': transport.get_pool_stats()
+    })
+
+
+@require_http_methods(["GET"])
+def prometheus_metrics(request):
+    """Expose request/upstream/cache metrics in the Prometheus text format."""
+    body = metrics.registry.render() + metrics.render_pool_stats(transport.get_pool_stats())
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @require_http_methods(["GET"])
 def start_oauth(request):
     """Start OAuth flow using server credentials from .env"""
@@ -161,11 +194,7 @@ def start_oauth(request):
     protocol = 'https' if request.is_secure() else 'http'
     redirect_uri = f"{protocol}://{current_host}/callback"
     
-    print(f"=== start_oauth ===")
-    print(f"current_host: {current_host}")
-    print(f"protocol: {protocol}")
-    print(f"redirect_uri: {redirect_uri}")
-    print(f"is_secure: {request.is_secure()}")
+    logger.debug("Starting OAuth flow with redirect_uri %s", redirect_uri)
     
     params = {
         'response_type': 'code',
@@ -175,8 +204,7 @@ def start_oauth(request):
         'audience': 'https://api.yotoplay.com'
     }
     
-    auth_url = f"https://login.yotoplay.com/oauth/authorize?{urlencode(params)}"
-    print(f"auth_url: {auth_url}")
+    auth_url = f"{settings.YOTO_AUTH_BASE_URL}/oauth/authorize?{urlencode(params)}"
     return redirect(auth_url)
 
 
@@ -212,7 +240,7 @@ def exchange_token_account(request):
             }, status=500)
 
         # Exchange code for tokens
-        token_url = 'https://login.yotoplay.com/oauth/token'
+        token_url = tokens.token_url()
         token_data = {
             'grant_type': 'authorization_code',
             'code': code,
@@ -222,26 +250,26 @@ def exchange_token_account(request):
             'audience': 'https://api.yotoplay.com'
         }
 
-        print(f"Exchanging token with redirect_uri: {redirect_uri}")
+        logger.debug("Exchanging authorization code with redirect_uri %s", redirect_uri)
         
-        token_response = requests.post(token_url, json=token_data)
+        token_response = transport.post(token_url, json=token_data)
         
         if not token_response.ok:
-            print(f"Token exchange failed: {token_response.status_code} - {token_response.text}")
+            logger.warning("Token exchange failed: %s - %s", token_response.status_code, token_response.text)
             return JsonResponse({
                 'status': 'error',
                 'message': f'Token exchange failed: {token_response.text}'
             }, status=token_response.status_code)
 
-        tokens = token_response.json()
+        result = token_response.json()
         
         return JsonResponse({
             'status': 'success',
-            'data': tokens
+            'data': result
         })
 
     except Exception as e:
-        print(f"Token exchange error: {str(e)}")
+        logger.exception("Token exchange error: %s", e)
         return JsonResponse({
             'status': 'error',
             'message': str(e)
@@ -259,7 +287,7 @@ def exchange_token(request):
         client_secret = data.get('clientSecret')
         redirect_uri = data.get('redirectUri')
 
-        print(f"Token exchange request: code={code[:20] if code else None}..., client_id={client_id[:20] if client_id else None}..., redirect_uri={redirect_uri}")
+        logger.debug("Token exchange request with redirect_uri %s", redirect_uri)
 
         if not all([code, client_id, client_secret, redirect_uri]):
             missing = []
@@ -269,7 +297,7 @@ def exchange_token(request):
             if not redirect_uri: missing.append('redirectUri')
             
             error_msg = f'Missing required parameters: {", ".join(missing)}'
-            print(f"ERROR: {error_msg}")
+            logger.warning("Token exchange rejected: %s", error_msg)
             
             return JsonResponse({
                 'status': 'error',
@@ -277,7 +305,7 @@ def exchange_token(request):
             }, status=400)
 
         # Exchange code for tokens
-        token_url = 'https://login.yotoplay.com/oauth/token'
+        token_url = tokens.token_url()
         token_data = {
             'grant_type': 'authorization_code',
             'code': code,
@@ -287,14 +315,13 @@ def exchange_token(request):
             'audience': 'https://api.yotoplay.com'
         }
 
-        print(f"Sending request to {token_url}")
-        response = requests.post(token_url, json=token_data)
-        print(f"Response status: {response.status_code}")
+        response = transport.post(token_url, json=token_data)
+        logger.debug("Token exchange response: %s", response.status_code)
         
         response.raise_for_status()
 
         result = response.json()
-        print(f"Token exchange successful!")
+        logger.info("Token exchange successful")
 
         return JsonResponse({
             'status': 'success',
@@ -302,15 +329,15 @@ def exchange_token(request):
         })
 
     except requests.exceptions.RequestException as e:
-        print(f"Token exchange HTTP error: {str(e)}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response body: {e.response.text}")
+        logger.warning("Token exchange HTTP error: %s", e)
+        if getattr(e, 'response', None) is not None:
+            logger.warning("Token exchange response body: %s", e.response.text)
         return JsonResponse({
             'status': 'error',
             'message': f'Token exchange failed: {str(e)}'
         }, status=500)
     except Exception as e:
-        print(f"Token exchange error: {str(e)}")
+        logger.exception("Token exchange error: %s", e)
         return JsonResponse({
             'status': 'error',
             'message': str(e)
@@ -326,20 +353,15 @@ def oauth_callback(request):
     state = request.GET.get('state')
     error = request.GET.get('error')
 
-    print(f"=== OAuth Callback View ===")
-    print(f"Code: {code[:20] if code else None}...")
-    print(f"State: {state[:20] if state else None}...")
-    print(f"Error: {error}")
+    logger.debug("OAuth callback (code %s, error %s)", 'present' if code else 'missing', error)
     
     # If using env credentials (server mode), redirect to setup page with code
     if settings.USE_ENV_CREDENTIALS:
-        print("Using env credentials - redirecting to /setup/ with code")
         if error:
             return redirect(f'/setup/?error={error}')
         return redirect(f'/setup/?code={code}')
     
     # Otherwise, use popup callback flow for local setup
-    print("Rendering oauth_callback.html for popup flow")
     if error:
         return render(request, 'oauth_callback.html', {
             'error': error,
@@ -379,6 +401,8 @@ def get_family(request):
             'status': 'success',
             'data': family_data
         })
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
         return JsonResponse({
             'status': 'error',
@@ -398,23 +422,83 @@ def get_players(request):
                 'message': 'No access token provided'
             }, status=401)
         
-        players = client.get_players()
-        return JsonResponse({
-            'status': 'success',
-            'data': players
-        })
+        players = cache.get_players(client, refresh=wants_refresh(request))
+        return api_response(request, players, client)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
-        print(f"Error in get_players view: {e}")
+        logger.exception("Error in get_players view: %s", e)
         return JsonResponse({
             'status': 'error',
             'message': str(e)
         }, status=500)
 
 
+@require_http_methods(["GET"])
+def players_stream(request):
+    """Server-sent events with player status changes (see api.player_stream)."""
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    # Only a token the Yoto API accepts may join (or start) an account's poller
+    try:
+        cache.get_players(client)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.warning("Player stream refused: %s", e)
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=401)
+
+    events = player_stream.astream_events(client) if is_asgi(request) else player_stream.stream_events(client)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def parse_library_query(request):
+    """Return (query, error_response); query is None when the full listing was asked for."""
+    if not LibraryQuery.wanted(request.GET):
+        return None, None
+    try:
+        return LibraryQuery(request.GET), None
+    except ValueError as e:
+        return None, JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+
+
+def library_page(request, client, library, query):
+    """One page of the library from the account's index (see api.library_index)."""
+    page = library_index.indexes.index_for(cache.account_key(client), library).page(query)
+    # The upstream validators describe the whole listing, not this page
+    client.last_validators = {}
+    if media_store.is_enabled():
+        page['items'] = media_store.rewrite_library_media(copy.deepcopy(page['items']))
+    return api_response(request, page, client, items_key='items')
+
+
 @require_http_methods(["GET"])
 def get_library(request):
-    """Get library from Yoto API."""
+    """
+    Get library from Yoto API.
+    
+    With any of ?limit, cursor, sort, q, category or author, returns one
+    sorted, filtered page ({'items', 'nextCursor', 'total'}) instead.
+    """
     try:
+        query, error_response = parse_library_query(request)
+        if error_response:
+            return error_response
+        
         client = get_client_from_request(request)
         
         if not client.access_token:
@@ -423,52 +507,640 @@ def get_library(request):
                 'message': 'No access token provided'
             }, status=401)
         
-        library = client.get_library()
+        library = cache.get_library(client, refresh=wants_refresh(request))
+        if query is not None:
+            return library_page(request, client, library, query)
+        if media_store.is_enabled():
+            media_store.rewrite_library_media(library)
+        return api_response(request, library, client)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception("Error in get_library view: %s", e)
         return JsonResponse({
-            'status': 'success',
-            'data': library
-        })
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+
+@require_http_methods(["GET"])
+def sync_library(request):
+    """Library changes since the ?since= sync token."""
+    try:
+        client = get_client_from_request(request)
+        
+        if not client.access_token:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'No access token provided'
+            }, status=401)
+        
+        changes = library_sync.sync_library(client, request.GET.get('since'), refresh=wants_refresh(request))
+        if media_store.is_enabled():
+            media_store.rewrite_library_media(changes['added'] + changes['changed'])
+        return api_response(request, changes, client)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
-        print(f"Error in get_library view: {e}")
+        logger.exception("Error in sync_library view: %s", e)
         return JsonResponse({
             'status': 'error',
             'message': str(e)
         }, status=500)
 
 
+@require_http_methods(["GET"])
+def search_library(request):
+    """
+    Search card, chapter and track titles with ?q= (see api.search).
+    
+    Answers from the local index only, so it covers the cards this server
+    has seen: the library listing, plus chapters of cards opened so far.
+    The index is shared by account, so a token the Yoto API hasn't accepted
+    yet is checked upstream (by loading the library) before it is searched.
+    """
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', settings.YOTO_SEARCH_MAX_RESULTS)), 1),
+                    settings.YOTO_SEARCH_MAX_RESULTS)
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'limit must be a number'
+        }, status=400)
+
+    account = identity.verified_account(client)
+    if account is None:
+        try:
+            cache.get_library(client)
+        except UpstreamUnavailable as e:
+            return unavailable_response(e)
+        except Exception as e:
+            logger.warning("Search refused: %s", e)
+        account = identity.verified_account(client)
+        if account is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Access token was not accepted'
+            }, status=401)
+
+    try:
+        results = search.search(account, request.GET.get('q', ''), limit)
+    except DatabaseError as e:
+        logger.exception("Error in search_library view: %s", e)
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Search index unavailable; run `python manage.py migrate`'
+        }, status=503)
+    return api_response(request, results, client)
+
+
 @require_http_methods(["GET"])
 def get_card_detail(request, card_id):
     """Get detailed card information including chapters."""
     try:
-        print(f"=== get_card_detail called for card_id: {card_id} ===")
         client = get_client_from_request(request)
         
-        print(f"Client access_token: {client.access_token[:20] if client.access_token else None}...")
-        print(f"Client refresh_token: {client.refresh_token[:20] if client.refresh_token else None}...")
-        print(f"Client client_id: {client.client_id[:20] if client.client_id else None}...")
-        
         if not client.access_token:
-            print("ERROR: No access token provided")
             return JsonResponse({
                 'status': 'error',
                 'message': 'No access token provided'
             }, status=401)
         
-        print(f"Calling client.get_card({card_id})...")
-        card = client.get_card(card_id, playable=True)
-        print(f"Successfully retrieved card details")
+        card = cache.get_card(client, card_id, playable=wants_playable(request.GET.get('playable')),
+                              refresh=wants_refresh(request))
+        if media_store.is_enabled():
+            media_store.rewrite_card_media(card)
         
-        return create_response_with_tokens(client, card)
+        return api_response(request, card, client, include_token=True)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
-        print(f"!!! ERROR in get_card_detail view: {type(e).__name__}: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_card_detail view for card %s: %s", card_id, e)
         return JsonResponse({
             'status': 'error',
             'message': str(e)
         }, status=500)
 
 
+def parse_card_batch(request):
+    """
+    Parse a batch card request body: {"cardIds": [...], "playable": bool}.
+
+    playable may also be given as ?playable= and is read like the single-card
+    view's (see wants_playable).
+
+    Returns (card_ids, playable, error_response); duplicate IDs are dropped
+    while keeping the original order.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        data = None
+    card_ids = data.get('cardIds') if isinstance(data, dict) else None
+
+    if not isinstance(card_ids, list) or not all(isinstance(c, str) and c for c in card_ids):
+        return None, None, JsonResponse({
+            'status': 'error',
+            'message': 'Request body must be JSON with a "cardIds" list of card ID strings'
+        }, status=400)
+
+    card_ids = list(dict.fromkeys(card_ids))
+    if len(card_ids) > settings.YOTO_BATCH_MAX_CARDS:
+        return None, None, JsonResponse({
+            'status': 'error',
+            'message': f'At most {settings.YOTO_BATCH_MAX_CARDS} cards can be requested at once'
+        }, status=400)
+
+    return card_ids, wants_playable(data.get('playable', request.GET.get('playable'))), None
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def get_cards_batch(request):
+    """Get details for many cards at once, fetched upstream in parallel."""
+    card_ids, playable, error_response = parse_card_batch(request)
+    if error_response:
+        return error_response
+
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    def fetch(card_id):
+        try:
+            # Each card gets its own fork: clients hold per-call state
+            return card_id, cache.get_card(client.fork(), card_id, playable=playable), None
+        except Exception as e:
+            return card_id, None, str(e)
+
+    cards, errors = {}, {}
+    if card_ids:
+        workers = min(settings.YOTO_BATCH_MAX_WORKERS, len(card_ids))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Run in copies of this request's context so upstream timings reach Server-Timing
+            futures = [executor.submit(contextvars.copy_context().run, fetch, card_id) for card_id in card_ids]
+            for card_id, card, error in (future.result() for future in futures):
+                if error is None:
+                    cards[card_id] = card
+                else:
+                    errors[card_id] = error
+
+    if media_store.is_enabled():
+        for card in cards.values():
+            media_store.rewrite_card_media(card)
+    return create_response_with_tokens(client, {'cards': cards, 'errors': errors})
+
+
+# Sections of GET /api/bootstrap, in response order
+BOOTSTRAP_SECTIONS = ('players', 'library', 'family')
+
+
+def parse_bootstrap_sections(request):
+    """Return (sections, error_response) for ?sections=players,library (default: all)."""
+    raw = request.GET.get('sections', '')
+    sections = list(dict.fromkeys(s.strip() for s in raw.split(',') if s.strip())) or list(BOOTSTRAP_SECTIONS)
+    unknown = [s for s in sections if s not in BOOTSTRAP_SECTIONS]
+    if unknown:
+        return None, JsonResponse({
+            'status': 'error',
+            'message': f'Unknown sections: {", ".join(unknown)} (choose from {", ".join(BOOTSTRAP_SECTIONS)})'
+        }, status=400)
+    return sections, None
+
+
+def section_result(name, data=None, error=None, started=None):
+    """One section of the bootstrap document, with its own status and duration."""
+    if error is None:
+        section = {'status': 'success', 'data': data}
+    else:
+        if not isinstance(error, UpstreamUnavailable):
+            logger.warning("Bootstrap section %s failed: %s", name, error)
+        section = {'status': 'error', 'message': str(error)}
+    section['ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return section
+
+
+def bootstrap_library(client, refresh):
+    library = cache.get_library(client, refresh=refresh)
+    if media_store.is_enabled():
+        media_store.rewrite_library_media(library)
+    return library
+
+
+@require_http_methods(["GET"])
+def bootstrap(request):
+    """
+    Players, library and family in one response, fetched upstream in parallel.
+    
+    Each section reports its own status and time, so one failing upstream
+    call doesn't block the first screen.
+    """
+    sections, error_response = parse_bootstrap_sections(request)
+    if error_response:
+        return error_response
+
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    refresh = wants_refresh(request)
+    loaders = {
+        'players': lambda c: cache.get_players(c, refresh=refresh),
+        'library': lambda c: bootstrap_library(c, refresh),
+        'family': lambda c: c.get_family(),
+    }
+
+    def load(name):
+        started = time.perf_counter()
+        try:
+            # Each section gets its own fork: clients hold per-call state
+            with metrics.timed(name):
+                return section_result(name, loaders[name](client.fork()), started=started)
+        except Exception as e:
+            return section_result(name, error=e, started=started)
+
+    with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+        # Run in copies of this request's context so phase timings reach Server-Timing
+        futures = [executor.submit(contextvars.copy_context().run, load, name) for name in sections]
+        data = {name: future.result() for name, future in zip(sections, futures)}
+    return create_response_with_tokens(client, data)
+
+
+# Upstream audio headers passed through to the browser unchanged
+AUDIO_PASSTHROUGH_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range',
+                             'Accept-Ranges', 'ETag', 'Last-Modified')
+
+
+def resolve_track_url(client, card_id, chapter_index, track_index=0, refresh=False):
+    """Return the signed URL of a chapter's track, or None if it doesn't exist."""
+    chapters = cache.get_chapters(cache.get_card(client, card_id, playable=True, refresh=refresh))
+    if not 0 <= chapter_index < len(chapters):
+        return None
+    tracks = chapters[chapter_index].get('tracks') or []
+    if not 0 <= track_index < len(tracks):
+        return None
+    return tracks[track_index].get('trackUrl')
+
+
+def iter_upstream(upstream):
+    """Relay an upstream body in fixed-size chunks, releasing the connection when done."""
+    try:
+        yield from upstream.raw.stream(settings.YOTO_STREAM_CHUNK_SIZE, decode_content=False)
+    finally:
+        upstream.close()
+
+
+async def aiter_upstream(upstream):
+    """iter_upstream() for an httpx response read on the event loop (ASGI)."""
+    try:
+        async for chunk in upstream.aiter_raw(settings.YOTO_STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await upstream.aclose()
+
+
+def open_upstream(request, url, headers):
+    """
+    Start an audio download without reading its body.
+
+    Over ASGI the download runs on the event loop's shared httpx pool, so
+    the body can be relayed with aiter_upstream() as it arrives.
+    """
+    if is_asgi(request):
+        return async_to_sync(open_stream)('GET', url, headers)
+    return transport.request('GET', url, headers=headers, stream=True)
+
+
+def close_upstream(upstream):
+    if isinstance(upstream, requests.Response):
+        upstream.close()
+    else:
+        async_to_sync(upstream.aclose)()
+
+
+@require_http_methods(["GET"])
+def stream_track(request, card_id, chapter_index):
+    """
+    Stream a chapter's audio from its signed URL, honoring Range requests.
+
+    The chapter's first track is streamed unless ?track=<n> selects another.
+    """
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    try:
+        track_index = int(request.GET.get('track', 0))
+    except ValueError:
+        track_index = -1
+
+    upstream_headers = {}
+    if 'Range' in request.headers:
+        upstream_headers['Range'] = request.headers['Range']
+
+    try:
+        track_url = resolve_track_url(client, card_id, chapter_index, track_index)
+        if not track_url:
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Track not found'
+            }, status=404)
+
+        upstream = open_upstream(request, track_url, upstream_headers)
+        if upstream.status_code == 403:
+            # The cached signature may have been revoked early; re-sign once
+            close_upstream(upstream)
+            track_url = resolve_track_url(client, card_id, chapter_index, track_index, refresh=True)
+            upstream = open_upstream(request, track_url, upstream_headers)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.warning("Error in stream_track view: %s", e)
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=502)
+
+    if upstream.status_code not in (200, 206, 416):
+        close_upstream(upstream)
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Audio upstream returned HTTP {upstream.status_code}'
+        }, status=502)
+
+    body = iter_upstream(upstream) if isinstance(upstream, requests.Response) else aiter_upstream(upstream)
+    response = StreamingHttpResponse(body, status=upstream.status_code,
+                                     content_type=upstream.headers.get('Content-Type', 'audio/mpeg'))
+    for header in AUDIO_PASSTHROUGH_HEADERS:
+        if header in upstream.headers:
+            response[header] = upstream.headers[header]
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_http_methods(["GET"])
+def media_fetch(request):
+    """Serve card art or an icon from the server-side media store, downloading it once."""
+    url = request.GET.get('url', '')
+    if not media_store.is_enabled():
+        return media_store_disabled_response()
+    if not media_store.is_allowed_source(url):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Missing or disallowed url parameter'
+        }, status=400)
+
+    try:
+        content_hash, content_type = media_store.get_store().fetch(url)
+    except media_store.MediaStoreError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=502)
+
+    return serve_media_object(content_hash, content_type)
+
+
+def serve_media_object(content_hash, content_type, cache_control='public, max-age=86400'):
+    """Send a media store object from disk."""
+    path = media_store.get_store().open_object(content_hash)
+    if path is None:
+        # Evicted between fetch and open; let the client retry
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Media was evicted, please retry'
+        }, status=503)
+
+    # FileResponse hands the open file to the server's file wrapper (sendfile where available)
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['ETag'] = f'"{content_hash}"'
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def media_store_disabled_response():
+    return JsonResponse({
+        'status': 'error',
+        'message': 'Media store is not enabled'
+    }, status=404)
+
+
+def images_unavailable_response():
+    return JsonResponse({
+        'status': 'error',
+        'message': 'Image processing needs Pillow (pip install Pillow)'
+    }, status=501)
+
+
+@require_http_methods(["GET"])
+def media_object(request, content_hash, ext):
+    """A generated image (sprite atlas or thumbnail) by content hash; immutable."""
+    if not media_store.is_enabled():
+        return media_store_disabled_response()
+    if ext not in images.FORMATS:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Unknown image format'
+        }, status=404)
+    return serve_media_object(content_hash, images.FORMATS[ext], 'public, max-age=31536000, immutable')
+
+
+@require_http_methods(["GET"])
+def card_icons(request, card_id):
+    """
+    One sprite atlas of a card's chapter and track icons, plus where each one is.
+    
+    Returns {'sprite': URL, 'width', 'height', 'size', 'icons': {'<chapter>' or
+    '<chapter>/<track>': [x, y]}, 'errors'}.
+    """
+    if not media_store.is_enabled():
+        return media_store_disabled_response()
+    if not images.is_available():
+        return images_unavailable_response()
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    try:
+        card = cache.get_card(client, card_id, playable=False, refresh=wants_refresh(request))
+        atlas = images.build_sprite(card)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except Exception as e:
+        logger.exception("Error in card_icons view: %s", e)
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+    if atlas['sprite']:
+        atlas['sprite'] = reverse('media_object', args=[atlas['sprite'], 'png'])
+    # The card's upstream validators don't describe the atlas
+    client.last_validators = {}
+    return api_response(request, atlas, client)
+
+
+@require_http_methods(["GET"])
+def card_cover(request, card_id):
+    """A card's cover resized to ?width= (snapped to YOTO_THUMBNAIL_WIDTHS) as ?format=webp|png."""
+    if not media_store.is_enabled():
+        return media_store_disabled_response()
+    if not images.is_available():
+        return images_unavailable_response()
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    try:
+        requested = int(request.GET['width']) if request.GET.get('width') else None
+        if requested is not None and requested < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'width must be a positive number'
+        }, status=400)
+
+    try:
+        url = images.cover_url(cache.get_card(client, card_id, playable=False))
+        if not url or not media_store.is_allowed_source(url):
+            return JsonResponse({
+                'status': 'error',
+                'message': 'Card has no cover'
+            }, status=404)
+        fmt = images.thumbnail_format(request.GET.get('format'), request.headers.get('Accept', ''))
+        content_hash, content_type = images.build_thumbnail(url, images.thumbnail_width(requested), fmt)
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except media_store.MediaStoreError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=502)
+    except Exception as e:
+        logger.exception("Error in card_cover view: %s", e)
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+    response = serve_media_object(content_hash, content_type)
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def iter_export(export, byte_range):
+    """Relay an archive; a failed track aborts the download (TAR ones can then be resumed)."""
+    try:
+        yield from export.chunks(byte_range)
+    except card_export.ExportError as e:
+        logger.warning("Export of card %s aborted: %s", export.card_id, e)
+        raise
+
+
+async def aiter_export(export, byte_range):
+    """
+    iter_export() for ASGI: each chunk is built in a worker thread and sent as soon as it's ready.
+
+    (Handed the sync generator, Django would build the whole archive in memory first.)
+    """
+    chunks = iter_export(export, byte_range)
+    next_chunk = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await next_chunk(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=False)()
+
+
+@require_http_methods(["GET"])
+def export_card(request, card_id):
+    """
+    A whole card (every track, card.json and the cover) as one ?format=tar|zip download.
+
+    TAR archives have a Content-Length and honor Range/If-Range, so an
+    interrupted download can be resumed; ZIP archives are sent in one pass.
+    """
+    client = get_client_from_request(request)
+    if not client.access_token:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'No access token provided'
+        }, status=401)
+
+    fmt = request.GET.get('format', 'tar')
+    if fmt not in card_export.FORMATS:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'format must be one of {", ".join(card_export.FORMATS)}'
+        }, status=400)
+
+    try:
+        export = card_export.CardExport(client, card_id, fmt, refresh=wants_refresh(request))
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+    except card_export.ExportError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=502)
+    except Exception as e:
+        logger.exception("Error in export_card view for card %s: %s", card_id, e)
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+    byte_range, status = None, 200
+    if export.size is not None and request.headers.get('If-Range', export.etag) == export.etag:
+        try:
+            byte_range = card_export.parse_range(request.headers.get('Range', ''), export.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{export.size}'
+            return response
+        status = 206 if byte_range else 200
+
+    body = aiter_export(export, byte_range) if is_asgi(request) else iter_export(export, byte_range)
+    response = StreamingHttpResponse(body, status=status, content_type=card_export.FORMATS[fmt])
+    response['Content-Disposition'] = content_disposition_header(True, export.filename)
+    if export.size is not None:
+        first, last = byte_range or (0, export.size - 1)
+        response['Content-Length'] = str(last - first + 1)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = export.etag
+        if byte_range:
+            response['Content-Range'] = f'bytes {first}-{last}/{export.size}'
+    else:
+        response['Accept-Ranges'] = 'none'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
 @require_http_methods(["GET"])
 def get_player_detail(request, player_id):
     """Get specific player information."""
@@ -479,6 +1151,8 @@ def get_player_detail(request, player_id):
             'status': 'success',
             'data': player_data
         })
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
     except Exception as e:
         return JsonResponse({
             'status': 'error',
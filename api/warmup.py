@@ -0,0 +1,109 @@
+"""
+Cache warm-up for server deployments (USE_ENV_CREDENTIALS).
+
+Periodically refreshes the library and the playable URLs of recently opened
+cards into the response cache using the credentials from .env, so the first
+request after startup or token expiry doesn't pay full upstream latency.
+Run it with `manage.py warm_cache`, or in the web process itself by setting
+YOTO_WARM_IN_PROCESS=true.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from django.conf import settings
+
+from . import cache
+from .yoto_client import YotoAPIClient
+
+logger = logging.getLogger(__name__)
+
+# Never re-run more often than this, however short signatures are
+MIN_DELAY = 30
+
+
+def build_env_client() -> YotoAPIClient:
+    """Client authenticated with the server's .env credentials."""
+    client = YotoAPIClient()
+    client.client_id = settings.YOTO_CLIENT_ID
+    client.client_secret = settings.YOTO_CLIENT_SECRET
+    client.refresh_token = settings.YOTO_REFRESH_TOKEN or client.refresh_token
+    client.access_token = settings.YOTO_ACCESS_TOKEN or None
+
+    if not client.access_token and not client.authenticate():
+        raise Exception("Failed to authenticate with Yoto API using .env credentials")
+    return client
+
+
+class CacheWarmer:
+    """Refreshes cached library and playable card responses on a schedule."""
+
+    def __init__(self, concurrency: int, interval: int, max_cards: int):
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self.max_cards = max_cards
+
+    def warm_once(self) -> int:
+        """Warm the cache once; returns the number of seconds until the next run."""
+        client = build_env_client()
+        library = cache.get_library(client, refresh=True)
+        card_ids = cache.recent_cards(cache.account_key(client))[:self.max_cards]
+
+        def warm(card_id):
+            try:
+                card = cache.get_card(client, card_id, playable=True, refresh=True, remember=False)
+                return cache.playable_ttl(card)
+            except Exception as e:
+                logger.warning("Warm-up failed for card %s: %s", card_id, e)
+                return None
+
+        ttls: List[int] = []
+        if card_ids:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(card_ids))) as executor:
+                ttls = [ttl for ttl in executor.map(warm, card_ids) if ttl]
+
+        logger.info("Warmed library (%d cards) and %d/%d playable cards", len(library), len(ttls), len(card_ids))
+        return self.next_delay(ttls)
+
+    def next_delay(self, ttls: List[int]) -> int:
+        """
+        Seconds until the next run.
+
+        Re-warms before the shortest-lived signed URL we just cached expires,
+        so playable entries are replaced before they drop out of the cache.
+        """
+        delay = self.interval
+        if ttls:
+            delay = min(delay, int(min(ttls) * 0.8))
+        return max(delay, MIN_DELAY)
+
+    def run_forever(self, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                delay = self.warm_once()
+            except Exception as e:
+                logger.exception("Cache warm-up failed: %s", e)
+                delay = self.interval
+            stop.wait(delay)
+
+
+def default_warmer() -> CacheWarmer:
+    return CacheWarmer(
+        concurrency=settings.YOTO_WARM_CONCURRENCY,
+        interval=settings.YOTO_WARM_INTERVAL,
+        max_cards=settings.YOTO_WARM_MAX_CARDS,
+    )
+
+
+_worker: Optional[threading.Thread] = None
+
+
+def start_in_background():
+    """Start the in-process warm-up worker if configured (called from wsgi/asgi)."""
+    global _worker
+    if not (settings.YOTO_WARM_IN_PROCESS and settings.USE_ENV_CREDENTIALS) or _worker is not None:
+        return
+    _worker = threading.Thread(target=default_warmer().run_forever, name='yoto-cache-warmer', daemon=True)
+    _worker.start()
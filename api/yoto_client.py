@@ -1,22 +1,49 @@
 """
 Yoto API Client for authenticating and making requests to the Yoto API.
 """
+import copy
+import logging
+import time
 import requests
 from typing import Optional, Dict, Any
-import os
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from django.conf import settings
+
+from . import coalesce, identity, metrics, resilience, transport
+from .tokens import TokenState, token_manager
+
+logger = logging.getLogger(__name__)
+
+# Upstream cache validators kept from the last response (see last_validators)
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
 
 
 class YotoAPIClient:
     """Client for interacting with the Yoto API."""
     
     def __init__(self):
-        self.base_url = os.getenv('YOTO_API_BASE_URL', 'https://api.yotoplay.com')
-        self.client_id = os.getenv('YOTO_CLIENT_ID')
-        self.client_secret = os.getenv('YOTO_CLIENT_SECRET')
-        self.refresh_token = os.getenv('YOTO_REFRESH_TOKEN')
+        self.base_url = settings.YOTO_API_BASE_URL
+        self.client_id = settings.YOTO_CLIENT_ID or None
+        self.client_secret = settings.YOTO_CLIENT_SECRET or None
+        self.refresh_token = settings.YOTO_REFRESH_TOKEN or None
         self.access_token: Optional[str] = None
         self.token_expiry: Optional[datetime] = None
+        # ETag/Last-Modified of the most recent upstream response, if any
+        self.last_validators: Dict[str, str] = {}
+        # How the last cached read was served ('hit', 'stale', 'miss') and its age in seconds
+        self.cache_status: Optional[str] = None
+        self.cache_age: Optional[int] = None
+        # The registry client this one was forked from; refreshed tokens are written back to it
+        self.origin: Optional['YotoAPIClient'] = None
+    
+    def fork(self) -> 'YotoAPIClient':
+        """A per-request copy with this client's credentials and token (see api.clients)."""
+        client = copy.copy(self)
+        client.origin = self
+        client.last_validators = {}
+        client.cache_status = client.cache_age = None
+        return client
     
     def _is_token_expired(self) -> bool:
         """Check if the current access token is expired."""
@@ -28,59 +55,86 @@ class YotoAPIClient:
             return True
         return datetime.now() >= self.token_expiry
     
+    def _can_refresh(self) -> bool:
+        """Check if we hold everything needed to refresh the access token."""
+        return bool(self.refresh_token and self.client_id and self.client_secret)
+    
+    def _apply_token(self, state: TokenState):
+        """Adopt a token obtained through the shared token manager."""
+        self.access_token = state.access_token
+        self.token_expiry = state.expiry
+        if self.origin is not None:
+            self.origin._apply_token(state)
+    
+    def _adopt_managed_token(self):
+        """Switch to a newer token another request already refreshed for this account."""
+        if not self._can_refresh():
+            return
+        state = token_manager.current(self.refresh_token, self.client_id)
+        if state is not None and state.access_token != self.access_token:
+            logger.debug("Using token already refreshed for this account")
+            self._apply_token(state)
+    
     def authenticate(self) -> bool:
         """
         Authenticate with the Yoto API using refresh token.
         Returns True if authentication is successful.
+        
+        Refreshes go through the process-wide token manager, so concurrent
+        requests for the same account share a single token refresh.
         """
         if not self.client_id or not self.client_secret:
             raise ValueError("YOTO_CLIENT_ID and YOTO_CLIENT_SECRET must be set in environment variables")
         
-        url = 'https://login.yotoplay.com/oauth/token'
-        data = {
-            'grant_type': 'refresh_token',
-            'refresh_token': self.refresh_token,
-            'client_id': self.client_id,
-            'client_secret': self.client_secret,
-            'audience': 'https://api.yotoplay.com'
-        }
-        
-        try:
-            response = requests.post(url, json=data)
-            response.raise_for_status()
-            
-            token_data = response.json()
-            self.access_token = token_data.get('access_token')
-            expires_in = token_data.get('expires_in', 3600)  # Default to 1 hour
-            self.token_expiry = datetime.now() + timedelta(seconds=expires_in - 60)  # Refresh 1 min early
-            
-            return True
-        except requests.exceptions.RequestException as e:
-            print(f"Authentication failed: {e}")
+        state = token_manager.refresh(self.refresh_token, self.client_id, self.client_secret,
+                                      stale_token=self.access_token)
+        if state is None:
             return False
+        self._apply_token(state)
+        return True
     
     def _ensure_authenticated(self):
         """Ensure we have a valid access token."""
-        print(f"=== _ensure_authenticated called ===")
-        print(f"  access_token: {'present' if self.access_token else 'missing'}")
-        print(f"  refresh_token: {'present' if self.refresh_token else 'missing'}")
-        print(f"  token_expiry: {self.token_expiry}")
-        print(f"  is_expired: {self._is_token_expired()}")
-        
         # If access token is already set (e.g., from headers), don't try to refresh
         if not self.access_token:
-            print("ERROR: No access token available")
+            logger.warning("No access token available")
             raise Exception("No access token available")
         
-        print("Access token is available, proceeding...")
+        self._adopt_managed_token()
         
         # Only try to refresh if we have all the credentials and token is expired
-        if self._is_token_expired() and self.refresh_token and self.client_id and self.client_secret:
-            print("Token expired, attempting refresh...")
+        if self._is_token_expired() and self._can_refresh():
+            logger.info("Access token expired (expiry %s), refreshing", self.token_expiry)
             if not self.authenticate():
                 raise Exception("Failed to authenticate with Yoto API")
-        else:
-            print("Token not expired or no refresh credentials, skipping refresh")
+    
+    def _send(self, method: str, url: str, headers: Dict[str, str], **kwargs) -> requests.Response:
+        """
+        One upstream call, timed as the request's 'upstream' phase.
+        
+        Goes through the host's shared circuit breaker and rate limiter, and
+        raises resilience.UpstreamUnavailable instead of calling a failing host.
+        """
+        guard = resilience.guard_for(url)
+        try:
+            wait = guard.acquire()
+        except resilience.UpstreamUnavailable:
+            metrics.upstream_rejected.inc(host=guard.host)
+            raise
+        if wait:
+            time.sleep(wait)
+        try:
+            with metrics.timed('upstream'):
+                response = transport.request(method, url, headers=headers, **kwargs)
+        except BaseException:
+            # Connection errors and timeouts, but also anything unexpected: a
+            # half-open probe must always be released
+            guard.record_error()
+            raise
+        guard.record(response.status_code, response.headers.get('Retry-After'))
+        metrics.upstream_responses.inc(status=response.status_code)
+        metrics.upstream_bytes.inc(len(response.content))
+        return response
     
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict[Any, Any]:
         """
@@ -94,48 +148,50 @@ class YotoAPIClient:
         Returns:
             JSON response as dictionary
         """
-        print(f"=== _make_request called ===")
-        print(f"  method: {method}")
-        print(f"  endpoint: {endpoint}")
-        print(f"  kwargs: {kwargs}")
-        
         self._ensure_authenticated()
         
         url = f"{self.base_url}{endpoint}"
         headers = kwargs.pop('headers', {})
         headers['Authorization'] = f'Bearer {self.access_token}'
         
-        print(f"Making {method} request to: {url}")
-        print(f"Authorization header: Bearer {self.access_token[:30]}...")
-        
         try:
-            response = requests.request(method, url, headers=headers, **kwargs)
-            print(f"Response status: {response.status_code}")
+            response = self._send(method, url, headers, **kwargs)
+            logger.debug("%s %s -> %s", method, endpoint, response.status_code)
             
             # If we get a 403 and we have refresh credentials, try to refresh the token and retry
-            if response.status_code == 403 and self.refresh_token and self.client_id and self.client_secret:
-                print("Got 403, attempting to refresh token and retry...")
+            if response.status_code == 403 and self._can_refresh():
+                logger.info("Got 403 for %s %s, refreshing token and retrying", method, endpoint)
                 if self.authenticate():
-                    print("Token refreshed successfully, retrying request...")
                     headers['Authorization'] = f'Bearer {self.access_token}'
-                    response = requests.request(method, url, headers=headers, **kwargs)
-                    print(f"Retry response status: {response.status_code}")
+                    response = self._send(method, url, headers, **kwargs)
+                    logger.debug("Retry %s %s -> %s", method, endpoint, response.status_code)
                 else:
-                    print("Token refresh failed")
+                    logger.warning("Token refresh failed")
             
             response.raise_for_status()
-            result = response.json()
-            print(f"Response JSON keys: {list(result.keys()) if isinstance(result, dict) else 'not a dict'}")
-            return result
+            identity.vouch(self.access_token)
+            self.last_validators = {h: response.headers[h] for h in VALIDATOR_HEADERS if h in response.headers}
+            return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"!!! API request failed: {type(e).__name__}: {e}")
-            if hasattr(e, 'response') and e.response is not None:
-                print(f"Response body: {e.response.text[:500]}")
+            logger.warning("API request %s %s failed: %s: %s", method, endpoint, type(e).__name__, e)
+            if getattr(e, 'response', None) is not None and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response body: %s", e.response.text[:500])
             raise
     
     def get(self, endpoint: str, **kwargs) -> Dict[Any, Any]:
-        """Make a GET request to the Yoto API."""
-        return self._make_request('GET', endpoint, **kwargs)
+        """
+        Make a GET request to the Yoto API.
+        
+        Identical GETs already in flight for the same account are joined
+        rather than repeated (see api.coalesce).
+        """
+        if not settings.YOTO_COALESCE_GETS or 'headers' in kwargs:
+            return self._make_request('GET', endpoint, **kwargs)
+        
+        def call():
+            return self._make_request('GET', endpoint, **kwargs), self.last_validators
+        key = coalesce.key_for(self, endpoint, kwargs.get('params'))
+        return coalesce.shared(coalesce.coalescer.run(key, call), self)
     
     def post(self, endpoint: str, **kwargs) -> Dict[Any, Any]:
         """Make a POST request to the Yoto API."""
@@ -156,18 +212,13 @@ class YotoAPIClient:
     
     def get_players(self) -> list:
         """Get all devices (players) in the family."""
-        try:
-            print(f"Fetching devices from /device-v2/devices/mine")
-            response = self.get('/device-v2/devices/mine')
-            # Response structure: { "devices": [...] }
-            devices = response.get('devices', [])
-            if not isinstance(devices, list):
-                devices = []
-            print(f"Successfully fetched {len(devices)} devices")
-            return devices
-        except Exception as e:
-            print(f"Error fetching devices: {e}")
-            raise
+        response = self.get('/device-v2/devices/mine')
+        # Response structure: { "devices": [...] }
+        devices = response.get('devices', [])
+        if not isinstance(devices, list):
+            devices = []
+        logger.debug("Fetched %d devices", len(devices))
+        return devices
     
     def get_player(self, player_id: str) -> Dict[Any, Any]:
         """Get specific device (player) information."""
@@ -175,41 +226,21 @@ class YotoAPIClient:
     
     def get_library(self) -> list:
         """Get user's MYO content library."""
-        try:
-            print(f"Fetching library from /content/mine")
-            response = self.get('/content/mine')
-            # Response structure: { "cards": [...] }
-            cards = response.get('cards', [])
-            if not isinstance(cards, list):
-                cards = []
-            print(f"Successfully fetched {len(cards)} cards from library")
-            return cards
-        except Exception as e:
-            print(f"Error fetching library: {e}")
-            raise
+        response = self.get('/content/mine')
+        # Response structure: { "cards": [...] }
+        cards = response.get('cards', [])
+        if not isinstance(cards, list):
+            cards = []
+        logger.debug("Fetched %d cards from library", len(cards))
+        return cards
     
     def get_card(self, card_id: str, playable: bool = True) -> dict:
         """Get detailed card information including chapters."""
-        try:
-            endpoint = f'/content/{card_id}'
-            print(f"=== get_card called ===")
-            print(f"  card_id: {card_id}")
-            print(f"  playable: {playable}")
-            print(f"  endpoint: {endpoint}")
-            
-            params = {}
-            if playable:
-                params['playable'] = 'true'
-                params['signingType'] = 's3'
-            
-            print(f"  params: {params}")
-            print(f"Calling self.get('{endpoint}', params={params})")
-            
-            response = self.get(endpoint, params=params)
-            print(f"Successfully fetched card details for {card_id}")
-            return response
-        except Exception as e:
-            print(f"!!! ERROR in get_card: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            raise
+        params = {}
+        if playable:
+            params['playable'] = 'true'
+            params['signingType'] = 's3'
+        
+        response = self.get(f'/content/{card_id}', params=params)
+        logger.debug("Fetched card %s (playable=%s)", card_id, playable)
+        return response
@@ -36,6 +36,56 @@ YOTO_CLIENT_SECRET = os.getenv('YOTO_CLIENT_SECRET', '')
 YOTO_ACCESS_TOKEN = os.getenv('YOTO_ACCESS_TOKEN', '')
 YOTO_REFRESH_TOKEN = os.getenv('YOTO_REFRESH_TOKEN', '')
 
+# Join identical upstream GETs (same account, endpoint and parameters) that
+# are already in flight instead of repeating them (api.coalesce).
+YOTO_COALESCE_GETS = os.getenv('YOTO_COALESCE_GETS', 'True').lower() == 'true'
+
+# Live API clients are kept per set of credentials (api.clients) so refreshed
+# tokens survive between requests: at most YOTO_CLIENT_REGISTRY_SIZE of them,
+# each dropped after YOTO_CLIENT_IDLE_TTL seconds without a request.
+YOTO_CLIENT_REGISTRY_SIZE = int(os.getenv('YOTO_CLIENT_REGISTRY_SIZE', '1000'))
+YOTO_CLIENT_IDLE_TTL = int(os.getenv('YOTO_CLIENT_IDLE_TTL', '3600'))
+
+# Upstream endpoints. Point both at a local stand-in (`manage.py fake_yoto`)
+# to develop, test or benchmark without the real Yoto service.
+YOTO_API_BASE_URL = os.getenv('YOTO_API_BASE_URL', 'https://api.yotoplay.com').rstrip('/')
+YOTO_AUTH_BASE_URL = os.getenv('YOTO_AUTH_BASE_URL', 'https://login.yotoplay.com').rstrip('/')
+
+# Upstream HTTP transport
+# All YotoAPIClient instances share one keep-alive connection pool.
+# YOTO_HTTP_POOL_BLOCK=true caps open connections at the pool size and makes
+# extra requests wait for a free connection instead of opening throwaway ones.
+YOTO_HTTP_POOL_SIZE = int(os.getenv('YOTO_HTTP_POOL_SIZE', '20'))
+YOTO_HTTP_POOL_BLOCK = os.getenv('YOTO_HTTP_POOL_BLOCK', 'False').lower() == 'true'
+YOTO_HTTP_MAX_RETRIES = int(os.getenv('YOTO_HTTP_MAX_RETRIES', '2'))
+YOTO_HTTP_BACKOFF_FACTOR = float(os.getenv('YOTO_HTTP_BACKOFF_FACTOR', '0.3'))
+YOTO_HTTP_CONNECT_TIMEOUT = float(os.getenv('YOTO_HTTP_CONNECT_TIMEOUT', '5'))
+YOTO_HTTP_READ_TIMEOUT = float(os.getenv('YOTO_HTTP_READ_TIMEOUT', '30'))
+
+# Upstream protection (api.resilience), shared by all clients in a process.
+# After YOTO_BREAKER_FAILURES consecutive failures (5xx, 429, timeouts) calls
+# fail fast for YOTO_BREAKER_RESET seconds (or the upstream's Retry-After),
+# serving stale cached data where available. Requests are limited to
+# YOTO_RATE_LIMIT per second per host (bursts of YOTO_RATE_BURST; 0 disables),
+# waiting at most YOTO_RATE_MAX_WAIT seconds for a slot.
+YOTO_BREAKER_FAILURES = int(os.getenv('YOTO_BREAKER_FAILURES', '5'))
+YOTO_BREAKER_RESET = float(os.getenv('YOTO_BREAKER_RESET', '30'))
+YOTO_RATE_LIMIT = float(os.getenv('YOTO_RATE_LIMIT', '20'))
+YOTO_RATE_BURST = int(os.getenv('YOTO_RATE_BURST', '40'))
+YOTO_RATE_MAX_WAIT = float(os.getenv('YOTO_RATE_MAX_WAIT', '2'))
+
+# Refreshed access tokens are shared between requests for the same account and
+# renewed in the background YOTO_TOKEN_REFRESH_LEAD seconds before they expire,
+# for as long as the account has been used within YOTO_TOKEN_IDLE_TIMEOUT seconds.
+YOTO_TOKEN_REFRESH_LEAD = int(os.getenv('YOTO_TOKEN_REFRESH_LEAD', '300'))
+YOTO_TOKEN_IDLE_TIMEOUT = int(os.getenv('YOTO_TOKEN_IDLE_TIMEOUT', '1800'))
+
+# Set YOTO_ASYNC_VIEWS=true when serving through ASGI (e.g. uvicorn yoto_local.asgi:application)
+# to route the players/library/card/family endpoints to the async views,
+# which share one httpx connection pool per event loop (requires httpx).
+YOTO_ASYNC_VIEWS = os.getenv('YOTO_ASYNC_VIEWS', 'False').lower() == 'true'
+YOTO_HTTP_ASYNC_MAX_CONNECTIONS = int(os.getenv('YOTO_HTTP_ASYNC_MAX_CONNECTIONS', '200'))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -71,7 +121,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -112,6 +164,137 @@ DATABASES = {
 }
 
 
+# Caches
+# The 'yoto' cache holds upstream Yoto API responses (library, card details).
+# It defaults to an in-process LRU (locmem) bounded by YOTO_CACHE_MAX_ENTRIES;
+# point YOTO_CACHE_BACKEND/YOTO_CACHE_LOCATION at e.g.
+# django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.redis.RedisCache to share it between workers
+# (for Redis, bound memory with maxmemory + allkeys-lru on the server).
+YOTO_CACHE_BACKEND = os.getenv('YOTO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+YOTO_CACHE_LOCATION = os.getenv('YOTO_CACHE_LOCATION', 'yoto-responses')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'yoto': {
+        'BACKEND': YOTO_CACHE_BACKEND,
+        'LOCATION': YOTO_CACHE_LOCATION,
+    },
+}
+if 'redis' not in YOTO_CACHE_BACKEND:
+    CACHES['yoto']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('YOTO_CACHE_MAX_ENTRIES', '1000')),
+    }
+
+YOTO_CACHE_ALIAS = 'yoto'
+
+# Per-endpoint cache lifetimes in seconds. Playable card responses contain
+# presigned S3 track URLs, so their TTL is additionally capped to expire
+# YOTO_SIGNED_URL_MARGIN seconds before the earliest signature does.
+YOTO_CACHE_TTLS = {
+    'library': int(os.getenv('YOTO_CACHE_TTL_LIBRARY', '60')),
+    'card': int(os.getenv('YOTO_CACHE_TTL_CARD', '3600')),
+    'card_playable': int(os.getenv('YOTO_CACHE_TTL_CARD_PLAYABLE', '900')),
+    'players': int(os.getenv('YOTO_CACHE_TTL_PLAYERS', '15')),
+}
+YOTO_SIGNED_URL_MARGIN = int(os.getenv('YOTO_SIGNED_URL_MARGIN', '60'))
+# How long entries are kept past their TTL to be served while the upstream is down
+YOTO_CACHE_STALE_TTL = int(os.getenv('YOTO_CACHE_STALE_TTL', str(24 * 3600)))
+# Endpoints served stale-while-revalidate: an expired (but not yet evicted)
+# entry is returned at once, with Age and X-Cache: stale headers, while up to
+# YOTO_SWR_WORKERS background workers fetch a fresh copy for the next request
+# (at most YOTO_SWR_MAX_PENDING refreshes queued). ?refresh=1 always waits.
+YOTO_SWR_ENDPOINTS = [
+    e.strip() for e in os.getenv('YOTO_SWR_ENDPOINTS', 'library,players').split(',') if e.strip()
+]
+# How long past its TTL an entry may be served stale-while-revalidate; older
+# entries are reloaded first (and only kept for the upstream-down fallback)
+YOTO_SWR_STALE_TTL = int(os.getenv('YOTO_SWR_STALE_TTL', '300'))
+YOTO_SWR_WORKERS = int(os.getenv('YOTO_SWR_WORKERS', '2'))
+YOTO_SWR_MAX_PENDING = int(os.getenv('YOTO_SWR_MAX_PENDING', '50'))
+# How long /api/library/sync keeps each library snapshot a syncToken can
+# refer to; older tokens get a full listing again.
+YOTO_SYNC_SNAPSHOT_TTL = int(os.getenv('YOTO_SYNC_SNAPSHOT_TTL', str(30 * 24 * 3600)))
+
+# Paged /api/library/ (?limit=&cursor=&sort=): default and maximum page size,
+# and how many accounts keep an in-memory sort/filter index.
+YOTO_LIBRARY_PAGE_SIZE = int(os.getenv('YOTO_LIBRARY_PAGE_SIZE', '50'))
+YOTO_LIBRARY_MAX_PAGE_SIZE = int(os.getenv('YOTO_LIBRARY_MAX_PAGE_SIZE', '500'))
+YOTO_LIBRARY_INDEX_ACCOUNTS = int(os.getenv('YOTO_LIBRARY_INDEX_ACCOUNTS', '256'))
+
+# Full-text search (/api/search): index library listings and card details
+# into the database as they are fetched (needs `manage.py migrate`), and the
+# most results one query returns.
+YOTO_SEARCH_INDEX = os.getenv('YOTO_SEARCH_INDEX', 'True').lower() == 'true'
+YOTO_SEARCH_MAX_RESULTS = int(os.getenv('YOTO_SEARCH_MAX_RESULTS', '50'))
+
+# /api/players/stream: one upstream poll per account every
+# YOTO_PLAYER_POLL_INTERVAL seconds, shared by all of its open streams. Idle
+# streams get a keep-alive comment every YOTO_PLAYER_STREAM_KEEPALIVE seconds
+# and are closed after YOTO_PLAYER_STREAM_MAX_AGE (clients reconnect).
+YOTO_PLAYER_POLL_INTERVAL = float(os.getenv('YOTO_PLAYER_POLL_INTERVAL', '10'))
+YOTO_PLAYER_STREAM_KEEPALIVE = float(os.getenv('YOTO_PLAYER_STREAM_KEEPALIVE', '15'))
+YOTO_PLAYER_STREAM_MAX_AGE = float(os.getenv('YOTO_PLAYER_STREAM_MAX_AGE', '300'))
+
+# Response compression (api.middleware.CompressionMiddleware). zstd and brotli
+# are used when their modules are installed, otherwise gzip.
+YOTO_COMPRESSION_MIN_BYTES = int(os.getenv('YOTO_COMPRESSION_MIN_BYTES', '1024'))
+YOTO_GZIP_LEVEL = int(os.getenv('YOTO_GZIP_LEVEL', '6'))
+YOTO_BROTLI_QUALITY = int(os.getenv('YOTO_BROTLI_QUALITY', '5'))
+YOTO_ZSTD_LEVEL = int(os.getenv('YOTO_ZSTD_LEVEL', '3'))
+
+# Cache warm-up (server deployments): `manage.py warm_cache`, or set
+# YOTO_WARM_IN_PROCESS=true to run it inside the web process. Each run refreshes
+# the library and the playable URLs of the YOTO_WARM_MAX_CARDS most recently
+# opened cards, at most YOTO_WARM_INTERVAL seconds apart (sooner if URL
+# signatures would expire first). Recently opened cards are remembered for
+# YOTO_RECENT_CARDS_TTL seconds.
+YOTO_WARM_IN_PROCESS = os.getenv('YOTO_WARM_IN_PROCESS', 'False').lower() == 'true'
+YOTO_WARM_INTERVAL = int(os.getenv('YOTO_WARM_INTERVAL', '600'))
+YOTO_WARM_CONCURRENCY = int(os.getenv('YOTO_WARM_CONCURRENCY', '4'))
+YOTO_WARM_MAX_CARDS = int(os.getenv('YOTO_WARM_MAX_CARDS', '50'))
+YOTO_RECENT_CARDS_TTL = int(os.getenv('YOTO_RECENT_CARDS_TTL', str(7 * 24 * 3600)))
+
+# POST /api/cards/batch limits: card IDs accepted per request, and how many
+# upstream /content/{id} calls one batch runs in parallel.
+YOTO_BATCH_MAX_CARDS = int(os.getenv('YOTO_BATCH_MAX_CARDS', '500'))
+YOTO_BATCH_MAX_WORKERS = int(os.getenv('YOTO_BATCH_MAX_WORKERS', '8'))
+
+# Chunk size used when relaying audio through /api/card/<id>/track/<n>;
+# memory per stream stays at roughly one chunk regardless of track size.
+YOTO_STREAM_CHUNK_SIZE = int(os.getenv('YOTO_STREAM_CHUNK_SIZE', str(64 * 1024)))
+
+# Optional server-side media store for card art and chapter icons.
+# When enabled, image URLs in library/card responses are rewritten to
+# /api/media/fetch so each image is downloaded once per server, not per device.
+# Only images from YOTO_MEDIA_ALLOWED_HOSTS (and their subdomains) are fetched.
+YOTO_MEDIA_STORE_ENABLED = os.getenv('YOTO_MEDIA_STORE_ENABLED', 'False').lower() == 'true'
+YOTO_MEDIA_STORE_DIR = Path(os.getenv('YOTO_MEDIA_STORE_DIR', str(BASE_DIR / 'media_store')))
+YOTO_MEDIA_STORE_MAX_BYTES = int(os.getenv('YOTO_MEDIA_STORE_MAX_MB', '512')) * 1024 * 1024
+YOTO_MEDIA_ALLOWED_HOSTS = [
+    host.strip().lower()
+    for host in os.getenv('YOTO_MEDIA_ALLOWED_HOSTS', 'yotoplay.com,yoto.io,yoto.dev').split(',')
+    if host.strip()
+]
+
+# Cover thumbnails (/api/card/<id>/cover?width=) are snapped to one of these
+# widths so only a few variants are generated and stored (an empty list means
+# the defaults); WebP quality. Thumbnails and icon sprites need Pillow and the
+# media store.
+YOTO_THUMBNAIL_WIDTHS = [
+    int(w) for w in os.getenv('YOTO_THUMBNAIL_WIDTHS', '').split(',') if w.strip() and int(w) > 0
+] or [64, 128, 256, 512]
+YOTO_THUMBNAIL_QUALITY = int(os.getenv('YOTO_THUMBNAIL_QUALITY', '80'))
+
+# Card exports (/api/card/<id>/export): how many upcoming tracks download
+# while the current one is written, and how many chunks of
+# YOTO_STREAM_CHUNK_SIZE each may buffer ahead.
+YOTO_EXPORT_PREFETCH = int(os.getenv('YOTO_EXPORT_PREFETCH', '2'))
+YOTO_EXPORT_BUFFER_CHUNKS = int(os.getenv('YOTO_EXPORT_BUFFER_CHUNKS', '16'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -153,3 +336,37 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Logging
+# https://docs.djangoproject.com/en/5.2/topics/logging/
+# The api.* loggers emit at YOTO_LOG_LEVEL (DEBUG traces every upstream call).
+# Credentials are masked before records are queued, and a background thread
+# writes them to stderr, as text or, with YOTO_LOG_FORMAT=json, as JSON lines.
+YOTO_LOG_LEVEL = os.getenv('YOTO_LOG_LEVEL', 'INFO').upper()
+YOTO_LOG_FORMAT = os.getenv('YOTO_LOG_FORMAT', 'text').lower()
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'redact': {'()': 'api.log.RedactingFilter'},
+    },
+    'formatters': {
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+        'json': {'()': 'api.log.JsonFormatter'},
+    },
+    'handlers': {
+        'queue': {
+            'class': 'api.log.QueueLogHandler',
+            'filters': ['redact'],
+            'formatter': 'json' if YOTO_LOG_FORMAT == 'json' else 'text',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['queue'],
+            'level': YOTO_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
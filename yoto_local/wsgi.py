@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yoto_local.settings')
 
 application = get_wsgi_application()
+
+# Preload the HTML/JS pages and start the optional in-process cache
+# warm-up worker (see YOTO_WARM_IN_PROCESS)
+from api import pages, warmup  # noqa: E402
+pages.pages.preload()
+warmup.start_in_background()